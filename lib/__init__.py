@@ -1,9 +1,14 @@
 from . import (
+    cache,
     chat,
     dataset,
+    inverted_index,
+    mention_store,
     preprocessing,
+    regex_registry,
     search_terms,
     special_tokens,
     stop_words,
+    term_matcher,
     utils,
 )
@@ -0,0 +1,188 @@
+"""
+Preprocessed text with standoff annotations.
+
+Instead of writing `<SOC>`, `<EOS>` and `<INVESTIGATOR>`-style tokens into the text,
+the text is kept clean and the sentences and search term tags found in it are stored
+as offsets into it. The inline format can still be exported (and read back).
+"""
+from array import array
+from typing import Iterable, Iterator
+
+from lib import regex_registry
+
+from .special_tokens import SpecialTokens
+
+# Line boundaries, the same as `str.splitlines`
+LINE_BREAK_PATTERN = r"\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]"
+regex_registry.register(LINE_BREAK_PATTERN, name="LINE_BREAK")
+
+# Special tokens of the inline format
+SPECIAL_TOKEN_PATTERN = r"<[A-Z]{3,}>"
+regex_registry.register(SPECIAL_TOKEN_PATTERN, name="SPECIAL_TOKEN")
+
+
+class AnnotatedText:
+    """
+    The preprocessed text of a chapter (or of the text before the first chapter).
+
+    A sentence ends at a whitespace character of the text (where the inline format has
+    an `<EOS>` and a newline). As in the inline format, the text is made of lines ending
+    at a newline or at the end of a sentence: the first line is the chapter title,
+    the sentences are the lines ending at the end of a sentence, and the paragraphs
+    are separated by empty lines.
+
+    Sentence and tag spans are [start, end) offsets into the text. A sentence span starts
+    after the whitespace at the start of its line and ends right before the whitespace
+    character ending it.
+    """
+
+    def __init__(self, text: str, sentence_ends: Iterable[int], is_chapter: bool):
+        """
+        Args:
+            text (str): The clean text.
+            sentence_ends (Iterable[int]): The offsets of the whitespace characters
+                the sentences end at, in order.
+            is_chapter (bool): Whether the text starts with a chapter title.
+        """
+        self.text = text
+        self.is_chapter = is_chapter
+        self.title_end = len(text)
+
+        # Sentences
+        self.sentence_starts = array("I")
+        self.sentence_ends = array("I")
+        self.sentence_paragraphs = array("I")
+
+        # Search term tags
+        self.tags: list[str] = []
+        self.tag_ids = array("B")
+        self.tag_starts = array("I")
+        self.tag_ends = array("I")
+
+        paragraph_idx = 1
+        for line_idx, (start, end, is_sentence) in enumerate(
+            self._iter_lines(sentence_ends)
+        ):
+            if line_idx == 0:
+                self.title_end = end
+
+            while start < end and text[start].isspace():
+                start += 1
+
+            if is_sentence:
+                self.sentence_starts.append(start)
+                self.sentence_ends.append(end)
+                self.sentence_paragraphs.append(paragraph_idx)
+            elif start == end:
+                if (
+                    self.sentence_paragraphs
+                    and self.sentence_paragraphs[-1] == paragraph_idx
+                ):
+                    paragraph_idx += 1
+
+    def _iter_lines(
+        self, sentence_ends: Iterable[int]
+    ) -> Iterator[tuple[int, int, bool]]:
+        """
+        Walks the lines of the text, yielding their (start, end) offsets
+        and whether they end at the end of a sentence.
+        """
+        text = self.text
+        line_break = regex_registry.compile(LINE_BREAK_PATTERN)
+        sentence_ends = iter(sentence_ends)
+        next_sentence_end = next(sentence_ends, None)
+
+        start = 0
+        while start < len(text):
+            m = line_break.search(text, start)
+            break_start, break_end = (m.start(), m.end()) if m else (len(text), None)
+
+            # the end of a sentence only takes up its whitespace character
+            if next_sentence_end is not None and next_sentence_end <= break_start:
+                yield start, next_sentence_end, True
+                start = next_sentence_end + 1
+                next_sentence_end = next(sentence_ends, None)
+                continue
+
+            yield start, break_start, False
+            if break_end is None:
+                break
+            start = break_end
+
+    def find_tags(self, matcher):
+        """
+        Finds the search terms in the text and stores them as tags.
+
+        Args:
+            matcher (TermMatcher): The matcher of the search terms of the book.
+        """
+        tag_ids = {tag: i for i, tag in enumerate(self.tags)}
+        for start, end, tag in matcher.finditer(self.text):
+            if tag not in tag_ids:
+                tag_ids[tag] = len(self.tags)
+                self.tags.append(tag)
+            self.tag_ids.append(tag_ids[tag])
+            self.tag_starts.append(start)
+            self.tag_ends.append(end)
+
+    @property
+    def title(self) -> str:
+        return self.text[: self.title_end].strip()
+
+    def to_inline(self) -> str:
+        """
+        Exports the text in the inline format: a `<SOC>` before the chapter title,
+        an `<EOS>` and a newline in place of the whitespace ending each sentence,
+        and the tag of each search term right after it (e.g. `Holmes<INVESTIGATOR>`).
+        """
+        text = self.text
+        parts = [str(SpecialTokens.START_OF_CHAPTER)] if self.is_chapter else []
+
+        # tags and sentence ends are both in order, a tag ending at the end of
+        # a sentence goes before the `<EOS>`
+        last_end = 0
+        tag_idx = 0
+        for sentence_end in self.sentence_ends:
+            while (
+                tag_idx < len(self.tag_ends) and self.tag_ends[tag_idx] <= sentence_end
+            ):
+                tag_end = self.tag_ends[tag_idx]
+                parts.append(text[last_end:tag_end])
+                parts.append(f"<{self.tags[self.tag_ids[tag_idx]].upper()}>")
+                last_end = tag_end
+                tag_idx += 1
+            parts.append(text[last_end:sentence_end])
+            parts.append(SpecialTokens.END_OF_SENTENCE + "\n")
+            last_end = sentence_end + 1
+
+        for tag_idx in range(tag_idx, len(self.tag_ends)):
+            tag_end = self.tag_ends[tag_idx]
+            parts.append(text[last_end:tag_end])
+            parts.append(f"<{self.tags[self.tag_ids[tag_idx]].upper()}>")
+            last_end = tag_end
+        parts.append(text[last_end:])
+
+        return "".join(parts)
+
+    @classmethod
+    def from_inline(cls, text: str, is_chapter: bool) -> "AnnotatedText":
+        """
+        Reads text in the inline format (without the `<SOC>` of a chapter).
+        The whitespace the sentences ended at is read back as newlines,
+        and the search term tags are dropped (see `find_tags`).
+        """
+        parts = []
+        sentence_ends = []
+        length = 0
+        last_end = 0
+        for m in regex_registry.compile(SPECIAL_TOKEN_PATTERN).finditer(text):
+            parts.append(text[last_end : m.start()])
+            length += m.start() - last_end
+            last_end = m.end()
+            if m.group() == SpecialTokens.END_OF_SENTENCE and text.startswith(
+                "\n", last_end
+            ):
+                sentence_ends.append(length)
+        parts.append(text[last_end:])
+
+        return cls("".join(parts), sentence_ends, is_chapter)
@@ -0,0 +1,147 @@
+"""
+Persistent on-disk cache of the preprocessed text and the index built from it.
+
+The cache is stored next to the input file(s) and is keyed by the hash of the input
+together with a fingerprint of the pipeline (the version below and the source code
+of the modules involved in preprocessing and indexing), so any change to the
+search terms or the pipeline automatically invalidates it.
+
+The text of the sentences is saved in a separate file next to the cache and memory-mapped
+when the cache is loaded (see `MentionStore.map_text`). Its path is kept relative to the cache,
+so the cache and the input files can be moved together.
+
+Note: the cache is a pickle file, only load caches you created yourself.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import sys
+
+from lib import mention_store
+
+# Bump this when the format of the cache changes in a way the fingerprint can't see
+CACHE_VERSION = 1
+
+# Modules whose source code affects the preprocessed text or the index
+PIPELINE_MODULES = [
+    "lib.annotated_text",
+    "lib.dataset",
+    "lib.preprocessing",
+    "lib.regex_registry",
+    "lib.search_terms",
+    "lib.special_tokens",
+    "lib.stop_words",
+    "lib.term_matcher",
+    "lib.utils",
+    "lib.mention_store",
+    "lib.inverted_index",
+    "lib.chat.ChatBot",
+]
+
+
+def get_cache_path(input_paths: list[str]) -> str:
+    """
+    Returns the path of the cache file of a list of input files.
+    A single book is cached next to its file, a corpus in the directory of its files.
+    """
+    if len(input_paths) == 1:
+        return f"{os.path.splitext(input_paths[0])[0]}_cache.pickle"
+
+    # different sets of books in the same directory get different caches
+    corpus_hash = hashlib.sha256("\n".join(input_paths).encode()).hexdigest()[:8]
+    return os.path.join(
+        os.path.commonpath(input_paths), f"corpus_{corpus_hash}_cache.pickle"
+    )
+
+
+def get_text_path(input_paths: list[str]) -> str:
+    """
+    Returns the path of the file the text of the cached sentences is memory-mapped from.
+    """
+    return f"{os.path.splitext(get_cache_path(input_paths))[0]}.corpus"
+
+
+def pipeline_fingerprint() -> str:
+    """
+    Hashes the cache version and the source code of the pipeline modules.
+    """
+    h = hashlib.sha256(str(CACHE_VERSION).encode())
+    for name in PIPELINE_MODULES:
+        with open(sys.modules[name].__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def get_cache_key(input_paths: list[str], **params) -> str:
+    """
+    Computes the cache key of a list of input files, given the parameters used to build the index.
+    """
+    h = hashlib.sha256(pipeline_fingerprint().encode())
+    for input_path in input_paths:
+        h.update(os.path.basename(input_path).encode())
+        with open(input_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    h.update(repr(sorted(params.items())).encode())
+    return h.hexdigest()
+
+
+def load(input_paths: list[str], **params):
+    """
+    Loads the cached object of a list of input files.
+
+    Args:
+        input_paths (list[str]): Paths to the input files.
+        **params: The parameters the cached object was built with.
+
+    Returns:
+        The cached object, or None if there is no valid cache for the input.
+    """
+    cache_path = get_cache_path(input_paths)
+    if not os.path.exists(cache_path):
+        logging.debug(f"No cache found at: {cache_path}")
+        return None
+
+    try:
+        with open(cache_path, "rb") as f:
+            # the key is stored first, so a stale cache is detected without loading it all
+            if pickle.load(f) != get_cache_key(input_paths, **params):
+                logging.info("Cache is outdated, rebuilding...")
+                return None
+            with mention_store.text_directory(
+                os.path.dirname(os.path.abspath(cache_path))
+            ):
+                obj = pickle.load(f)
+    except Exception as e:
+        logging.warning(f"Failed to load cache from {cache_path}: {e}")
+        return None
+
+    logging.info(f"Loaded cache from: {cache_path}")
+    return obj
+
+
+def save(input_paths: list[str], obj, **params):
+    """
+    Saves an object to the cache of a list of input files.
+
+    Args:
+        input_paths (list[str]): Paths to the input files.
+        obj: The object to cache.
+        **params: The parameters the object was built with.
+    """
+    cache_path = get_cache_path(input_paths)
+    try:
+        # write to a temporary file first so an interrupted write never leaves a broken cache
+        with open(f"{cache_path}.tmp", "wb") as f:
+            pickle.dump(get_cache_key(input_paths, **params), f)
+            with mention_store.text_directory(
+                os.path.dirname(os.path.abspath(cache_path))
+            ):
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{cache_path}.tmp", cache_path)
+    except (OSError, pickle.PicklingError) as e:
+        logging.warning(f"Failed to save cache to {cache_path}: {e}")
+        return
+
+    logging.debug(f"Saved cache to: {cache_path}")
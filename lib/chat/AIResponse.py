@@ -1,7 +1,7 @@
 import random
 import re
 
-from lib import utils
+from lib import regex_registry, utils
 
 response_phrase_alts = [
     ["hello!", "hi!", "hey!", "hey there!", "howdy!"],
@@ -24,6 +24,95 @@ response_phrase_alts = [
 
 response_phrase_permutation_map = utils.create_permutation_map(response_phrase_alts)
 
+# All the phrases in a single alternation, the longest ones first so the longest one
+# wins where several match (e.g. "I'm sorry" over "I'm"). The lookahead on the first
+# letters of the phrases skips most words without trying every alternative on them.
+_synonyms = sorted(response_phrase_permutation_map, key=lambda s: (-len(s), s))
+SYNONYMS_PATTERN = r"\b(?=[{first}])(?:{rgx})\b".format(
+    first="".join(sorted({re.escape(s[0]) for s in _synonyms})),
+    rgx="|".join(map(re.escape, _synonyms)),
+)
+regex_registry.register(SYNONYMS_PATTERN, re.IGNORECASE, name="SYNONYMS")
+
+# Random generator used to render the responses, see `AIResponse.seed`
+_rng = random.Random()
+
+
+class Choice:
+    """
+    A slot of a compiled response picking one of its alternatives at random.
+    Each alternative is a literal, a sequence of slots, or None for nothing at all.
+    """
+
+    __slots__ = ("alternatives",)
+
+    def __init__(self, alternatives: list[tuple | None]):
+        self.alternatives = alternatives
+
+
+class Join:
+    """
+    A slot of a compiled response joining the alternatives picked by its choices,
+    skipping the ones that pick nothing.
+    Only needed when none of the parts of a response is always rendered, otherwise
+    the separators are known at compile time and folded into the literals around them.
+    """
+
+    __slots__ = ("join", "choices")
+
+    def __init__(self, join: str, choices: list[Choice]):
+        self.join = join
+        self.choices = choices
+
+
+def _flush_literals(literals: list[str], slots: list):
+    """
+    Merges a run of literals into a single slot.
+    """
+    if literal := "".join(literals):
+        slots.append(literal)
+    literals.clear()
+
+
+def _splice(template: tuple, literals: list[str], slots: list):
+    """
+    Appends the slots of a compiled message to a sequence of slots and the literals after them.
+    """
+    for slot in template:
+        if slot.__class__ is str:
+            literals.append(slot)
+        else:
+            _flush_literals(literals, slots)
+            slots.append(slot)
+
+
+def _render(slots: tuple, out: list[str], rng: random.Random):
+    """
+    Renders a sequence of slots into a list of strings.
+    """
+    for slot in slots:
+        if slot.__class__ is str:
+            out.append(slot)
+        elif slot.__class__ is Choice:
+            alternative = rng.choice(slot.alternatives)
+            if alternative.__class__ is str:
+                out.append(alternative)
+            elif alternative is not None:
+                _render(alternative, out, rng)
+        else:
+            first = True
+            for choice in slot.choices:
+                alternative = rng.choice(choice.alternatives)
+                if alternative is None:
+                    continue
+                if not first:
+                    out.append(slot.join)
+                if alternative.__class__ is str:
+                    out.append(alternative)
+                else:
+                    _render(alternative, out, rng)
+                first = False
+
 
 class AIResponse:
     """
@@ -49,38 +138,151 @@ class AIResponse:
     msg2: Hello.
     msg3: Hello. How are you doing?
     ```
+
+    The message is compiled (once) into a flat sequence of literals and choices
+    (see `compile`), so rendering it is a single pass with a single join at the end.
     """
 
     def __init__(self, *msg_parts, join: str = " ", fn=None):
         self.msg_parts = msg_parts
         self.join: str = join
         self.fn = fn
+        self.template: tuple | None = None
 
     def __str__(self) -> str:
-        parts = []
-        for p in self.msg_parts:
+        return self.render()
+
+    def render(self, rng: random.Random | None = None) -> str:
+        """
+        Renders the message, making the random choices with the given random generator
+        (by default, the one seeded with `AIResponse.seed`).
+        """
+        template = self.compile()
+        # the messages without choices are compiled into a single literal
+        if len(template) == 1 and template[0].__class__ is str:
+            return template[0]
+
+        out = []
+        _render(template, out, rng or _rng)
+        return "".join(out)
+
+    @staticmethod
+    def seed(a=None):
+        """
+        Seeds the random generator the messages (and their variations) are rendered with.
+        """
+        _rng.seed(a)
+
+    @staticmethod
+    def sample(population: list, k: int) -> list:
+        """
+        Picks `k` distinct elements at random, with the same random generator as the messages.
+        """
+        return _rng.sample(population, k)
+
+    def compile(self) -> tuple:
+        """
+        Compiles the message into a flat sequence of slots: literals (str), and choices
+        between alternatives that are themselves compiled (see `Choice`).
+        The separators between the parts are folded into the literals around them.
+        The nested messages are flattened into it, and keep their own compiled slots,
+        so a message shared by many responses is only compiled once.
+
+        The choices are made in the same order as when walking the parts recursively,
+        so a message renders the same either way for the same random state.
+
+        Returns:
+            tuple: The slots of the message.
+        """
+        if self.template is not None:
+            return self.template
+
+        # the slots so far, and the literals after them, to be merged
+        slots = []
+        literals = []
+
+        # the first part that is always rendered (the ones that may be skipped are choices)
+        first = None
+        for i, p in enumerate(self.msg_parts):
+            if all(p) if isinstance(p, list) else p:
+                first = i
+                break
+
+        if first is None:
+            parts = [i for i, p in enumerate(self.msg_parts) if p]
+            if len(parts) > 1:
+                # which parts are rendered, and so where the separators go, is only known when rendering
+                self.template = (
+                    Join(
+                        self.join,
+                        [self._compile_choice(self.msg_parts[i]) for i in parts],
+                    ),
+                )
+                return self.template
+            # a single part, with no separator around it
+            first = parts[0] if parts else 0
+
+        # the parts before the first one that is always rendered are followed by
+        # a separator, and the parts after it are preceded by one
+        join = self.join
+        for i, p in enumerate(self.msg_parts):
             if isinstance(p, str):
                 # Skip anything that evaluates to False like empty strings, None, etc.
                 if not p:
                     continue
-                parts.append(p)
+                if i > first:
+                    literals.append(join)
+                literals.append(p)
+                if i < first:
+                    literals.append(join)
             elif isinstance(p, list):
-                # Skip anything that evaluates to False like empty strings, None, etc.
-                rnd_msg = random.choice(p)
-                if not rnd_msg:
-                    continue
-                parts.append(str(rnd_msg))
+                _flush_literals(literals, slots)
+                slots.append(
+                    self._compile_choice(
+                        p, join if i > first else "", join if i < first else ""
+                    )
+                )
             elif isinstance(p, self.__class__):
-                parts.append(str(p))
+                # the nested messages are flattened into this one
+                if i > first:
+                    literals.append(join)
+                _splice(p.compile(), literals, slots)
+                if i < first:
+                    literals.append(join)
             else:
                 raise TypeError(f"Invalid type: {type(p)}")
 
-        return self.join.join(parts)
+        _flush_literals(literals, slots)
+        self.template = tuple(slots)
+        return self.template
+
+    def _compile_choice(self, alternatives: list, before: str = "", after: str = ""):
+        """
+        Compiles a part that is a list of alternatives, with the separators around it.
+        """
+        compiled = []
+        for alt in alternatives:
+            # Skip anything that evaluates to False like empty strings, None, etc.
+            if not alt:
+                compiled.append(None)
+            elif isinstance(alt, self.__class__):
+                if not before and not after:
+                    compiled.append(alt.compile())
+                    continue
+                literals, slots = [before], []
+                _splice(alt.compile(), literals, slots)
+                literals.append(after)
+                _flush_literals(literals, slots)
+                compiled.append(tuple(slots))
+            else:
+                compiled.append(f"{before}{alt}{after}")
+        return Choice(compiled)
 
     @staticmethod
     def create_variation(text: str) -> str:
         """
         Replaces words in the input text with synonyms from a predefined list of alternatives.
+        All the phrases are replaced in a single pass over the text.
 
         Args:
             text (str): The input text to be modified.
@@ -88,54 +290,55 @@ class AIResponse:
         Returns:
             str: The modified text with replaced synonyms.
         """
-        for synonym, synonym_list in response_phrase_permutation_map.items():
-
-            def get_replacement(match):
-                """
-                Returns a random synonym for the matched word in the input string.
-
-                Args:
-                    match (re.Match): A match object containing the word to be replaced.
-
-                Returns:
-                    str: A randomly chosen synonym for the matched word, with the same casing as the original word.
-                """
-                original = match.group(0)
-
-                rnd_synonym = random.choice(synonym_list)
-
-                # Preserve the original casing
-                # if original.islower():
-                #     rnd_synonym = rnd_synonym.lower()
-                # elif original.isupper():
-                #     rnd_synonym = rnd_synonym.upper()
-                # elif original.istitle():
-                #     rnd_synonym = rnd_synonym.title()
-
-                # if the synonym picked can be split into words preserve the original casing of the first word
-                if " " in rnd_synonym:
-                    rnd_synonym = rnd_synonym.split(" ")
-                    if original.islower():
-                        rnd_synonym[0] = rnd_synonym[0].lower()
-                    elif original.isupper():
-                        rnd_synonym[0] = rnd_synonym[0].upper()
-                    elif original.istitle():
-                        rnd_synonym[0] = rnd_synonym[0].title()
-                    rnd_synonym = " ".join(rnd_synonym)
-                else:
-                    if original.islower():
-                        rnd_synonym = rnd_synonym.lower()
-                    elif original.isupper():
-                        rnd_synonym = rnd_synonym.upper()
-                    elif original.istitle():
-                        rnd_synonym = rnd_synonym.title()
-
-                return rnd_synonym
-
-            text = re.sub(
-                r"\b" + synonym + r"\b",
-                get_replacement,
-                text,
-                flags=re.IGNORECASE,
-            )
-        return text
+
+        def get_replacement(match):
+            """
+            Returns a random synonym for the matched word in the input string.
+
+            Args:
+                match (re.Match): A match object containing the word to be replaced.
+
+            Returns:
+                str: A randomly chosen synonym for the matched word, with the same casing as the original word.
+            """
+            original = match.group(0)
+
+            # the phrases are in lower case, casefold also covers the few characters
+            # `re` matches regardless of case but `lower` doesn't map (like "ſ")
+            synonym_list = response_phrase_permutation_map.get(original.casefold())
+            if synonym_list is None:
+                return original
+
+            rnd_synonym = _rng.choice(synonym_list)
+
+            # Preserve the original casing
+            # if original.islower():
+            #     rnd_synonym = rnd_synonym.lower()
+            # elif original.isupper():
+            #     rnd_synonym = rnd_synonym.upper()
+            # elif original.istitle():
+            #     rnd_synonym = rnd_synonym.title()
+
+            # if the synonym picked can be split into words preserve the original casing of the first word
+            if " " in rnd_synonym:
+                rnd_synonym = rnd_synonym.split(" ")
+                if original.islower():
+                    rnd_synonym[0] = rnd_synonym[0].lower()
+                elif original.isupper():
+                    rnd_synonym[0] = rnd_synonym[0].upper()
+                elif original.istitle():
+                    rnd_synonym[0] = rnd_synonym[0].title()
+                rnd_synonym = " ".join(rnd_synonym)
+            else:
+                if original.islower():
+                    rnd_synonym = rnd_synonym.lower()
+                elif original.isupper():
+                    rnd_synonym = rnd_synonym.upper()
+                elif original.istitle():
+                    rnd_synonym = rnd_synonym.title()
+
+            return rnd_synonym
+
+        return regex_registry.compile(SYNONYMS_PATTERN, re.IGNORECASE).sub(
+            get_replacement, text
+        )
@@ -1,15 +1,28 @@
+import concurrent.futures
+import copy
+import functools
 import logging
-import random
 import re
 import string
 import sys
 from enum import Enum
-from pprint import pformat
-
-from lib import preprocessing, search_terms, special_tokens, utils
+from typing import Iterable, Iterator
+
+from lib import (
+    dataset,
+    inverted_index,
+    mention_store,
+    preprocessing,
+    regex_registry,
+    search_terms,
+    special_tokens,
+    utils,
+)
+from lib.annotated_text import AnnotatedText
 
 from . import AIResponse
 from .example_prompts import samples
+from .IntentRouter import Intent, IntentRouter, TermLayout
 
 
 class RegexPatterns(str, Enum):
@@ -30,167 +43,534 @@ class RegexPatterns(str, Enum):
         r"^(hi|hello|hey|howdy|greetings|salutations|sup|yo|what's up|what up|wassup)$"
     )
 
+    # Handling patterns across the books of the corpus
+    PATTERNS = r".*\b(pattern(s)?|compare|comparison|plot structure(s)?)\b.*"
+
+    # Trigger words of the analysis queries, the search terms are found separately
+    # and go before or after them (see `IntentRouter`)
+
     # Handling first mention queries
-    FIRST_MENTION_V1 = r".*({rgx}).*(?P<term>{terms}).*".format(
-        rgx=r"(first|initial(ly)?) (meet|appear(s)?|introduce(d)?|enter(s)?|mention(s)?|brought( up)?|disclosed|reveal(s)?|refer(s)?|talk(s)?|hear|time|bring)( possible)?",
-        terms=utils.re_union(
-            *[
-                p
-                for p in search_terms.build_pattern_map(
-                    search_terms.all_query_terms
-                ).values()
-            ]
-        ),
-    )
-    FIRST_MENTION_V2 = r".*(?P<term>{terms}).*({rgx}).*".format(
-        rgx=r"(first|initial(ly)?) (meet|appear(s)?|introduce(d)?|enter(s)?|mention(s)?|brought( up)?|disclosed|reveal(s)?|refer(s)?|talk(s)?|hear|time|bring)",
-        terms=utils.re_union(
-            *[
-                p
-                for p in search_terms.build_pattern_map(
-                    search_terms.all_query_terms
-                ).values()
-            ]
-        ),
-    )
+    FIRST_MENTION = r"(first|initial(ly)?) (meet|appear(s)?|introduce(d)?|enter(s)?|mention(s)?|brought( up)?|disclosed|reveal(s)?|refer(s)?|talk(s)?|hear|time|bring)"
 
     # Handling words around queries
-    WORDS_AROUND_V1 = r".*({rgx}).*(?P<term>{terms}).*".format(
-        rgx=r"surround|accompany|before after|around|near|close to",
-        terms=utils.re_union(
-            *[
-                p
-                for p in search_terms.build_pattern_map(
-                    search_terms.all_query_terms
-                ).values()
-            ]
-        ),
-    )
-
-    WORDS_AROUND_V2 = r".*(?P<term>{terms}).*({rgx}).*".format(
-        rgx=r"surround|accompany|before after|around|near|close to",
-        terms=utils.re_union(
-            *[
-                p
-                for p in search_terms.build_pattern_map(
-                    search_terms.all_query_terms
-                ).values()
-            ]
-        ),
-    )
+    WORDS_AROUND = r"surround|accompany|before after|around|near|close to"
 
     # Handling co-occurance queries
-    WORDS_COOCCUR_V1 = r".*({rgx}).*(?P<term1>{terms}) (?P<term2>{terms}).*".format(
-        rgx=r"co[- ]?occur|appear same sentence|both mentioned",
-        terms=utils.re_union(
-            *[
-                p
-                for p in search_terms.build_pattern_map(
-                    search_terms.all_query_terms
-                ).values()
-            ]
-        ),
-    )
+    WORDS_COOCCUR = r"co[- ]?occur|appear same sentence|both mentioned"
 
-    WORDS_COOCCUR_V2 = r".*(?P<term1>{terms}) (?P<term2>{terms}).*({rgx}).*".format(
-        rgx=r"co[- ]?occur|appear same sentence|both mentioned",
-        terms=utils.re_union(
-            *[
-                p
-                for p in search_terms.build_pattern_map(
-                    search_terms.all_query_terms
-                ).values()
-            ]
-        ),
+    # Handling windowed co-occurance queries
+    # (within a number of sentences, in the same paragraph or in the same chapter)
+    WORDS_COOCCUR_WINDOW = (
+        r"within (?P<num>\d+) sentence(s)?|same (?P<scope>paragraph|chapter)"
     )
 
     def __str__(self):
         return self.value
 
 
+# Parts of the responses repeated for every mention, compiled once
+NEXT_RESPONSE = AIResponse(["Next,", "Also,"])
+WORDS_ARE_RESPONSE = AIResponse(
+    [
+        "the words are:",
+        AIResponse(["we see:", "we have:"]),
+        "they are:",
+    ]
+)
+
+
+# Keyword-in-context entry of a mention: the (first, last) words of each part
+# of the sentence around the matched term
+Context = tuple[tuple[tuple[str, ...], tuple[str, ...]], ...]
+
+
+def build_context(sentence: str, matched_term: str, words_around: int) -> Context:
+    """
+    Builds the keyword-in-context entry of a mention.
+    The sentence is split by the matched term, which allows us to get the words
+    at the boundaries. For each part we keep the first and last `words_around`
+    content words (no stopwords, punctuation or extra whitespace).
+    """
+    context = []
+
+    for sentence_part in sentence.split(matched_term):
+        words = list(preprocessing.iter_content_words(sentence_part))
+        context.append((tuple(words[:words_around]), tuple(words[-words_around:])))
+
+    return tuple(context)
+
+
+def read_chapters(
+    data: str | Iterable[str | AnnotatedText],
+    query_terms: dict[str, list] | None = None,
+) -> Iterator[AnnotatedText]:
+    """
+    Reads the chapters of the preprocessed text data (the text before the first chapter is skipped).
+    Text in the inline format is split into chapters and read back as annotated text.
+
+    Args:
+        data (str | Iterable[str | AnnotatedText]): The preprocessed text, whole or split by chapter.
+        query_terms (dict[str, list] | None): The search terms the text was tagged with.
+
+    Returns:
+        Iterator[AnnotatedText]: The chapters, as they arrive.
+    """
+    for part in [data] if isinstance(data, str) else data:
+        if isinstance(part, AnnotatedText):
+            if part.is_chapter:
+                yield part
+            continue
+
+        # The inline tags don't say where the terms start, so they are found again
+        matcher = search_terms.compile_term_matcher(
+            query_terms or search_terms.book_query_terms
+        )
+        for chapter in part.split(special_tokens.SpecialTokens.START_OF_CHAPTER)[1:]:
+            chapter = AnnotatedText.from_inline(chapter, is_chapter=True)
+            chapter.find_tags(matcher)
+            yield chapter
+
+
+def parse_chapter(
+    chapter: AnnotatedText, words_around: int
+) -> tuple[str, list[tuple[str, int, list[tuple[str, str, int, int, Context]]]]]:
+    """
+    Parses the preprocessed text of a chapter, walking its sentence and tag offsets.
+    This only depends on the chapter itself, so the chapters can be parsed in parallel.
+
+    Args:
+        chapter (AnnotatedText): The preprocessed text of the chapter.
+        words_around (int): The number of context words kept around each mention.
+
+    Returns:
+        tuple: The chapter title, and for each sentence its text, its paragraph index
+            and its (tag, matched_term, start, end, context) mentions.
+    """
+    text = chapter.text
+    tag_starts, tag_ends = chapter.tag_starts, chapter.tag_ends
+
+    parsed_sentences = []
+    tag_idx = 0
+    for sentence_start, sentence_end, paragraph_idx in zip(
+        chapter.sentence_starts, chapter.sentence_ends, chapter.sentence_paragraphs
+    ):
+        sentence = text[sentence_start:sentence_end]
+        mentions = []
+        parsed_sentences.append((sentence, paragraph_idx, mentions))
+
+        # Tags are in order, so the ones of the sentence follow the ones of the previous sentences
+        while tag_idx < len(tag_starts) and tag_starts[tag_idx] < sentence_start:
+            tag_idx += 1
+
+        # We keep the first match of every tag in the sentence
+        first_matches = {}
+        while tag_idx < len(tag_starts) and tag_starts[tag_idx] < sentence_end:
+            if tag_ends[tag_idx] <= sentence_end:
+                tag = chapter.tags[chapter.tag_ids[tag_idx]]
+                first_matches.setdefault(
+                    tag,
+                    (
+                        tag_starts[tag_idx] - sentence_start,
+                        tag_ends[tag_idx] - sentence_start,
+                    ),
+                )
+            tag_idx += 1
+
+        for tag, (start, end) in first_matches.items():
+            matched_term = sentence[start:end]
+            context = build_context(sentence, matched_term, words_around)
+            mentions.append((tag.lower(), matched_term, start, end, context))
+
+    return chapter.title, parsed_sentences
+
+
+def preprocess_and_parse_chapter(
+    text: str, query_terms: dict[str, list] | None, words_around: int
+) -> tuple[str, list] | None:
+    """
+    Preprocesses the raw text of a chapter and parses it (see `dataset.preprocess_chapter`
+    and `parse_chapter`), so that a chapter is a single task when run on a process pool.
+
+    Returns:
+        tuple[str, list] | None: The parsed chapter, or None for the text before the first chapter.
+    """
+    chapter = dataset.preprocess_chapter(text, query_terms)
+    if not chapter.is_chapter:
+        return None
+    return parse_chapter(chapter, words_around)
+
+
 class ChatBot:
     """
     This class defines the chatbot and its capabilities.
     The chatbot is initialized with the preprocessed text data.
     It then builds a data structure to store various information
     to be used for analysis queries.
+
+    The data is either the annotated chapters yielded by `dataset.preprocess_lines`,
+    or the preprocessed text in the inline format (whole, or split right before each
+    chapter delimiter). The chapters are indexed as they arrive.
+    The chapters can also be parsed in parallel on an executor (e.g. a process pool),
+    and the raw text preprocessed along with them (see `build_data_map_from_lines`).
+
+    Several books can be loaded into the same index (a corpus), by calling
+    `build_data_map` (or `build_data_map_from_lines`) for each of them. Analysis queries are then answered for
+    each book, or for the books whose title or author is mentioned in the query.
     """
 
-    def __init__(self, data: str):
-        self.data = data
-        self.data_map = {}
-        self.build_data_map()
-
-        # Maps regex patterns to functions that generate responses
-        self.capabilities = {
-            # Special Commands
-            RegexPatterns.QUIT: self.cmd_quit,
-            RegexPatterns.HELP: self.cmd_help,
-            RegexPatterns.EXAMPLE: self.cmd_example,
-            # Analysis Capabilities
-            RegexPatterns.FIRST_MENTION_V1: self.get_first_mention,
-            RegexPatterns.FIRST_MENTION_V2: self.get_first_mention,
-            RegexPatterns.WORDS_AROUND_V1: self.get_words_around,
-            RegexPatterns.WORDS_AROUND_V2: self.get_words_around,
-            RegexPatterns.WORDS_COOCCUR_V1: self.get_cooccurance,
-            RegexPatterns.WORDS_COOCCUR_V2: self.get_cooccurance,
-            # Misc
-            RegexPatterns.GREET: self.greet,
+    def __init__(
+        self,
+        data: str | Iterable[str | AnnotatedText] | None = None,
+        words_around: int = 3,
+        executor: concurrent.futures.Executor | None = None,
+        time_budget: float | None = None,
+    ):
+        # number of context words kept before and after each mention
+        self.words_around = max(words_around, 1)
+        # time (in seconds) allowed to answer a user message, None for no limit
+        self.time_budget = time_budget
+        self.store = mention_store.MentionStore()
+        self.index = inverted_index.InvertedIndex(self.store)
+        self.aliases = inverted_index.AliasTable({})
+        # the aliases of the tags in each book alone, see `for_book`
+        self.book_aliases: list[inverted_index.AliasTable] = []
+        # keyword-in-context index: for each mention id, the (first, last) words
+        # of each part of the sentence around the matched term
+        self.kwic: list[Context] = []
+        if data is not None:
+            self.build_data_map(data, executor)
+        self.build_capabilities()
+
+    def __getstate__(self) -> dict:
+        # the capabilities hold bound methods, they are rebuilt when unpickling
+        state = self.__dict__.copy()
+        del state["router"]
+        del state["book_capabilities"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.build_capabilities()
+
+    def build_capabilities(self):
+        """
+        Maps regex patterns to functions that generate responses.
+        The first pattern that matches the user message is used to generate the response.
+        """
+        self.router = IntentRouter(search_terms.all_query_terms)
+        add = self.router.add
+
+        # Special Commands
+        add("QUIT", RegexPatterns.QUIT, self.cmd_quit)
+        add("HELP", RegexPatterns.HELP, self.cmd_help)
+        add("EXAMPLE", RegexPatterns.EXAMPLE, self.cmd_example)
+        # Analysis Capabilities
+        add("PATTERNS", RegexPatterns.PATTERNS, self.get_patterns)
+        add(
+            "FIRST_MENTION_V1",
+            RegexPatterns.FIRST_MENTION,
+            self.get_first_mention,
+            TermLayout.TERM_AFTER,
+        )
+        add(
+            "FIRST_MENTION_V2",
+            RegexPatterns.FIRST_MENTION,
+            self.get_first_mention,
+            TermLayout.TERM_BEFORE,
+        )
+        add(
+            "WORDS_AROUND_V1",
+            RegexPatterns.WORDS_AROUND,
+            self.get_words_around,
+            TermLayout.TERM_AFTER,
+        )
+        add(
+            "WORDS_AROUND_V2",
+            RegexPatterns.WORDS_AROUND,
+            self.get_words_around,
+            TermLayout.TERM_BEFORE,
+        )
+        add(
+            "WORDS_COOCCUR_WINDOW_V1",
+            RegexPatterns.WORDS_COOCCUR_WINDOW,
+            self.get_cooccurance_window,
+            TermLayout.PAIR_BEFORE,
+        )
+        add(
+            "WORDS_COOCCUR_WINDOW_V2",
+            RegexPatterns.WORDS_COOCCUR_WINDOW,
+            self.get_cooccurance_window,
+            TermLayout.PAIR_AFTER,
+        )
+        add(
+            "WORDS_COOCCUR_V1",
+            RegexPatterns.WORDS_COOCCUR,
+            self.get_cooccurance,
+            TermLayout.PAIR_AFTER,
+        )
+        add(
+            "WORDS_COOCCUR_V2",
+            RegexPatterns.WORDS_COOCCUR,
+            self.get_cooccurance,
+            TermLayout.PAIR_BEFORE,
+        )
+        # Misc
+        add("GREET", RegexPatterns.GREET, self.greet)
+
+        # Analysis capabilities answered separately for each book of a corpus
+        self.book_capabilities = {
+            self.get_first_mention,
+            self.get_words_around,
+            self.get_cooccurance_window,
+            self.get_cooccurance,
         }
 
-    def build_data_map(self):
+    def build_data_map(
+        self,
+        data: str | Iterable[str | AnnotatedText],
+        executor: concurrent.futures.Executor | None = None,
+        name: str = "",
+        title: str = "",
+        author: str = "",
+        query_terms: dict[str, list] | None = None,
+    ):
         """
-        Parses the preprocessed text data and stores various information
+        Parses the preprocessed text data of a book and stores various information
         for easy lookup later when answering analysis queries.
+
+        Args:
+            data (str | Iterable[str | AnnotatedText]): The preprocessed text, whole or split by chapter.
+            executor (Executor | None): The executor to parse the chapters on, if any.
+            name (str): The name of the book (see `search_terms.get_book_name`).
+            title (str): The title of the book.
+            author (str): The author of the book.
+            query_terms (dict[str, list] | None): The search terms the book was tagged with.
         """
-        # Split the text into chapters
-        chapters = self.data.split(special_tokens.SpecialTokens.START_OF_CHAPTER)[1:]
+        self.store.add_book(name, title or name, author)
+
+        chapters = read_chapters(data, query_terms)
+
+        # The chapters are parsed independently (in parallel if there is an executor),
+        # and merged in order, so the result doesn't depend on how they were parsed
+        parse = functools.partial(parse_chapter, words_around=self.words_around)
+        self.add_chapters(utils.ordered_map(parse, chapters, executor))
+
+    def build_data_map_from_lines(
+        self,
+        lines: Iterable[str],
+        executor: concurrent.futures.Executor | None = None,
+        name: str = "",
+        title: str = "",
+        author: str = "",
+        query_terms: dict[str, list] | None = None,
+    ):
+        """
+        Preprocesses, parses and stores the raw text of a book, like `build_data_map`
+        does for the preprocessed text. Each chapter is preprocessed and parsed in a single
+        task of the executor, so only the parsed chapter comes back from the worker.
+
+        Args:
+            lines (Iterable[str]): The lines of the raw text, without the line endings.
+            executor (Executor | None): The executor to process the chapters on, if any.
+            name (str): The name of the book (see `search_terms.get_book_name`).
+            title (str): The title of the book.
+            author (str): The author of the book.
+            query_terms (dict[str, list] | None): The search terms to tag the book with.
+        """
+        self.store.add_book(name, title or name, author)
 
-        # Iterate through the chapters to populate the data structure
-        for chapter_idx, chapter in enumerate(chapters):
-            # Split the chapter into lines
-            lines = chapter.splitlines()
+        process = functools.partial(
+            preprocess_and_parse_chapter,
+            query_terms=query_terms,
+            words_around=self.words_around,
+        )
+        self.add_chapters(
+            parsed
+            for parsed in dataset.map_chapters(process, lines, executor)
+            if parsed is not None
+        )
 
-            # The first line should be the chapter title
-            chapter_title = lines[0].strip()
+    def add_chapters(self, parsed_chapters: Iterable[tuple[str, list]]):
+        """
+        Stores and indexes the parsed chapters of the last book added (see `parse_chapter`).
+        """
+        for chapter_title, sentences in parsed_chapters:
+            self.store.add_chapter(chapter_title)
+
+            for sentence, paragraph_idx, mentions in sentences:
+                sentence_id = self.store.add_sentence(sentence, paragraph_idx)
+
+                for tag, matched_term, start, end, context in mentions:
+                    mention_id = self.store.add_mention(sentence_id, start, end)
+                    self.index.add(tag, matched_term, mention_id)
+                    # the context words are interned, they repeat a lot across mentions
+                    self.kwic.append(
+                        tuple(
+                            (
+                                tuple(map(sys.intern, first)),
+                                tuple(map(sys.intern, last)),
+                            )
+                            for first, last in context
+                        )
+                    )
 
-            # Extract sentences based on <EOS> at the end of lines
-            sentences = [
-                line.strip()
-                for line in lines
-                if line.strip().endswith(special_tokens.SpecialTokens.END_OF_SENTENCE)
-            ]
+        # The aliases of each tag are the tag itself and all the terms it was matched as
+        # (in any of the books), and the book gets its own, so that the answers about it
+        # don't resolve the names of the characters of the other books
+        self.aliases = self.build_aliases(self.index)
+        self.book_aliases.append(
+            self.build_aliases(
+                self.index.restrict(
+                    self.store.book_mentions(len(self.store.book_names) - 1)
+                )
+            )
+        )
 
-            # Iterate through the sentences and look for regex matches
-            for sentence_idx, sentence in enumerate(sentences):
-                for tag, pattern in search_terms.build_pattern_map(
-                    search_terms.book_query_terms
-                ).items():
-                    tag = tag.lower()
-
-                    if match := re.search(pattern, sentence):
-                        occurance = {
-                            "matched_term": match.group(),
-                            "sentence": special_tokens.remove_special_tokens(
-                                sentence,
-                            ),
-                            "sentence_idx": sentence_idx + 1,
-                            "chapter_idx": chapter_idx + 1,
-                            "chapter_title": special_tokens.remove_special_tokens(
-                                chapter_title
-                            ),
-                        }
-
-                        if tag not in self.data_map:
-                            self.data_map[tag] = {
-                                "matched_terms": [tag],
-                                "mentions": [],
-                            }
-
-                        self.data_map[tag]["matched_terms"] = list(
-                            set([match.group()] + self.data_map[tag]["matched_terms"])
-                        )
-                        self.data_map[tag]["mentions"].append(occurance)
+    @staticmethod
+    def build_aliases(index: inverted_index.InvertedIndex) -> inverted_index.AliasTable:
+        """
+        Builds the alias table of the tags of an index: the tag itself and all the terms
+        it was matched as, the tags being prioritized in the order they are defined
+        in the search terms.
+        """
+        return inverted_index.AliasTable(
+            {
+                tag: [tag, *index.terms(tag)]
+                for tag in search_terms.book_query_terms
+                if tag in index
+            }
+        )
+
+    def get_mention(self, posting: inverted_index.Posting) -> dict:
+        """
+        Looks up the details of a mention from its posting in the index.
+        """
+        chapter_idx, sentence_idx, start, end = posting
+        sentence = self.store.sentence(chapter_idx, sentence_idx)
+
+        return {
+            "matched_term": sentence[start:end],
+            "sentence": sentence,
+            "sentence_idx": sentence_idx,
+            "chapter_idx": chapter_idx,
+            "chapter_title": self.store.chapter_titles[chapter_idx - 1],
+        }
+
+    def paragraph_key(self, posting: inverted_index.Posting) -> tuple[tuple, int]:
+        """
+        Windowed merge key grouping the postings by paragraph.
+        """
+        chapter_idx, sentence_idx, _, _ = posting
+        return (chapter_idx, self.store.paragraph(chapter_idx, sentence_idx)), 0
+
+    @staticmethod
+    def chapter_key(posting: inverted_index.Posting) -> tuple[int, int]:
+        """
+        Windowed merge key grouping the postings by chapter.
+        """
+        return posting[0], 0
+
+    def find_cooccurrences(
+        self, term1: str, term2: str, window: int = 0, scope: str = "sentence"
+    ) -> list[tuple[dict, dict]] | None:
+        """
+        Finds the mentions of `term1` that have a mention of `term2` nearby.
+        Each mention of `term1` is paired with the nearest mention of `term2`.
+
+        Args:
+            term1 (str): The first term.
+            term2 (str): The second term.
+            window (int): For the "sentence" scope, the maximum number of sentences between the mentions.
+            scope (str): One of "sentence", "paragraph" or "chapter".
+
+        Returns:
+            list[tuple[dict, dict]] | None: The pairs of mentions, or None if a term can't be found.
+        """
+        tag1, tag2 = self.find_term_tag(term1), self.find_term_tag(term2)
+        if tag1 is None or tag2 is None:
+            return None
+
+        if scope == "sentence":
+            key = inverted_index.sentence_key
+        elif scope == "paragraph":
+            key, window = self.paragraph_key, 0
+        elif scope == "chapter":
+            key, window = self.chapter_key, 0
+        else:
+            raise ValueError(f"Invalid co-occurrence scope: {scope}")
+
+        return [
+            (self.get_mention(posting1), self.get_mention(posting2))
+            for posting1, posting2 in self.index.window_cooccurrences(
+                tag1, tag2, window, key
+            )
+        ]
+
+    def for_book(self, book_id: int) -> "ChatBot":
+        """
+        Returns a view of the chatbot restricted to one book of the corpus.
+        The view shares all the data, only the postings lists are sliced
+        and the terms are resolved with the aliases of the book.
+        """
+        book_bot = copy.copy(self)
+        book_bot.index = self.index.restrict(self.store.book_mentions(book_id))
+        book_bot.aliases = self.book_aliases[book_id]
+        return book_bot
+
+    def find_books(self, msg: str) -> tuple[list[int], str]:
+        """
+        Finds the books of the corpus a message refers to, by their title or their author,
+        and removes the references from the message (so that e.g. the "murder" of
+        "The Murder on the Links" isn't taken for a search term).
+
+        Args:
+            msg (str): The user message.
+
+        Returns:
+            tuple[list[int], str]: The ids of the books (all of them if the message doesn't
+                refer to any), and the message without the references.
+        """
+        book_ids = []
+        patterns = []
+        for book_id, (title, author) in enumerate(
+            zip(self.store.book_titles, self.store.book_authors)
+        ):
+            names = [regex_registry.compile(r"^the\s+", re.IGNORECASE).sub("", title)]
+            if author:
+                names.extend([author, author.split()[-1]])
+
+            pattern = regex_registry.compile(
+                r"\b((in|of|from|by)\s+)?(the\s+)?({rgx})\b".format(
+                    rgx="|".join(r"\s+".join(map(re.escape, n.split())) for n in names)
+                ),
+                re.IGNORECASE,
+            )
+            # every book is matched against the whole message, as the books
+            # by the same author share the references to it
+            if pattern.search(msg):
+                book_ids.append(book_id)
+                patterns.append(pattern)
+
+        for pattern in patterns:
+            msg = pattern.sub("", msg)
+
+        if not book_ids:
+            book_ids = list(range(len(self.store.book_names)))
+
+        return book_ids, " ".join(msg.split())
+
+    def answer_books(
+        self, book_ids: list[int], resp, msg: str, groups: dict
+    ) -> AIResponse:
+        """
+        Answers an analysis query separately for each of the books.
+        """
+        answers = []
+        for book_id in book_ids:
+            book_resp = getattr(self.for_book(book_id), resp.__name__)(msg, **groups)
+            answers.append(AIResponse(f"{self.store.book_titles[book_id]}:", book_resp))
+
+        return AIResponse(*answers, join="\n")
 
     def fallback(self) -> AIResponse:
         """
@@ -207,6 +587,17 @@ class ChatBot:
             ["I don't understand", "I don't know how to respond to that"],
         )
 
+    def give_up(self) -> AIResponse:
+        """
+        This function is called when answering the user input takes longer than the time budget.
+        """
+        logging.debug("Giving up on the user input...")
+
+        return AIResponse(
+            AIResponse(["Sorry", "I'm sorry"], [",", "!"], join=""),
+            ["that is taking too long to answer.", "I can't answer that in time."],
+        )
+
     def greet(self, msg=None) -> AIResponse:
         """
         This function is called when the user greets the chatbot.
@@ -261,34 +652,17 @@ class ChatBot:
             ["questions", "prompts", "queries"],
             ["you can ask", None],
             ":\n",
-            "\n".join([f'- "{ex}"' for ex in random.sample(samples, int(num))]),
+            "\n".join([f'- "{ex}"' for ex in AIResponse.sample(samples, int(num))]),
         )
 
-    def find_term_data(self, term: str) -> dict | None:
+    def find_term_tag(self, term: str) -> str | None:
         """
-        Helper function to look up the parsed data for a given term.
+        Helper function to resolve a term to the tag it is indexed under.
         """
-        term = term.lower()
-
-        # base case: if we can index directly into the data_map, then we're done
-        if term in self.data_map:
-            return self.data_map[term]
-
-        result = None
-        # otherwise, we need to check if the term is a substring of any of the matched terms
-        for _, termdata in self.data_map.items():
-            if any(
-                term in matched_term.lower() or matched_term.lower() in term
-                for matched_term in termdata["matched_terms"]
-            ):
-                logging.debug(
-                    f"find_term_data: `{term}` -> {pformat(termdata, sort_dicts=False)}"
-                )
+        tag = self.aliases.resolve(term)
+        logging.debug(f"find_term_tag: `{term}` -> `{tag}`")
 
-                result = termdata
-                break
-
-        return result
+        return tag
 
     def get_first_mention(self, msg: str, term: str) -> AIResponse | str:
         """
@@ -298,17 +672,18 @@ class ChatBot:
 
         logging.debug(f"get_first_mention: `{term}`")
 
-        termdata = self.find_term_data(term)
+        tag = self.find_term_tag(term)
 
-        if termdata is None:
+        if tag is None:
             return f"Sorry, I couldn't find any mentions of `{term}`."
-        if re.match(utils.re_union(*search_terms.book_query_terms["suspect"]), term):
-            mentions = []
-            terms = set()
-            for mention in termdata["mentions"]:
-                if mention["matched_term"] not in terms:
-                    mentions.append(mention)
-                    terms.add(mention["matched_term"])
+        if regex_registry.compile(
+            utils.re_union(*search_terms.book_query_terms["suspect"])
+        ).match(term):
+            # the first mention of each of the distinct terms
+            mentions = [
+                self.get_mention(posting)
+                for _, posting in self.index.first_of_each_term(tag)
+            ]
 
             sentence_list = []
             chapter_title = None
@@ -324,9 +699,7 @@ class ChatBot:
                 else:
                     sentence_list.extend(
                         [
-                            AIResponse(
-                                ["Next,", "Also,"],
-                            ),
+                            NEXT_RESPONSE,
                             f"sentence #{mention['sentence_idx']} mentions `{mention['matched_term']}`.",
                         ]
                     )
@@ -346,7 +719,7 @@ class ChatBot:
                 *sentence_list,
             )
 
-        first_mention = termdata["mentions"][0]
+        first_mention = self.get_mention(self.index.first(tag))
 
         term_or_alt_str = f"`{term}`"
         # determine whether to add term in parentheses by whether it's a substring of the matched term
@@ -391,54 +764,47 @@ class ChatBot:
         )
 
     def get_words_around(
-        self, msg: str, term: str, num_words_default: int = 3
+        self, msg: str, term: str, num_words: int | None = None
     ) -> AIResponse | str:
         """
         This function is called when the user wants to find the words around a term on every mention.
         """
         term = term.lower()
 
+        # we can't look further than what was stored in the KWIC index
+        num_words = min(num_words or self.words_around, self.words_around)
+
         logging.debug(f"get_words_around: `{term}`")
 
-        termdata = self.find_term_data(term)
+        tag = self.find_term_tag(term)
 
-        if termdata is None:
+        if tag is None:
             return f"Sorry, I couldn't find any mentions of `{term}`."
 
         mentions_enhanced = []
 
-        for mention in termdata["mentions"]:
-            sentence = mention["sentence"]
-            matched_term = mention["matched_term"]
-
-            # we split the sentence by the matched term
-            # which allows us to get the words at the boundaries
-            sentence_parts = sentence.split(matched_term)
+        for mention_id in self.index.get_ids(tag):
+            mention = self.get_mention(self.store.posting(mention_id))
 
             words_around = []
 
-            for i, sentence_part in enumerate(sentence_parts):
-                # some processing
-                sentence_part = preprocessing.remove_stopwords(sentence_part)
-                sentence_part = preprocessing.remove_punctuation(sentence_part)
-                sentence_part = preprocessing.remove_extra_whitespace(sentence_part)
-
-                sentence_parts[i] = sentence_part
-                words = sentence_part.split()
-
+            # the context was precomputed when building the index,
+            # so we only need to slice the words we want out of it
+            context = self.kwic[mention_id]
+            for i, (words_after, words_before) in enumerate(context):
                 if i == 0:
                     # first part - only get the last num_words
-                    words_around.extend(words[-min(num_words_default, len(words)) :])
-                elif i == len(sentence_parts) - 1:
+                    words_around.extend(words_before[-num_words:])
+                elif i == len(context) - 1:
                     # last part - only get the first num_words
-                    words_around.extend(words[: min(num_words_default, len(words))])
+                    words_around.extend(words_after[:num_words])
                 else:
                     # middle part - get both the first and last num_words
-                    words_around.extend(words[-min(num_words_default, len(words)) :])
-                    words_around.extend(words[: min(num_words_default, len(words))])
+                    words_around.extend(words_before[-num_words:])
+                    words_around.extend(words_after[:num_words])
 
-            # removing duplicates
-            words_around = list(set(words_around))
+            # removing duplicates (keeping the order of the words)
+            words_around = list(dict.fromkeys(words_around))
 
             # remove falsey values like empty strings
             words_around = [w for w in words_around if w]
@@ -456,20 +822,12 @@ class ChatBot:
             mentions_enhanced.append(
                 {
                     **mention,
-                    "sentence_parts": sentence_parts,
                     "words_around": words_around,
                 }
             )
 
         # return pformat(mentions_enhanced, sort_dicts=False)
 
-        wa = AIResponse(
-            [
-                "the words are:",
-                AIResponse(["we see:", "we have:"]),
-                "they are:",
-            ]
-        )
         sentence_list = []
         last_chapter = None
 
@@ -482,7 +840,7 @@ class ChatBot:
                     [
                         "\n",
                         f"In {mention['chapter_title']}, sentence #{mention['sentence_idx']},",
-                        wa,
+                        WORDS_ARE_RESPONSE,
                         f"{words_around_str}.",
                     ]
                 )
@@ -490,7 +848,7 @@ class ChatBot:
                 sentence_list.extend(
                     [
                         f"Next, in sentence #{mention['sentence_idx']},",
-                        wa,
+                        WORDS_ARE_RESPONSE,
                         f"{words_around_str}.",
                     ]
                 )
@@ -513,35 +871,31 @@ class ChatBot:
 
         logging.debug(f"get_cooccurance: `{term1}`, `{term2}`")
 
-        term1data = self.find_term_data(term1)
-        term2data = self.find_term_data(term2)
+        tag1 = self.find_term_tag(term1)
+        tag2 = self.find_term_tag(term2)
 
-        if term1data is None:
+        if tag1 is None:
             return f"Sorry, I couldn't find any mentions of `{term1}`."
 
-        if term2data is None:
+        if tag2 is None:
             return f"Sorry, I couldn't find any mentions of `{term2}`."
 
         co_occurrences_list = []
 
-        for mention1 in term1data["mentions"]:
-            for mention2 in term2data["mentions"]:
-                if mention1["chapter_idx"] != mention2["chapter_idx"]:
-                    continue
-
-                if mention1["sentence_idx"] != mention2["sentence_idx"]:
-                    continue
+        for posting1, posting2 in self.index.cooccurrences(tag1, tag2):
+            mention1 = self.get_mention(posting1)
+            mention2 = self.get_mention(posting2)
 
-                co_occurrences_list.append(
-                    {
-                        "chapter_title": mention1["chapter_title"],
-                        "chapter_idx": mention1["chapter_idx"],
-                        "sentence_idx": mention1["sentence_idx"],
-                        "sentence": mention1["sentence"],
-                        "matched_term1": mention1["matched_term"],
-                        "matched_term2": mention2["matched_term"],
-                    }
-                )
+            co_occurrences_list.append(
+                {
+                    "chapter_title": mention1["chapter_title"],
+                    "chapter_idx": mention1["chapter_idx"],
+                    "sentence_idx": mention1["sentence_idx"],
+                    "sentence": mention1["sentence"],
+                    "matched_term1": mention1["matched_term"],
+                    "matched_term2": mention2["matched_term"],
+                }
+            )
 
         # return pformat(co_occurrences_list, sort_dicts=False)
 
@@ -551,12 +905,10 @@ class ChatBot:
         for co_occurrence in co_occurrences_list:
             both_terms_Str = f"`{co_occurrence['matched_term1']}` and `{co_occurrence['matched_term2']}`"
 
-            random_sentence_position = AIResponse(
-                [
-                    f"sentence #{co_occurrence['sentence_idx']} mentions both {both_terms_Str}.",
-                    f"{both_terms_Str} are mentioned in sentence #{co_occurrence['sentence_idx']}.",
-                ]
-            )
+            random_sentence_position = [
+                f"sentence #{co_occurrence['sentence_idx']} mentions both {both_terms_Str}.",
+                f"{both_terms_Str} are mentioned in sentence #{co_occurrence['sentence_idx']}.",
+            ]
 
             if co_occurrence["chapter_title"] != last_chapter:
                 sentence_list.extend(
@@ -567,12 +919,7 @@ class ChatBot:
                     ]
                 )
             else:
-                sentence_list.extend(
-                    [
-                        AIResponse(["Next,", "Also,"]),
-                        random_sentence_position,
-                    ]
-                )
+                sentence_list.extend([NEXT_RESPONSE, random_sentence_position])
             last_chapter = co_occurrence["chapter_title"]
 
         return AIResponse(
@@ -584,30 +931,258 @@ class ChatBot:
             *sentence_list,
         )
 
-    def answer(self, msg: str) -> AIResponse | None:
+    def get_cooccurance_window(
+        self,
+        msg: str,
+        term1: str,
+        term2: str,
+        num: str | None = None,
+        scope: str | None = None,
+    ) -> AIResponse | str:
         """
-        Given a user message, this function will try to generate a response.
-        If no response can be generated, it will return None.
-        The None can be used to trigger a fallback response.
+        This function is called when the user wants to find where two terms occur
+        close to each other: within a number of sentences, or in the same paragraph/chapter.
+        """
+        term1, term2 = term1.lower(), term2.lower()
+        scope = scope.lower() if scope else "sentence"
+        window = int(num) if num else 0
+
+        logging.debug(
+            f"get_cooccurance_window: `{term1}`, `{term2}` ({scope}, {window})"
+        )
+
+        pairs = self.find_cooccurrences(term1, term2, window, scope)
+
+        if pairs is None:
+            return f"Sorry, I couldn't find any mentions of `{term1}` or `{term2}`."
+
+        sentence_list = []
+        last_chapter = None
+        last_group = None
+
+        for mention1, mention2 in pairs:
+            if scope == "sentence":
+                group = (mention1["chapter_idx"], mention1["sentence_idx"])
+            elif scope == "paragraph":
+                group = self.paragraph_key(
+                    (mention1["chapter_idx"], mention1["sentence_idx"], 0, 0)
+                )
+            else:
+                group = mention1["chapter_idx"]
+
+            # only report the first pair of each scene
+            if group == last_group:
+                continue
+            last_group = group
+
+            if mention1["sentence_idx"] == mention2["sentence_idx"]:
+                position = [
+                    f"sentence #{mention1['sentence_idx']} mentions both",
+                    f"`{mention1['matched_term']}` and `{mention2['matched_term']}`.",
+                ]
+            else:
+                position = [
+                    f"sentence #{mention1['sentence_idx']} mentions `{mention1['matched_term']}`",
+                    "and",
+                    f"sentence #{mention2['sentence_idx']} mentions `{mention2['matched_term']}`.",
+                ]
+
+            if mention1["chapter_title"] != last_chapter:
+                sentence_list.extend(
+                    ["\n", f"In {mention1['chapter_title']},", *position]
+                )
+            else:
+                sentence_list.extend([NEXT_RESPONSE, *position])
+            last_chapter = mention1["chapter_title"]
+
+        if scope == "sentence":
+            scope_str = (
+                f"within {window} sentence{'s' if window != 1 else ''} of each other"
+            )
+        else:
+            scope_str = f"in the same {scope}"
+
+        return AIResponse(
+            "Here are the places where",
+            f"`{term1}`",
+            "and",
+            f"`{term2}`",
+            "appear",
+            f"{scope_str}:",
+            *sentence_list,
+        )
+
+    def get_book_patterns(self, book_id: int) -> dict:
+        """
+        Computes the plot structure of a book from the index: where each tag is first
+        mentioned (relative to the length of the book), in how many chapters it is mentioned,
+        and in how many sentences the investigator and the perpetrator co-occur.
+        """
+        index = self.index.restrict(self.store.book_mentions(book_id))
+        sentences = self.store.book_sentences(book_id)
+
+        tags = {}
+        for tag in search_terms.book_query_terms:
+            mention_ids = index.get_ids(tag)
+            if not mention_ids:
+                continue
+
+            first_sentence = self.store.mention_sentence[mention_ids[0]]
+            first_chapter = self.store.sentence_chapter[first_sentence]
+            tags[tag] = {
+                "first_position": (first_sentence - sentences.start) / len(sentences),
+                "first_chapter_title": self.store.chapter_titles[first_chapter - 1],
+                "num_chapters": len(
+                    {
+                        self.store.sentence_chapter[self.store.mention_sentence[i]]
+                        for i in mention_ids
+                    }
+                ),
+            }
+
+        cooccurrences = index.cooccurrences("investigator", "perpetrator")
+
+        return {
+            "title": self.store.book_titles[book_id],
+            "author": self.store.book_authors[book_id],
+            "num_chapters": len(self.store.book_chapters(book_id)),
+            "tags": tags,
+            "num_cooccurrences": len({posting1[:2] for posting1, _ in cooccurrences}),
+        }
+
+    def get_patterns(self, msg: str) -> AIResponse | str:
+        """
+        This function is called when the user wants to find patterns in the plot structure
+        across the works of one or all authors. The books are compared on when the characters
+        and the crime are first mentioned, how often they are mentioned, and how often
+        the investigator and the perpetrator co-occur.
+        """
+        book_ids, _ = self.find_books(msg)
+
+        logging.debug(f"get_patterns: {[self.store.book_names[i] for i in book_ids]}")
+
+        if not book_ids:
+            return "Sorry, there are no books to compare."
+
+        books_patterns = [self.get_book_patterns(book_id) for book_id in book_ids]
+
+        sentence_list = []
+        for patterns in books_patterns:
+            tags = patterns["tags"]
+            by_author = f" by {patterns['author']}" if patterns["author"] else ""
+            sentence_list.extend(["\n", f"In {patterns['title']}{by_author},"])
+
+            tag_sentences = [
+                f"the {tag} first appears {stats['first_position']:.0%} into the book "
+                f"({stats['first_chapter_title']}) and is mentioned in "
+                f"{stats['num_chapters']} of {patterns['num_chapters']} chapters"
+                for tag, stats in tags.items()
+            ]
+            sentence_list.append("; ".join(tag_sentences) + ".")
+
+            order = sorted(tags, key=lambda tag: tags[tag]["first_position"])
+            sentence_list.extend(
+                [
+                    ["The order of first appearance is:", "They appear in this order:"],
+                    ", ".join(order) + ".",
+                    "The investigator and the perpetrator",
+                    ["are mentioned together in", "co-occur in"],
+                    f"{patterns['num_cooccurrences']} sentences.",
+                ]
+            )
+
+        # Average position of the first appearances, for each author and overall
+        groups = {}
+        for patterns in books_patterns:
+            groups.setdefault(f"the works of {patterns['author']}", []).append(patterns)
+        if len(groups) > 1:
+            groups["all the books"] = books_patterns
+
+        for group, group_patterns in groups.items():
+            if len(group_patterns) < 2:
+                continue
+
+            averages = []
+            for tag in search_terms.book_query_terms:
+                positions = [
+                    p["tags"][tag]["first_position"]
+                    for p in group_patterns
+                    if tag in p["tags"]
+                ]
+                if positions:
+                    averages.append(f"the {tag} {sum(positions) / len(positions):.0%}")
+
+            sentence_list.extend(
+                [
+                    "\n",
+                    f"Across {group} ({len(group_patterns)} books),",
+                    "on average, the first appearance into the book is:",
+                    ", ".join(averages) + ".",
+                ]
+            )
+
+        return AIResponse(
+            ["Let's see...", "Alright,", "I can help with that", None],
+            ["Here are the patterns I found", "Here is what I found"],
+            "in the plot structure of",
+            ["the books:", "the works:"],
+            *sentence_list,
+        )
+
+    def route(self, msg: str) -> tuple[Intent, dict, list[int] | None, str] | None:
+        """
+        Finds the capability a user message asks for.
+
+        Returns:
+            tuple[Intent, dict, list[int] | None, str] | None: The intent and its named groups,
+                the ids of the books referred to (None if not a corpus) and the message
+                without the references to the books, or None if no capability matches.
         """
-        msg_usr_proc: str = ChatBot.preprocess_msg(msg)
+        # In a corpus, the references to the books are taken out of the message,
+        # the analysis queries being answered for each of the books referred to
+        book_ids, msg_books = None, msg
+        if len(self.store.book_names) > 1:
+            book_ids, msg_books = self.find_books(msg)
+
+        msg_usr_proc: str = ChatBot.preprocess_msg(msg_books)
 
         if not msg_usr_proc:
             logging.debug("Empty message, skipping...")
             return None
 
-        ai_resp = None
-        # Looping through the regex map
-        # The first regex that matches the user message will be used to generate a response
-        for cmd, resp in self.capabilities.items():
-            if match := re.match(cmd, msg_usr_proc, re.IGNORECASE):
-                # we can pass named capture groups as keyword arguments to the response function
+        if route := self.router.route(msg_usr_proc):
+            return *route, book_ids, msg_books
+
+        return None
 
-                ai_resp = resp(msg, **match.groupdict()) if callable(resp) else resp
+    def answer(self, msg: str) -> AIResponse | None:
+        """
+        Given a user message, this function will try to generate a response.
+        If no response can be generated, it will return None.
+        The None can be used to trigger a fallback response.
+        """
+        # The user message is untrusted, routing it and generating the response
+        # both have to fit in the time budget
+        try:
+            with utils.time_budget(self.time_budget):
+                # The first capability that matches the user message will be used to generate a response
+                route = self.route(msg)
+                if route is None:
+                    return None
+
+                intent, groups, book_ids, msg_books = route
+                resp = intent.handler
+                # we can pass named capture groups as keyword arguments to the response function
 
-                break
+                if book_ids is not None and resp in self.book_capabilities:
+                    return self.answer_books(book_ids, resp, msg_books, groups)
 
-        return ai_resp
+                return resp(msg, **groups) if callable(resp) else resp
+        except utils.TimeBudgetExceeded:
+            logging.warning(
+                f"No answer within the time budget of {self.time_budget}s for: {msg[:80]!r}"
+            )
+            return self.give_up()
 
     def start(self, ai_name: str = "AI", user_name: str = "You"):
         """
@@ -681,13 +1256,13 @@ class ChatBot:
             msg = AIResponse.create_variation(msg)
 
         # remove spaces before certain punctuation
-        msg = re.sub(r"\s+([.,!?;:])", r"\1", msg)
+        msg = regex_registry.compile(r"\s+([.,!?;:])").sub(r"\1", msg)
 
         # capitalize the first letter of the message
         msg = msg[0].upper() + msg[1:]
 
         # add a period at the end if there isn't any punctuation at the end
-        if not re.search(f"[{string.punctuation}]$", msg):
+        if not regex_registry.compile(f"[{string.punctuation}]$").search(msg):
             msg += "."
 
         msg = msg.strip()
@@ -0,0 +1,246 @@
+"""
+Routing of the user messages to the capabilities of the chatbot.
+
+The analysis queries used to be matched with patterns like `.*(trigger).*(?P<term>{terms}).*`,
+where `{terms}` is the union of every search term. Those backtrack over the whole union
+at every position of the message, and a message matching none of them goes through all of them.
+
+Instead, each analysis query is routed in two steps:
+1. A cheap pass looks for its trigger words (e.g. "first mentioned", "co-occur").
+2. Only if they are found, the search terms are looked up with the literal matcher
+   (see `TermMatcher`), and the terms are picked by their position with respect to
+   the trigger words, the same way the greedy `.*` of the old patterns did.
+
+So the cost of routing a message no longer depends on the number of search terms.
+The time spent routing the messages is kept per intent (see `log_stats`).
+"""
+import logging
+import re
+import time
+from enum import Enum
+from typing import Callable
+
+from lib import regex_registry, search_terms
+
+
+class TermLayout(Enum):
+    """
+    Where the search terms of an analysis query are with respect to its trigger words.
+    """
+
+    # `.*(trigger).*(?P<term>{terms}).*`
+    TERM_AFTER = "trigger term"
+    # `.*(?P<term>{terms}).*(trigger).*`
+    TERM_BEFORE = "term trigger"
+    # `.*(trigger).*(?P<term1>{terms}) (?P<term2>{terms}).*`
+    PAIR_AFTER = "trigger term1 term2"
+    # `.*(?P<term1>{terms}) (?P<term2>{terms}).*(trigger).*`
+    PAIR_BEFORE = "term1 term2 trigger"
+
+
+class Intent:
+    """
+    A capability of the chatbot along with the pattern used to recognize it.
+    Without a term layout, the pattern must match the whole message (from its start).
+    With one, the pattern is made of the trigger words of an analysis query.
+    """
+
+    __slots__ = ("name", "pattern", "handler", "layout", "regex")
+
+    def __init__(
+        self,
+        name: str,
+        pattern: str,
+        handler: Callable,
+        layout: TermLayout | None = None,
+    ):
+        self.name = name
+        self.pattern = str(pattern)
+        self.handler = handler
+        self.layout = layout
+
+        if layout is None:
+            self.regex = self.pattern
+            regex_registry.register(self.regex, re.IGNORECASE, name=name)
+        else:
+            # the rightmost trigger words, like the greedy `.*` in front of them
+            self.regex = r".*({rgx})".format(rgx=self.pattern)
+            regex_registry.register(self.regex, re.IGNORECASE, name=f"{name}.trigger")
+
+    @property
+    def compiled(self) -> re.Pattern:
+        """
+        The compiled regex of the intent, looked up in the registry so that its uses are counted.
+        """
+        return regex_registry.compile(self.regex, re.IGNORECASE)
+
+
+class IntentRouter:
+    """
+    Finds the first intent (in the order they were added) matching a user message,
+    along with its named groups (the search terms, etc.).
+    """
+
+    def __init__(self, query_terms: dict[str, list]):
+        """
+        Args:
+            query_terms (dict[str, list]): The search terms the analysis queries can refer to.
+        """
+        self.intents: list[Intent] = []
+        self.matcher = search_terms.compile_term_matcher(query_terms, ignore_case=True)
+
+        # per intent: [number of messages routed to it, total time, max time]
+        # (the messages routed to no intent are counted under `None`)
+        self.stats: dict[str | None, list] = {}
+
+    def add(
+        self,
+        name: str,
+        pattern: str,
+        handler: Callable,
+        layout: TermLayout | None = None,
+    ):
+        """
+        Adds an intent, tried after the ones added before it.
+        """
+        self.intents.append(Intent(name, pattern, handler, layout))
+
+    def route(self, msg: str) -> tuple[Intent, dict] | None:
+        """
+        Routes a (preprocessed) user message.
+
+        Args:
+            msg (str): The user message.
+
+        Returns:
+            tuple[Intent, dict] | None: The intent and its named groups,
+                or None if no intent matches the message.
+        """
+        start = time.perf_counter()
+
+        res = None
+        terms = None
+        # like `.*`, the analysis queries only look at the first line of the message
+        line = msg.partition("\n")[0]
+        for intent in self.intents:
+            if intent.layout is None:
+                if match := intent.compiled.match(msg):
+                    res = intent, match.groupdict()
+                    break
+                continue
+
+            # cheap pass first, the search terms are only looked up if the trigger words are there
+            if not intent.compiled.match(line):
+                continue
+
+            if terms is None:
+                terms = self.find_terms(line)
+
+            if (groups := self.match_terms(intent, line, terms)) is not None:
+                res = intent, groups
+                break
+
+        elapsed = time.perf_counter() - start
+        entry = self.stats.setdefault(res[0].name if res else None, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+
+        return res
+
+    def find_terms(self, line: str) -> list[tuple[int, int]]:
+        """
+        Finds the (start, end) of every search term in a message, overlapping ones included.
+        The rightmost terms come first, and the longest first for the same start.
+        """
+        spans = {(start, end) for start, end, _ in self.matcher.find_all(line)}
+        return sorted(spans, reverse=True)
+
+    @staticmethod
+    def match_terms(
+        intent: Intent, line: str, terms: list[tuple[int, int]]
+    ) -> dict | None:
+        """
+        Picks the search terms of an analysis query, given the positions of the terms in the message.
+        As with the greedy `.*` of the patterns, the rightmost term (or pair of terms)
+        with the trigger words on the right side of it is picked.
+
+        Returns:
+            dict | None: The named groups of the query, or None if it doesn't match.
+        """
+        trigger = intent.compiled
+        after = intent.layout in (TermLayout.TERM_AFTER, TermLayout.PAIR_AFTER)
+
+        # The terms can only start after the end of the first trigger words (or end
+        # before the start of the last ones), this bound is found once per message
+        # so that the trigger words aren't looked for again for every term.
+        bound = IntentRouter.find_trigger_bound(trigger, line, after)
+
+        if intent.layout in (TermLayout.TERM_AFTER, TermLayout.TERM_BEFORE):
+            for start, end in terms:
+                if after and start >= bound:
+                    match = trigger.match(line, 0, start)
+                elif not after and end <= bound:
+                    match = trigger.match(line, end)
+                else:
+                    continue
+                return {**match.groupdict(), "term": line[start:end]}
+            return None
+
+        # pairs of terms separated by a single space
+        term_ends = {}
+        for start, end in terms:
+            term_ends.setdefault(start, []).append(end)
+
+        for start1, end1 in terms:
+            if not line.startswith(" ", end1):
+                continue
+            for end2 in term_ends.get(end1 + 1, []):
+                if after and start1 >= bound:
+                    match = trigger.match(line, 0, start1)
+                elif not after and end2 <= bound:
+                    match = trigger.match(line, end2)
+                else:
+                    continue
+                return {
+                    **match.groupdict(),
+                    "term1": line[start1:end1],
+                    "term2": line[end1 + 1 : end2],
+                }
+        return None
+
+    @staticmethod
+    def find_trigger_bound(trigger: re.Pattern, line: str, after: bool) -> int:
+        """
+        Finds the end of the first trigger words in a message (`after`),
+        or the start of the last ones. The trigger words must be in the message.
+
+        Both are found with a binary search, since there may be trigger words
+        in the range [0, end) only if `end` is past the end of the first ones
+        (and in the range [start, len) only if `start` is before the start of the last ones).
+        """
+        lo, hi = 0, len(line)
+        while lo < hi:
+            if after:
+                mid = (lo + hi) // 2
+                if trigger.match(line, 0, mid):
+                    hi = mid
+                else:
+                    lo = mid + 1
+            else:
+                mid = (lo + hi + 1) // 2
+                if trigger.match(line, mid):
+                    lo = mid
+                else:
+                    hi = mid - 1
+        return lo
+
+    def log_stats(self):
+        """
+        Logs the time spent routing the messages, per intent.
+        """
+        for name, (count, total, longest) in self.stats.items():
+            logging.debug(
+                f"Routing: {name or 'no match':<24} messages={count:<6} "
+                f"avg={total / count * 1000:.3f}ms max={longest * 1000:.3f}ms"
+            )
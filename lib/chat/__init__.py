@@ -1,3 +1,4 @@
-from . import example_prompts
+from . import example_prompts, fuzz
 from .AIResponse import AIResponse
 from .ChatBot import ChatBot
+from .IntentRouter import IntentRouter
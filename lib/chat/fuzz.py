@@ -0,0 +1,173 @@
+"""
+Fuzzing harness for the worst-case latency of routing user messages.
+
+For each intent of the chatbot, messages of growing size are generated from the words
+of its pattern and from the search terms, arranged to make the matching work as hard
+as possible: trigger words repeated or glued together, search terms in the wrong order
+with respect to the trigger words, near misses, long runs of digits, etc.
+
+The time it takes to route the messages (see `ChatBot.route`) should grow linearly
+with their size. An intent whose worst-case time grows faster than that
+(e.g. because some pattern backtracks) is reported as superlinear.
+"""
+import logging
+import math
+import random
+import time
+from typing import Callable
+
+from lib import regex_registry, search_terms, term_matcher, utils
+
+from .IntentRouter import Intent
+
+# Sizes (in characters) of the generated messages
+SIZES = (2000, 8000, 32000)
+
+# Growth exponent of the routing time above which an intent is considered superlinear,
+# (1 is linear, 2 is quadratic), with some slack for the noise of the timings
+MAX_EXPONENT = 1.5
+
+
+def _repeat(unit: str, size: int) -> str:
+    return (unit * (size // max(len(unit), 1) + 1))[:size]
+
+
+# Families of generated messages, from the words of the pattern of an intent,
+# a few search terms, the size of the message and a random generator
+FAMILIES: dict[str, Callable[[list[str], list[str], int, random.Random], str]] = {
+    "repeated": lambda words, terms, size, rnd: _repeat(" ".join(words) + " ", size),
+    "glued": lambda words, terms, size, rnd: _repeat("".join(words), size),
+    "near_misses": lambda words, terms, size, rnd: _repeat(
+        " ".join(w[:-1] or w for w in words) + " ", size
+    ),
+    "terms_before": lambda words, terms, size, rnd: _repeat(" ".join(terms) + " ", size)
+    + " ".join(words),
+    "terms_after": lambda words, terms, size, rnd: " ".join(words)
+    + " "
+    + _repeat(" ".join(terms) + " ", size),
+    "digits": lambda words, terms, size, rnd: " ".join(
+        [words[0], _repeat("1", size), *words[1:]]
+    ),
+    "shuffled": lambda words, terms, size, rnd: _repeat(
+        " ".join(rnd.choice(words + terms + ["1", "42"]) for _ in range(size // 4)),
+        size,
+    ),
+}
+
+
+def get_pattern_words(intent: Intent) -> list[str]:
+    """
+    Returns the words of the pattern of an intent, e.g. ["within", "sentence", "s", ...].
+    """
+    # group names and escapes (like `\d`) aren't words of the pattern
+    pattern = regex_registry.compile(r"\?P<\w+>|\\.").sub(" ", intent.pattern)
+    return regex_registry.compile(r"[A-Za-z']+").findall(pattern) or [intent.pattern]
+
+
+def get_sample_terms(query_terms: dict[str, list], per_tag: int = 2) -> list[str]:
+    """
+    Returns a few literal search terms of each tag, e.g. ["Sherlock Holmes", "Holmes", ...].
+    """
+    terms = []
+    for patterns in query_terms.values():
+        literals = []
+        for pattern in patterns:
+            literals.extend(term_matcher.expand_literals(pattern) or [])
+        terms.extend(literals[:per_tag])
+    return terms
+
+
+def time_route(bot, msg: str, repeats: int, budget: float | None) -> float:
+    """
+    Times routing a message (the best of a few runs).
+    Returns infinity if it doesn't fit in the time budget.
+    """
+    best = math.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        try:
+            with utils.time_budget(budget):
+                bot.route(msg)
+        except utils.TimeBudgetExceeded:
+            return math.inf
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def fuzz_intents(
+    bot,
+    sizes: tuple[int, ...] = SIZES,
+    repeats: int = 3,
+    budget: float | None = 10.0,
+    seed: int = 0,
+) -> list[dict]:
+    """
+    Records the worst-case routing time of each intent of a chatbot on generated messages.
+
+    Args:
+        bot (ChatBot): The chatbot.
+        sizes (tuple[int, ...]): The sizes of the messages, in increasing order.
+        repeats (int): The number of times each message is routed (the best time is kept).
+        budget (float | None): The time budget of routing a message, in seconds.
+        seed (int): The seed of the random generator used to generate the messages.
+
+    Returns:
+        list[dict]: For each intent, the worst time for each size, the growth exponent
+            of the time (from the smallest to the largest size), the family of messages
+            it was found with, and whether the intent is superlinear.
+    """
+    terms = get_sample_terms(search_terms.all_query_terms)
+
+    results = {}
+    for intent in bot.router.intents:
+        words = get_pattern_words(intent)
+
+        # the same pattern can be used by several intents (e.g. in both term layouts)
+        if intent.pattern in results:
+            continue
+
+        res = {
+            "name": intent.name,
+            "times": [0.0] * len(sizes),
+            "exponent": 0.0,
+            "family": None,
+        }
+        for family, generate in FAMILIES.items():
+            times = [
+                time_route(
+                    bot,
+                    generate(words, terms, size, random.Random(seed)),
+                    repeats,
+                    budget,
+                )
+                for size in sizes
+            ]
+
+            if math.inf in times:
+                exponent = math.inf
+            else:
+                exponent = math.log(times[-1] / times[0]) / math.log(
+                    sizes[-1] / sizes[0]
+                )
+
+            res["times"] = [max(a, b) for a, b in zip(res["times"], times)]
+            if res["family"] is None or exponent > res["exponent"]:
+                res["exponent"] = exponent
+                res["family"] = family
+
+        res["superlinear"] = res["exponent"] > MAX_EXPONENT
+        results[intent.pattern] = res
+
+    return list(results.values())
+
+
+def log_results(results: list[dict]):
+    """
+    Logs the results of `fuzz_intents`.
+    """
+    for res in results:
+        times = " ".join(f"{t * 1000:.2f}ms" for t in res["times"])
+        logging.info(
+            f"Fuzzing: {res['name']:<24} worst={times} exponent={res['exponent']:.2f} "
+            f"({res['family']}){' SUPERLINEAR' if res['superlinear'] else ''}"
+        )
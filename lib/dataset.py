@@ -1,13 +1,21 @@
 """
 Functions for loading and processing text dataset.    
 """
+import concurrent.futures
+import functools
+import glob
+import io
+import itertools
 import logging
+import os
 import re
 from enum import Enum
 from pprint import pformat
+from typing import Callable, Iterable, Iterator
 
-from lib import preprocessing, search_terms, utils
+from lib import preprocessing, regex_registry, search_terms, utils
 
+from .annotated_text import AnnotatedText
 from .special_tokens import SpecialTokens
 
 
@@ -29,8 +37,7 @@ class RegexPatterns(str, Enum):
         + r")(?:\.? .*?)?"  # noqa: E501
     )
 
-    TABLE_OF_CONTENTS = r"(^Contents\n+(?:.*\n)+?$\n\n)"
-
+    # Reference definition of where sentences end, `find_sentence_ends` follows the same rules
     SENTENCE_SPLITTING = (
         r"(?<!\w\.\w.)"
         # Don't match abbreviations like ["U. S.", "U. K."]
@@ -49,50 +56,164 @@ class RegexPatterns(str, Enum):
     # SENTENCE_SPLITTING = r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?)\s"
     # SENTENCE_SPLITTING = r"(?<!\w\.\w.)(?<![A-Z][a-z]\.)(?<=\.|\?|:|\"|\!)\s"
 
+    # Whitespace after a punctuation mark or a quote, where a sentence may end
+    SENTENCE_END_CANDIDATE = r"[.!?:\"\']\s"
+
     def __str__(self) -> str:
         return self.value
 
 
+regex_registry.register(
+    RegexPatterns.DELIM_PROJ_GUTENBERG, re.MULTILINE, name="DELIM_PROJ_GUTENBERG"
+)
+regex_registry.register(
+    RegexPatterns.CHAPTER_TITLE, re.MULTILINE | re.IGNORECASE, name="CHAPTER_TITLE"
+)
+regex_registry.register(RegexPatterns.SENTENCE_SPLITTING, name="SENTENCE_SPLITTING")
+regex_registry.register(
+    RegexPatterns.SENTENCE_END_CANDIDATE, name="SENTENCE_END_CANDIDATE"
+)
+
+# Abbreviations that don't end a sentence (e.g. "Mr. Holmes")
+ABBREVIATIONS = frozenset(
+    ["Mr", "Ms", "Dr", "Sr", "Jr", "St", "Lt", "Co", "Mt"]
+    + ["Mrs", "Rev", "Col", "Maj", "Gen", "Sgt"]
+)
+
+
 def read_data(file_path):
     """
-    Reads the text file and returns a list of lines.
+    Reads the whole text file at once (see `read_lines` to read it lazily),
+    e.g. for `preprocess_data`.
+    Parameters:
+      file_path (string): Path to the file to read.
+    Returns:
+      text (string): Text read from the file, without the final line ending.
+    """
+    return "\n".join(read_lines(file_path))
+
+
+def read_lines(file_path) -> Iterator[str]:
+    """
+    Reads the text file lazily, one line at a time.
     Parameters:
       file_path (string): Path to the file to read.
     Returns:
-      text (string): Text read from the file.
+      lines (Iterator[str]): Lines read from the file, without the line endings.
     """
     logging.info(f"Reading data from file: {file_path}")
-    # with open(file_path, "r", encoding="ascii", errors="ignore") as f:
     with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-        lines = f.readlines()
+        for line in f:
+            yield line.rstrip("\n")
 
-    return "".join(map(str, lines))
 
+def read_metadata(file_path) -> dict[str, str]:
+    """
+    Reads the metadata fields (e.g. "Title", "Author") from the header of a Project Gutenberg
+    text file, up to the start of the body.
+    Parameters:
+      file_path (string): Path to the file to read.
+    Returns:
+      metadata (dict[str, str]): The metadata fields found.
+    """
+    delim_pattern = regex_registry.compile(
+        RegexPatterns.DELIM_PROJ_GUTENBERG, re.MULTILINE
+    )
+    field_pattern = regex_registry.compile(r"^(\w[\w ]*): (.+)$")
 
-def extract_body(text: str):
+    metadata = {}
+    with open(file_path, "r", encoding="utf-8-sig", errors="ignore") as f:
+        for line in f:
+            line = line.strip()
+            if delim_pattern.match(line):
+                break
+            if match := field_pattern.match(line):
+                metadata.setdefault(match.group(1), match.group(2))
+
+    return metadata
+
+
+def find_books(path: str) -> list[str]:
+    """
+    Finds the text files of the books to load.
+    Parameters:
+      path (string): Path to a text file, to a directory of text files, or a glob pattern.
+    Returns:
+      file_paths (list[str]): The sorted paths of the text files.
+    """
+    # the paths of existing files and directories are used as they are, their names
+    # may contain characters that are special in glob patterns (like "[")
+    if os.path.isfile(path):
+        return [path]
+
+    if os.path.isdir(path):
+        paths = [
+            os.path.join(path, name)
+            for name in os.listdir(path)
+            if name.endswith(".txt") and not name.startswith(".")
+        ]
+    else:
+        paths = glob.glob(path)
+
+    return sorted(p for p in paths if os.path.isfile(p))
+
+
+def strip_empty_lines(lines: Iterable[str]) -> Iterator[str]:
+    """
+    Drops the leading and trailing empty lines, like `str.strip` does for the joined text.
+    Only the current run of empty lines is held back, not the text.
+    """
+    num_empty = None  # None until the first non-empty line
+    for line in lines:
+        if not line:
+            if num_empty is not None:
+                num_empty += 1
+            continue
+        if num_empty:
+            yield from [""] * num_empty
+        num_empty = 0
+        yield line
+
+
+def extract_body(lines: Iterable[str]) -> Iterator[str]:
     """
     Filters out text between 'START OF THE PROJECT' and 'END OF THE PROJECT'.
     Parameters:
-      text (string): Text to filter.
+      lines (Iterable[str]): Lines of the text to filter.
     Returns:
-      filtered_text (string): Filtered text.
+      filtered_lines (Iterator[str]): Lines of the filtered text.
     """
     # Examples:
     # *** START OF THE PROJECT GUTENBERG EBOOK THE MAN IN THE BROWN SUIT ***
     # *** END OF THE PROJECT GUTENBERG EBOOK THE MAN IN THE BROWN SUIT ***
     logging.info("Extracting body of text...")
 
-    split_text = re.split(RegexPatterns.DELIM_PROJ_GUTENBERG, text, flags=re.MULTILINE)
+    delim_pattern = regex_registry.compile(
+        RegexPatterns.DELIM_PROJ_GUTENBERG, re.MULTILINE
+    )
+
+    # The header is only kept around in case there is no body to extract
+    lines = iter(lines)
+    header = []
+    for line in lines:
+        if delim_pattern.match(line):
+            break
+        header.append(line)
+    else:
+        logging.warning("Expected 3 splits for body of text. Found 1 splits.")
+        yield from strip_empty_lines(header)
+        return
 
-    if len(split_text) != 3:
-        logging.warning(
-            f"Expected 3 splits for body of text. Found {len(split_text)} splits."
-        )
-        return text
+    del header
 
-    _, body_text, _ = split_text
+    def body_lines():
+        for line in lines:
+            if delim_pattern.match(line):
+                return
+            yield line
+        logging.warning("Expected 3 splits for body of text. Found 2 splits.")
 
-    return body_text.strip()
+    yield from strip_empty_lines(body_lines())
 
 
 def matches_chapter_title(text: str) -> bool:
@@ -104,62 +225,111 @@ def matches_chapter_title(text: str) -> bool:
     Returns:
         bool: True if the text matches a chapter title, False otherwise.
     """
-    match = re.match(
+    match = regex_registry.compile(
         RegexPatterns.CHAPTER_TITLE,
-        text,
-        flags=re.MULTILINE | re.IGNORECASE,
-    )
+        re.MULTILINE | re.IGNORECASE,
+    ).match(text)
     return match is not None
 
 
-def get_toc(text: str) -> tuple[str | None, list[str]]:
+def get_chapter_pattern() -> re.Pattern:
+    """
+    Returns the compiled pattern matching a whole chapter heading line.
+    """
+    pattern = r"^{rgx}$".format(
+        rgx=utils.re_union(
+            "PROLOGUE",
+            RegexPatterns.CHAPTER_TITLE,
+            "EPILOGUE",
+        )
+    )
+    return regex_registry.compile(pattern, re.MULTILINE | re.IGNORECASE)
+
+
+def read_toc(lines: Iterator[str]) -> tuple[list[str] | None, list[str]]:
+    """
+    Reads the table of contents following a `Contents` line,
+    up to the first two consecutive empty lines.
+    Args:
+        lines (Iterator[str]): Lines of the text, right after the `Contents` line.
+
+    Returns:
+        tuple[list[str] | None, list[str]]: The table of contents elements
+            (or None if the table of contents never ends), and the lines consumed.
+    """
+    consumed = []
+    toc_elems = []
+    # the previous line was empty (empty lines before the first element are skipped)
+    empty = False
+    for line in lines:
+        consumed.append(line)
+        if not line:
+            if empty:
+                return toc_elems, consumed
+            empty = bool(toc_elems)
+            continue
+        if empty:
+            toc_elems.append("")
+            empty = False
+        toc_elems.append(line)
+
+    return None, consumed
+
+
+def get_toc(lines: Iterator[str]) -> tuple[list[str], list[str]]:
     """
     Extracts the table of contents from the text.
+    The table of contents is expected before the first chapter heading,
+    so the lines are only consumed up to the end of the table of contents,
+    or up to the first chapter heading if there is none.
     Args:
-        text (str): Text to be parsed and checked.
+        lines (Iterator[str]): Lines of the text.
 
     Returns:
-        list[str]: List of chapter headings.
+        tuple[list[str], list[str]]: The lines consumed that are not part of the
+            table of contents, and the list of chapter headings.
     """
     logging.debug("Searching for table of contents...")
 
-    toc = re.search(
-        RegexPatterns.TABLE_OF_CONTENTS,
-        text,
-        flags=re.MULTILINE,
-    )
-    if not toc:
-        logging.debug(" - No table of contents found.")
-        return None, []
+    chapter_pattern = get_chapter_pattern()
 
-    toc_text = toc.group()
+    head = []
+    for line in lines:
+        if line == "Contents":
+            toc_elems, consumed = read_toc(lines)
+            if toc_elems is not None:
+                logging.debug(f" - Found {len(toc_elems)} table of contents elements.")
+                return head, toc_elems
+            # the table of contents never ends, which means we reached the end of the text
+            head.append(line)
+            head.extend(consumed)
+            break
 
-    toc_elems: list[str] = (
-        re.sub(
-            r"^Contents\n+",
-            "",
-            toc_text,
-        )
-        .strip()
-        .split("\n")
-    )
-    logging.debug(f" - Found {len(toc_elems)} table of contents elements.")
+        head.append(line)
+        if chapter_pattern.match(line):
+            break
 
-    return toc_text, toc_elems
+    logging.debug(" - No table of contents found.")
+    return head, []
 
 
-def normalize_chapter_headings(text: str, chapter_headings: list[str]) -> str:
+def normalize_chapter_headings(
+    lines: Iterable[str], chapter_headings: list[str]
+) -> Iterator[str]:
     """
     Process the TOC elements in the text to determine if the chapter headings need updating.
     Args:
-        text (str): Text to be parsed and checked.
+        lines (Iterable[str]): Lines of the text to be parsed and checked.
+        chapter_headings (list[str]): The table of contents elements.
 
     Returns:
-        text (str): Text with proper chapter headings.
+        lines (Iterator[str]): Lines of the text with proper chapter headings.
     """
     logging.info("Normalizing chapter headings...")
     logging.debug(f"Chapter headings: {pformat(chapter_headings)}")
 
+    # TOC entry -> replacement, looked up with whole lines so the entries are never used as regexes
+    replacements = {}
     for elem in chapter_headings:
         elem = elem.strip()
         # If this chapter title already matches we don't need to update it to match
@@ -169,16 +339,6 @@ def normalize_chapter_headings(text: str, chapter_headings: list[str]) -> str:
             )
             continue
 
-        text_occurances = re.findall(
-            f"^{elem}$",
-            text,
-            flags=re.MULTILINE,
-        )
-        if len(text_occurances) not in (1, 2):
-            logging.warning(
-                f'Expected 1 or 2 matches for chapter heading: "{elem}". Found {len(text_occurances)} matches.'
-            )
-
         replacement = f"Chapter {elem}"
         if not matches_chapter_title(replacement):
             logging.warning(
@@ -187,57 +347,128 @@ def normalize_chapter_headings(text: str, chapter_headings: list[str]) -> str:
             continue
 
         logging.debug(f'Replacing "{elem}" with "{replacement}"...')
-
-        text = re.sub(elem, replacement, text)
-
-    return text
+        replacements[elem] = replacement
+
+    # the occurrences are counted as the lines go by, and checked once they are all processed
+    text_occurances = {elem: 0 for elem in replacements}
+    for line in lines:
+        # only lines made of a heading alone are rewritten, whatever the number of headings
+        elem = line.strip()
+        if elem in replacements:
+            text_occurances[elem] += 1
+            line = line.replace(elem, replacements[elem], 1)
+        yield line
+
+    for elem, count in text_occurances.items():
+        if count not in (1, 2):
+            logging.warning(
+                f'Expected 1 or 2 matches for chapter heading: "{elem}". Found {count} matches.'
+            )
 
 
-def add_chapter_delimiter(text: str) -> str:
+def add_chapter_delimiter(lines: Iterable[str]) -> Iterator[str]:
     """
     Adds a chapter delimiter to split up the chapters.
     Args:
-        text (str): Text to be parsed and checked.
+        lines (Iterable[str]): Lines of the text to be parsed and checked.
 
     Returns:
-        text (str): Text with chapter delimiters.
+        chapters (Iterator[str]): The text before the first chapter, then the text of
+            each chapter (starting with the chapter delimiter), as soon as it is complete.
+            Joined together they give the text with chapter delimiters.
     """
+    lines = iter(lines)
 
     # if we have a table of contents we can use it to help us add chapter delimiters
-    toc_text, toc_elems = get_toc(text)
-    if toc_text and toc_elems:
-        logging.debug("Removing table of contents from text...")
-        # remove the toc from the text
-        text = re.sub(
-            RegexPatterns.TABLE_OF_CONTENTS,
-            "",
-            text,
-            flags=re.MULTILINE,
-        )
-        text = normalize_chapter_headings(text, toc_elems)
+    head, toc_elems = get_toc(lines)
+    # the table of contents is left out of the text
+    lines = itertools.chain(head, lines)
+    if toc_elems:
+        lines = normalize_chapter_headings(lines, toc_elems)
 
-    pattern = r"^{rgx}$".format(
-        rgx=utils.re_union(
-            "PROLOGUE",
-            RegexPatterns.CHAPTER_TITLE,
-            "EPILOGUE",
-        )
-    )
+    chapter_pattern = get_chapter_pattern()
 
-    chapter_titles = re.findall(
-        pattern,
-        text,
-        flags=re.MULTILINE | re.IGNORECASE,
-    )
-    logging.debug(f"Found chapter titles: {pformat(chapter_titles)}")
+    chapter_lines = []
+    for line in lines:
+        if chapter_pattern.match(line):
+            logging.debug(f"Found chapter title: {line}")
+            yield "".join(f"{prev_line}\n" for prev_line in chapter_lines)
+            chapter_lines = []
+            line = f"{SpecialTokens.START_OF_CHAPTER}{line}"
+        chapter_lines.append(line)
 
-    text = re.sub(
-        pattern,
-        r"{token}\1".format(token=SpecialTokens.START_OF_CHAPTER),
-        text,
-        flags=re.MULTILINE | re.IGNORECASE,
-    )
-    return text
+    yield "\n".join(chapter_lines)
+
+
+def is_word_char(char: str) -> bool:
+    """
+    Returns whether a character is a word character (`\\w` in a regex).
+    """
+    return char.isalnum() or char == "_"
+
+
+def is_sentence_end(text: str, i: int) -> bool:
+    """
+    Checks whether a sentence ends at the whitespace character `text[i]`,
+    following the rules of `RegexPatterns.SENTENCE_SPLITTING`.
+
+    Args:
+        text (str): The text to be split into sentences.
+        i (int): The index of a whitespace character preceded by a punctuation mark or a quote.
+
+    Returns:
+        bool: True if a sentence ends at `text[i]`.
+    """
+    prev = text[i - 1]
+    prev2 = text[i - 2] if i >= 2 else ""
+
+    if prev in "\"'":
+        # A quote ends a sentence if it closes one (`."`, `!'`) or if it ends the line,
+        # but not after a comma (`,"`)
+        if prev2 not in (".", "!") and text[i] != "\n":
+            return False
+        if prev2 == "," and prev == '"':
+            return False
+
+    elif prev == ".":
+        # Initials (e.g. "U. S.") and abbreviations (e.g. "Mr.", "Col.")
+        if "A" <= prev2 <= "Z":
+            return False
+        if text[max(i - 3, 0) : i - 1] in ABBREVIATIONS:
+            return False
+        if text[max(i - 4, 0) : i - 1] in ABBREVIATIONS:
+            return False
+
+    # Abbreviations with inner dots (e.g. "e.g.", "a.m.")
+    if i >= 4 and text[i - 3] == "." and is_word_char(text[i - 4]):
+        if is_word_char(prev2):
+            return False
+
+    return True
+
+
+def find_sentence_ends(text: str) -> Iterator[int]:
+    """
+    Finds where the sentences of the text end.
+
+    The text is scanned once for the places where a sentence may end
+    (whitespace after a punctuation mark or a quote), and each of them is then checked
+    against the list of abbreviations and the rules for quotes.
+    This gives the same result as `RegexPatterns.SENTENCE_SPLITTING`,
+    without evaluating all of its lookbehinds at every whitespace.
+
+    Args:
+        text (str): The input text.
+
+    Returns:
+        Iterator[int]: The offsets of the whitespace characters ending the sentences.
+    """
+    for m in regex_registry.compile(RegexPatterns.SENTENCE_END_CANDIDATE).finditer(
+        text
+    ):
+        i = m.end() - 1
+        if is_sentence_end(text, i):
+            yield i
 
 
 def add_sentence_delimiter(text: str) -> str:
@@ -251,67 +482,124 @@ def add_sentence_delimiter(text: str) -> str:
         str: The modified text with a sentence delimiters
     """
     # text = re.sub(r"[.!?]+", " <END_SENTENCE> ", text)
-    return re.sub(
-        RegexPatterns.SENTENCE_SPLITTING,
-        SpecialTokens.END_OF_SENTENCE + "\n",
-        text,
-    )
+    parts = []
+    last_end = 0
+    for i in find_sentence_ends(text):
+        parts.append(text[last_end:i])
+        parts.append(SpecialTokens.END_OF_SENTENCE + "\n")
+        last_end = i + 1
+    parts.append(text[last_end:])
 
+    return "".join(parts)
 
-def add_search_term_tags(text: str) -> str:
+
+def preprocess_chapter(
+    text: str, query_terms: dict[str, list] | None = None
+) -> AnnotatedText:
     """
-    Adds search term tags to the input text.
+    Preprocesses the text of a single chapter (or of the text before the first chapter).
+    Every step from here on only looks at the text of the chapter itself.
 
     Args:
-        text (str): The input text to be modified.
+        text (str): The text of the chapter, with the chapter delimiter.
+        query_terms (dict[str, list] | None): The search terms of the book,
+            the terms of all the books by default.
 
     Returns:
-        str: The modified text with search term tags.
+        AnnotatedText: The preprocessed text of the chapter, with its sentences and search terms.
     """
-    logging.debug("Adding search term tags...")
+    # The chapter delimiter is kept as a flag, the text itself stays clean
+    is_chapter = text.startswith(SpecialTokens.START_OF_CHAPTER)
+    if is_chapter:
+        text = text[len(SpecialTokens.START_OF_CHAPTER) :]
 
-    for key, pattern in search_terms.build_pattern_map(
-        search_terms.book_query_terms
-    ).items():
-        # add tag after any matches
-        text = re.sub(
-            pattern,
-            r"\1<{tag}>".format(tag=key.upper()),
-            text,
-            # flags=re.IGNORECASE,
-        )
+    text = preprocessing.join_paragraph_lines(text)
 
-    return text
+    # Non-destructive normalization/translation from unicode to ascii equivalents
+    text = preprocessing.normalize_character_set(text)
 
+    # The sentences and search terms are stored as offsets into the text
+    chapter = AnnotatedText(text, find_sentence_ends(text), is_chapter)
 
-def preprocess_data(text: str):
+    logging.debug("Adding search term tags...")
+    # all the tags are found in a single linear scan over the text
+    chapter.find_tags(
+        search_terms.compile_term_matcher(query_terms or search_terms.book_query_terms)
+    )
+
+    return chapter
+
+
+def map_chapters(
+    fn: Callable,
+    lines: Iterable[str],
+    executor: concurrent.futures.Executor | None = None,
+) -> Iterator:
     """
-    Preprocesses the text.
+    Splits the text into chapters as it is being read, and maps a function over
+    the text of each chapter (e.g. `preprocess_chapter`), so only the current chapter
+    is ever held in memory.
+
+    The chapters are independent once they are split, so the function can run on them
+    in parallel on an executor (e.g. a process pool), with the same result.
 
     Args:
-        text (str): The input text.
+        fn (Callable): The function to map, picklable for process pools.
+        lines (Iterable[str]): The lines of the input text, without the line endings.
+        executor (Executor | None): The executor to run the function on, if any.
 
     Returns:
-        str: The preprocessed text.
+        Iterator: The results for the text before the first chapter, then for each chapter.
     """
     logging.info("Preprocessing data...")
 
     # Initial normalization to help with the rest of the processing
-    text = preprocessing.remove_extra_whitespace(text)
+    lines = preprocessing.remove_extra_whitespace_lines(lines)
 
-    text = extract_body(text)
+    lines = extract_body(lines)
 
     # We add chapter delimiter to help split the text into chapters later
-    text = add_chapter_delimiter(text)
+    chapters = add_chapter_delimiter(lines)
 
-    # We add sentence delimiter to help split the text into sentences later
-    text = preprocessing.join_paragraph_lines(text)
+    # the character set is normalized one chapter at a time, see `preprocess_chapter`
+    logging.info("Normalizing character set...")
 
-    # Non-destructive normalization/translation from unicode to ascii equivalents
-    text = preprocessing.normalize_character_set(text)
+    yield from utils.ordered_map(fn, chapters, executor)
 
-    text = add_sentence_delimiter(text)
 
-    text = add_search_term_tags(text)
+def preprocess_lines(
+    lines: Iterable[str],
+    executor: concurrent.futures.Executor | None = None,
+    query_terms: dict[str, list] | None = None,
+) -> Iterator[AnnotatedText]:
+    """
+    Preprocesses the text as it is being read, one chapter at a time (see `map_chapters`).
+
+    Args:
+        lines (Iterable[str]): The lines of the input text, without the line endings.
+        executor (Executor | None): The executor to preprocess the chapters on, if any.
+        query_terms (dict[str, list] | None): The search terms of the book.
+
+    Returns:
+        Iterator[AnnotatedText]: The preprocessed text before the first chapter, then the
+            preprocessed text of each chapter.
+    """
+    yield from map_chapters(
+        functools.partial(preprocess_chapter, query_terms=query_terms), lines, executor
+    )
+
+
+def preprocess_data(text: str):
+    """
+    Preprocesses the text.
+
+    Args:
+        text (str): The input text.
+
+    Returns:
+        str: The preprocessed text, exported to the inline format (see `AnnotatedText.to_inline`).
+    """
+    # the lines are split the same way as when reading the file
+    lines = (line.rstrip("\n") for line in io.StringIO(text, newline=None))
 
-    return text
+    return "".join(chapter.to_inline() for chapter in preprocess_lines(lines))
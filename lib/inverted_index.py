@@ -0,0 +1,263 @@
+"""
+Inverted index of the search term mentions in the text.
+"""
+
+from array import array
+from bisect import bisect_left
+from typing import Any, Callable
+
+from lib import mention_store, term_matcher
+
+# (chapter_idx, sentence_idx, start, end) of a mention
+# The indexes are 1-based like the ones shown to the user,
+# the offsets are character offsets into the sentence.
+Posting = tuple[int, int, int, int]
+
+
+def sentence_key(posting: Posting) -> tuple[Any, int]:
+    """
+    Default (group, position) key for windowed merges:
+    postings are grouped by chapter and positioned by sentence.
+    """
+    return posting[0], posting[1]
+
+
+def intersect_sentences(
+    postings1: list[Posting], postings2: list[Posting]
+) -> list[tuple[Posting, Posting]]:
+    """
+    Finds the pairs of postings that are in the same sentence,
+    with a linear merge of the two sorted postings lists.
+
+    Args:
+        postings1 (list[Posting]): The sorted postings of the first tag.
+        postings2 (list[Posting]): The sorted postings of the second tag.
+
+    Returns:
+        list[tuple[Posting, Posting]]: The pairs of postings in the same sentence, in order.
+    """
+    pairs = []
+    i, j = 0, 0
+    while i < len(postings1) and j < len(postings2):
+        # (chapter_idx, sentence_idx) of both postings
+        key1, key2 = postings1[i][:2], postings2[j][:2]
+
+        if key1 < key2:
+            i += 1
+        elif key1 > key2:
+            j += 1
+        else:
+            # pair up every posting of this sentence from both lists
+            j_end = j
+            while j_end < len(postings2) and postings2[j_end][:2] == key1:
+                j_end += 1
+            while i < len(postings1) and postings1[i][:2] == key1:
+                pairs.extend((postings1[i], p2) for p2 in postings2[j:j_end])
+                i += 1
+            j = j_end
+
+    return pairs
+
+
+def intersect_window(
+    postings1: list[Posting],
+    postings2: list[Posting],
+    window: int = 0,
+    key: Callable[[Posting], tuple[Any, int]] = sentence_key,
+) -> list[tuple[Posting, Posting]]:
+    """
+    Pairs each posting of the first list with the nearest posting of the second list
+    that is in the same group and at most `window` positions away,
+    with a sliding merge of the two sorted postings lists.
+
+    The `key` maps a posting to a sortable (group, position) and must be
+    non-decreasing along the postings lists. By default it is (chapter_idx, sentence_idx), so
+    `window=2` means "within 2 sentences, in the same chapter". Using a constant
+    position with `window=0` matches anything in the same group (e.g. the same paragraph).
+
+    Args:
+        postings1 (list[Posting]): The sorted postings of the first tag.
+        postings2 (list[Posting]): The sorted postings of the second tag.
+        window (int): The maximum distance between the positions of a pair.
+        key (Callable): Maps a posting to its (group, position).
+
+    Returns:
+        list[tuple[Posting, Posting]]: The pairs of postings, in order of the first list.
+    """
+    keys2 = [key(p) for p in postings2]
+
+    pairs = []
+    # index of the first posting of the second list that is not before the current one
+    j = 0
+    for posting1 in postings1:
+        key1 = key(posting1)
+        while j < len(keys2) and keys2[j] < key1:
+            j += 1
+
+        # the nearest candidates are right before and right at the pointer
+        best = None
+        for k in (j - 1, j):
+            if 0 <= k < len(keys2) and keys2[k][0] == key1[0]:
+                distance = abs(keys2[k][1] - key1[1])
+                if distance <= window and (best is None or distance < best[0]):
+                    best = (distance, postings2[k])
+
+        if best is not None:
+            pairs.append((posting1, best[1]))
+
+    return pairs
+
+
+class InvertedIndex:
+    """
+    Maps each canonical tag (e.g. "investigator") to the sorted list of mentions
+    where it is found, and each tag to the matched terms it was mentioned as.
+
+    The postings lists are compact arrays of mention ids, the details of the
+    mentions being kept in the `MentionStore`. Mentions must be added in document
+    order, which keeps every postings list sorted without any extra work.
+    """
+
+    def __init__(self, store: mention_store.MentionStore):
+        self.store = store
+        self.postings: dict[str, array] = {}
+        self.term_postings: dict[str, dict[str, array]] = {}
+
+    def add(self, tag: str, term: str, mention_id: int):
+        """
+        Records a mention of `tag`, matched as `term` in the text.
+        """
+        self.postings.setdefault(tag, array("I")).append(mention_id)
+        self.term_postings.setdefault(tag, {}).setdefault(term, array("I")).append(
+            mention_id
+        )
+
+    def __contains__(self, tag: str) -> bool:
+        return tag in self.postings
+
+    def terms(self, tag: str) -> list[str]:
+        """
+        Returns the distinct terms the tag was matched as, in order of first mention.
+        """
+        return list(self.term_postings.get(tag, {}).keys())
+
+    def get_ids(self, tag: str) -> array:
+        """
+        Returns the sorted mention ids of a tag.
+        """
+        return self.postings.get(tag, array("I"))
+
+    def get(self, tag: str) -> list[Posting]:
+        """
+        Returns the sorted postings of a tag.
+        """
+        return [self.store.posting(i) for i in self.get_ids(tag)]
+
+    def first(self, tag: str) -> Posting | None:
+        """
+        Returns the first posting of a tag, or None if it is never mentioned.
+        """
+        mention_ids = self.postings.get(tag)
+        return self.store.posting(mention_ids[0]) if mention_ids else None
+
+    def cooccurrences(self, tag1: str, tag2: str) -> list[tuple[Posting, Posting]]:
+        """
+        Returns the pairs of postings where both tags are mentioned in the same sentence.
+        """
+        return intersect_sentences(self.get(tag1), self.get(tag2))
+
+    def window_cooccurrences(
+        self,
+        tag1: str,
+        tag2: str,
+        window: int = 0,
+        key: Callable[[Posting], tuple[Any, int]] = sentence_key,
+    ) -> list[tuple[Posting, Posting]]:
+        """
+        Returns each posting of `tag1` paired with the nearest posting of `tag2`
+        within the window. See `intersect_window` for the meaning of the arguments.
+        """
+        return intersect_window(self.get(tag1), self.get(tag2), window, key)
+
+    def restrict(self, mention_ids: range) -> "InvertedIndex":
+        """
+        Returns the index of a contiguous range of mention ids (e.g. the mentions of
+        one book of a corpus), sharing the same store. The postings lists are sorted,
+        so each of them is sliced with two binary searches.
+        """
+        index = InvertedIndex(self.store)
+        start, stop = mention_ids.start, mention_ids.stop
+
+        for tag, term_postings in self.term_postings.items():
+            ids = self.postings[tag]
+            ids = ids[bisect_left(ids, start) : bisect_left(ids, stop)]
+            if not ids:
+                continue
+            index.postings[tag] = ids
+
+            # the terms stay in order of first mention, within the range this time
+            sliced = []
+            for term, ids in term_postings.items():
+                ids = ids[bisect_left(ids, start) : bisect_left(ids, stop)]
+                if ids:
+                    sliced.append((term, ids))
+            index.term_postings[tag] = dict(sorted(sliced, key=lambda t: t[1][0]))
+
+        return index
+
+    def first_of_each_term(self, tag: str) -> list[tuple[str, Posting]]:
+        """
+        Returns the first posting of each distinct term the tag was matched as,
+        in order of first mention (which is the insertion order of the terms).
+        """
+        return [
+            (term, self.store.posting(mention_ids[0]))
+            for term, mention_ids in self.term_postings.get(tag, {}).items()
+        ]
+
+
+class AliasTable:
+    """
+    Resolves the terms used in user queries to the tag they are indexed under.
+
+    Every tag has a list of aliases (the tag name itself and the terms it was
+    matched as), and a term resolves to a tag if it is a substring of one of the
+    aliases, or if one of the aliases is a substring of it. When several tags
+    qualify, the one listed first wins, so the result never depends on the
+    order in which the mentions were found.
+
+    Both lookups take O(len(term)): the aliases containing the term are found with
+    a suffix automaton, and the aliases contained in the term with an Aho-Corasick scan.
+    """
+
+    def __init__(self, aliases: dict[str, list[str]]):
+        # priority of each tag, lower is better
+        self.priority: dict[str, int] = {tag: i for i, tag in enumerate(aliases)}
+
+        self.exact: dict[str, str] = {}
+        self.substrings = term_matcher.SuffixAutomaton()
+        self.automaton = term_matcher.AhoCorasick(tokenize=list)
+
+        for tag, tag_aliases in aliases.items():
+            for alias in map(str.lower, tag_aliases):
+                self.exact.setdefault(alias, tag)
+                self.substrings.add(alias, tag)
+                self.automaton.add(alias, tag)
+
+        self.substrings.build()
+        self.automaton.build()
+
+    def resolve(self, term: str) -> str | None:
+        """
+        Returns the tag a term refers to, or None if it doesn't match any alias.
+        """
+        term = term.lower()
+
+        if term in self.exact:
+            return self.exact[term]
+
+        candidates = [tag for _, _, tag in self.automaton.iter_matches(term)]
+        if (tag := self.substrings.get(term)) is not None:
+            candidates.append(tag)
+
+        return min(candidates, key=self.priority.__getitem__, default=None)
@@ -0,0 +1,242 @@
+"""
+Compact storage of the chapters, sentences and search term mentions of a book
+(or of a corpus of books).
+"""
+import contextlib
+import hashlib
+import mmap
+import os
+from array import array
+
+# Directory the paths of the text files are relative to in pickled stores, see `text_directory`
+_text_directory: str | None = None
+
+
+@contextlib.contextmanager
+def text_directory(path: str):
+    """
+    Makes the stores pickled or unpickled in the block keep the path of their text file
+    relative to the given directory (e.g. the one of the cache), so that the files
+    can be moved together.
+    """
+    global _text_directory
+    prev, _text_directory = _text_directory, path
+    try:
+        yield
+    finally:
+        _text_directory = prev
+
+
+class MentionStore:
+    """
+    Chapter titles and sentences are stored once, in tables referenced by integer ids,
+    and the mentions are stored as parallel columns of integers instead of one dict
+    (with its own copy of the sentence and chapter title) per mention.
+
+    Chapter and sentence indexes are 1-based like the ones shown to the user,
+    book, sentence and mention ids are 0-based positions in the tables.
+
+    The books of a corpus are stored one after the other, so the chapters,
+    sentences and mentions of each book are contiguous ranges of the tables.
+
+    The text of the sentences is stored one sentence after the other in a flat UTF-8 buffer,
+    and only decoded when a sentence is looked up. The buffer can be written to a file
+    and memory-mapped (see `map_text`), so that processes loading the same store
+    share its pages instead of each holding their own copy.
+    """
+
+    def __init__(self):
+        # Books
+        self.book_names: list[str] = []
+        self.book_titles: list[str] = []
+        self.book_authors: list[str] = []
+        self.book_first_chapter = array("I")
+        self.book_first_sentence = array("I")
+        self.book_first_mention = array("I")
+
+        # Chapters
+        self.chapter_titles: list[str] = []
+        self.chapter_first_sentence = array("I")
+
+        # Sentences, with the byte offsets of the text of each sentence in `text`
+        self.text: bytearray | mmap.mmap = bytearray()
+        self.text_path: str | None = None
+        # the hash of the text in the file, to check it is the right one when mapping it again
+        self.text_digest: str | None = None
+        self.sentence_offsets = array("Q", [0])
+        self.sentence_chapter = array("I")
+        self.sentence_paragraph = array("I")
+
+        # Mentions (their tags and matched terms are kept by the index)
+        self.mention_sentence = array("I")
+        self.mention_start = array("I")
+        self.mention_end = array("I")
+
+    def __len__(self) -> int:
+        return len(self.mention_sentence)
+
+    def add_book(self, name: str, title: str, author: str) -> int:
+        """
+        Adds a book, which the following chapters will belong to.
+        Returns the id of the book.
+        """
+        self.book_names.append(name)
+        self.book_titles.append(title)
+        self.book_authors.append(author)
+        self.book_first_chapter.append(len(self.chapter_titles) + 1)
+        self.book_first_sentence.append(len(self.sentence_chapter))
+        self.book_first_mention.append(len(self.mention_sentence))
+        return len(self.book_names) - 1
+
+    def add_chapter(self, title: str) -> int:
+        """
+        Adds a chapter, which the following sentences will belong to.
+        Returns the (1-based) index of the chapter.
+        """
+        self.chapter_titles.append(title)
+        self.chapter_first_sentence.append(len(self.sentence_chapter))
+        return len(self.chapter_titles)
+
+    def add_sentence(self, sentence: str, paragraph_idx: int) -> int:
+        """
+        Adds a sentence to the last chapter. Returns the id of the sentence.
+        """
+        if self.text_path is not None:
+            # a memory-mapped text is read-only, new sentences go to a copy of it
+            self.text = bytearray(self.text)
+            self.text_path = None
+            self.text_digest = None
+
+        self.text += sentence.encode("utf-8")
+        self.sentence_offsets.append(len(self.text))
+        self.sentence_chapter.append(len(self.chapter_titles))
+        self.sentence_paragraph.append(paragraph_idx)
+        return len(self.sentence_chapter) - 1
+
+    def add_mention(self, sentence_id: int, start: int, end: int) -> int:
+        """
+        Adds a mention at [start:end] in the sentence. Returns the id of the mention.
+        """
+        self.mention_sentence.append(sentence_id)
+        self.mention_start.append(start)
+        self.mention_end.append(end)
+        return len(self.mention_sentence) - 1
+
+    def map_text(self, path: str):
+        """
+        Writes the text of the sentences to a file and memory-maps it in place of the buffer.
+        When the store is pickled, only the path of the file (see `text_directory`),
+        its size and its hash are kept, and it is mapped again when unpickling.
+
+        Args:
+            path (str): The path of the file to write the text to.
+        """
+        # write to a temporary file first, processes mapping the previous file keep their copy
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(self.text)
+        os.replace(f"{path}.tmp", path)
+
+        digest = hashlib.sha256(self.text).hexdigest()
+        self.text = self._map_file(path, len(self.text), digest)
+        self.text_path = os.path.abspath(path)
+        self.text_digest = digest
+
+    @staticmethod
+    def _map_file(path: str, size: int, digest: str) -> bytearray | mmap.mmap:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size != size:
+                raise ValueError(f"Unexpected size of the text file: {path}")
+            # an empty file can't be mapped
+            if size == 0:
+                return bytearray()
+            text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if hashlib.sha256(text).hexdigest() != digest:
+            text.close()
+            raise ValueError(f"Unexpected content of the text file: {path}")
+        return text
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        if self.text_path is not None:
+            # the text is in the file, only its size is kept (along with its hash)
+            # to check it's the right one
+            state["text"] = len(self.text)
+            if _text_directory is not None:
+                state["text_path"] = os.path.relpath(self.text_path, _text_directory)
+        return state
+
+    def __setstate__(self, state: dict):
+        if state["text_path"] is not None:
+            # an absolute path stays as it is
+            path = os.path.join(_text_directory or "", state["text_path"])
+            state["text"] = self._map_file(path, state["text"], state["text_digest"])
+            state["text_path"] = os.path.abspath(path)
+        self.__dict__.update(state)
+
+    def _book_range(self, firsts: array, book_id: int, end: int) -> range:
+        if book_id + 1 < len(firsts):
+            end = firsts[book_id + 1]
+        return range(firsts[book_id], end)
+
+    def book_chapters(self, book_id: int) -> range:
+        """
+        Returns the (1-based) indexes of the chapters of a book.
+        """
+        return self._book_range(
+            self.book_first_chapter, book_id, len(self.chapter_titles) + 1
+        )
+
+    def book_sentences(self, book_id: int) -> range:
+        """
+        Returns the ids of the sentences of a book.
+        """
+        return self._book_range(
+            self.book_first_sentence, book_id, len(self.sentence_chapter)
+        )
+
+    def book_mentions(self, book_id: int) -> range:
+        """
+        Returns the ids of the mentions of a book.
+        """
+        return self._book_range(self.book_first_mention, book_id, len(self))
+
+    def sentence_id(self, chapter_idx: int, sentence_idx: int) -> int:
+        """
+        Returns the id of a sentence from its chapter and sentence indexes.
+        """
+        return self.chapter_first_sentence[chapter_idx - 1] + sentence_idx - 1
+
+    def sentence(self, chapter_idx: int, sentence_idx: int) -> str:
+        """
+        Returns the text of a sentence from its chapter and sentence indexes.
+        """
+        return self.sentence_text(self.sentence_id(chapter_idx, sentence_idx))
+
+    def sentence_text(self, sentence_id: int) -> str:
+        """
+        Returns the text of a sentence from its id.
+        """
+        start = self.sentence_offsets[sentence_id]
+        end = self.sentence_offsets[sentence_id + 1]
+        return self.text[start:end].decode("utf-8")
+
+    def paragraph(self, chapter_idx: int, sentence_idx: int) -> int:
+        """
+        Returns the (1-based, per chapter) paragraph index of a sentence.
+        """
+        return self.sentence_paragraph[self.sentence_id(chapter_idx, sentence_idx)]
+
+    def posting(self, mention_id: int) -> tuple[int, int, int, int]:
+        """
+        Returns the (chapter_idx, sentence_idx, start, end) of a mention.
+        """
+        sentence_id = self.mention_sentence[mention_id]
+        chapter_idx = self.sentence_chapter[sentence_id]
+        sentence_idx = sentence_id - self.chapter_first_sentence[chapter_idx - 1] + 1
+        return (
+            chapter_idx,
+            sentence_idx,
+            self.mention_start[mention_id],
+            self.mention_end[mention_id],
+        )
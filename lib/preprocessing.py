@@ -1,8 +1,39 @@
+import functools
 import logging
 import re
 import unicodedata
+from typing import Iterable, Iterator
 
-from lib import stop_words, utils
+from lib import regex_registry, stop_words, utils
+
+# Stopwords, in lower case
+STOPWORDS = frozenset(stop_words.stop_words)
+
+# A single stopword, only used for the words outside of ASCII (see `is_stopword`):
+# neither `str.lower` nor `str.casefold` folds them the way the case-insensitive
+# matching of `re` does, so the stopwords are still matched with a regex there
+STOPWORD_PATTERN = "|".join(sorted(STOPWORDS))
+regex_registry.register(STOPWORD_PATTERN, re.IGNORECASE, name="STOPWORD")
+
+# Alternating runs of word and non-word characters
+TOKEN_PATTERN = r"\w+|\W+"
+regex_registry.register(TOKEN_PATTERN, name="TOKEN")
+
+# Runs of characters that are neither removed by `remove_punctuation` nor whitespace
+NON_CONTENT_PATTERN = r"[^a-zA-Z0-9\[]+"
+regex_registry.register(NON_CONTENT_PATTERN, name="NON_CONTENT")
+
+# Runs of whitespace other than a single space or newline, the only ones `remove_extra_whitespace` may change
+WHITESPACE_RUN_PATTERN = r"\s{2,}|[^\S \n]"
+regex_registry.register(WHITESPACE_RUN_PATTERN, name="WHITESPACE_RUN")
+
+# Runs of newlines, splitting a run of whitespace into lines
+NEWLINES_PATTERN = r"([\r\n]+)"
+regex_registry.register(NEWLINES_PATTERN, name="NEWLINES")
+
+# Any character outside of ASCII, the only ones `normalize_character_set` may change
+NON_ASCII_PATTERN = r"[^\x00-\x7f]"
+regex_registry.register(NON_ASCII_PATTERN, name="NON_ASCII")
 
 
 def remove_punctuation(text: str) -> str:
@@ -22,11 +53,7 @@ def remove_punctuation(text: str) -> str:
     #     "",
     #     text,
     # )
-    text = re.sub(
-        r"[^[a-zA-Z0-9\s]+",
-        " ",
-        text,
-    )
+    text = regex_registry.compile(r"[^[a-zA-Z0-9\s]+").sub(" ", text)
 
     # For debugging purposes. Can be removed later.
     # if len_before != len(text) and len(text) == 0:
@@ -34,6 +61,41 @@ def remove_punctuation(text: str) -> str:
     return text
 
 
+def normalize_whitespace_run(
+    run: str,
+    max_consecutive_spaces: int = 1,
+    max_consecutive_newlines: int = 3,
+) -> str:
+    """
+    Normalizes a run of whitespace found between two non-whitespace characters.
+
+    Args:
+        run (str): The run of whitespace to be normalized.
+
+    Returns:
+        str: The normalized run of whitespace.
+    """
+    # even indices -> spaces (possibly empty), odd indices -> runs of newlines
+    parts = regex_registry.compile(NEWLINES_PATTERN).split(run)
+
+    for i in range(1, len(parts), 2):
+        if len(parts[i]) >= max_consecutive_newlines:
+            parts[i] = "\n" * max_consecutive_newlines
+
+    for i in range(0, len(parts), 2):
+        if not parts[i]:
+            continue
+        # spaces at the start or end of a line are stripped, but a lone `\r` doesn't end a line
+        if (i > 0 and parts[i - 1][-1] == "\n") or (
+            i + 1 < len(parts) and parts[i + 1][0] == "\n"
+        ):
+            parts[i] = ""
+        elif len(parts[i]) >= max_consecutive_spaces:
+            parts[i] = " " * max_consecutive_spaces
+
+    return "".join(parts)
+
+
 def remove_extra_whitespace(
     text: str,
     max_consecutive_spaces: int = 1,
@@ -41,6 +103,8 @@ def remove_extra_whitespace(
 ) -> str:
     """
     Removes extra spaces from the input text.
+    1. Caps runs of spaces to `max_consecutive_spaces` and runs of newlines to `max_consecutive_newlines`.
+    2. Strips leading and trailing whitespace on each line and on the whole text.
 
     Args:
         text (str): The input text to be modified.
@@ -48,32 +112,45 @@ def remove_extra_whitespace(
     Returns:
         str: The modified text with extra spaces removed.
     """
-    len_before = len(text)
-
-    # [^\S\r\n] -> any whitespace EXCEPT newlines and carriage returns
-
-    # max_consecutive_spaces
-    text = re.sub(
-        r"[^\S\r\n]{" + str(max_consecutive_spaces) + r",}",
-        " " * max_consecutive_spaces,
+    # Whitespace at either end of the text is always removed
+    text = text.strip()
+
+    # Everything else is done in a single pass over the runs of whitespace that may change.
+    # Single spaces and newlines are by far the most common runs and are left as they are.
+    return regex_registry.compile(WHITESPACE_RUN_PATTERN).sub(
+        lambda m: normalize_whitespace_run(
+            m.group(), max_consecutive_spaces, max_consecutive_newlines
+        ),
         text,
     )
 
-    # max_consecutive_newlines
-    text = re.sub(
-        r"[\r\n]{" + str(max_consecutive_newlines) + r",}",
-        "\n" * max_consecutive_newlines,
-        text,
-    )
 
-    # Also strip leading and trailing whitespace on each line
-    text = re.sub(r"^[^\S\r\n]+", "", text, flags=re.MULTILINE)
-    text = re.sub(r"[^\S\r\n]+$", "", text, flags=re.MULTILINE)
+def remove_extra_whitespace_lines(
+    lines: Iterable[str],
+    max_consecutive_spaces: int = 1,
+    max_consecutive_newlines: int = 3,
+) -> Iterator[str]:
+    """
+    Streaming version of `remove_extra_whitespace`, over the lines of a text.
+    Joining the lines gives the same text, except for the leading and trailing empty lines.
+
+    Args:
+        lines (Iterable[str]): The lines of the text, without the line endings.
 
-    # For debugging purposes. Can be removed later.
-    # if len_before != len(text) and len(text) == 0:
-    #     logging.warning("Text is empty after removing extra whitespace.")
-    return text.strip()
+    Returns:
+        Iterator[str]: The lines with extra spaces removed.
+    """
+    num_empty = 0
+    for line in lines:
+        # runs of newlines are capped before the lines are stripped,
+        # so only the lines that are empty to begin with count towards them
+        num_empty = num_empty + 1 if not line else 0
+        if num_empty >= max_consecutive_newlines:
+            continue
+
+        yield remove_extra_whitespace(
+            line, max_consecutive_spaces, max_consecutive_newlines
+        )
 
 
 def join_paragraph_lines(text: str) -> str:
@@ -86,7 +163,56 @@ def join_paragraph_lines(text: str) -> str:
       processed_text (string): Processed text.
     """
     pattern = r"([^\s])\n([^\s])"
-    return re.sub(pattern, r"\1 \2", text)
+    return regex_registry.compile(pattern).sub(r"\1 \2", text)
+
+
+# Translation of special characters to their ASCII equivalents
+SPECIAL_CHARACTERS = {
+    "’": "'",
+    "‘": "'",
+    "”": '"',
+    "“": '"',
+    "…": "...",
+    "•": "*",
+    "–": "-",  # en dash
+    "—": "-",  # em dash
+    "―": "-",  # horizontal bar
+    "æ": "ae",
+    "£": "",
+    "œ": "",  # ae ligature
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def translate_character(char: str) -> str:
+    """
+    Translates a single character the way `normalize_character_set` does.
+    The character is decomposed (NFD), its diacritical marks are dropped,
+    and what is left is translated with `SPECIAL_CHARACTERS`.
+    The translations of the characters seen most recently are cached.
+
+    Args:
+        char (str): The character to be translated.
+
+    Returns:
+        str: The translation of the character, possibly empty or several characters long.
+    """
+    return "".join(
+        SPECIAL_CHARACTERS.get(c, c) for c in remove_unicode_diacritics(char)
+    )
+
+
+def get_translation_table(charset: Iterable[str]) -> dict[int, str]:
+    """
+    Returns the translation table of `normalize_character_set` for the given characters.
+
+    Args:
+        charset (Iterable[str]): The unicode characters of the text to be translated.
+
+    Returns:
+        dict[int, str]: The translation table, to be used with `str.translate`.
+    """
+    return {ord(char): translate_character(char) for char in charset}
 
 
 def remove_unicode_diacritics(text: str) -> str:
@@ -103,12 +229,14 @@ def remove_unicode_diacritics(text: str) -> str:
     # Normalize to NFD form, which decomposes composed characters into base characters and diacritical marks
     text = unicodedata.normalize("NFD", text)
 
-    # Filter out characters that are not spacing marks (i.e., diacritical marks)
-    for char in utils.extract_unicode_charset(text):
-        if unicodedata.category(char) == "Mn":
-            text = text.replace(char, "")
-
-    return text
+    # Filter out characters that are not spacing marks (i.e., diacritical marks), all in one pass
+    return text.translate(
+        {
+            ord(char): None
+            for char in utils.extract_unicode_charset(text)
+            if unicodedata.category(char) == "Mn"
+        }
+    )
 
 
 def normalize_character_set(text: str) -> str:
@@ -117,45 +245,105 @@ def normalize_character_set(text: str) -> str:
     1. Removes diacritical marks while keeping the underlying base character.
     2. Translates special characters to their ASCII equivalents.
 
+    Both are done in a single pass over the non-ASCII characters, with a translation table
+    built one character at a time.
+    This gives the same text as normalizing the whole text to NFD first, as long as it contains
+    no spacing combining marks (only found in a handful of non-latin scripts).
+
     Args:
         text (str): The input text to be processed.
 
     Returns:
         str: The input text with UTF-8 characters translated to ASCII characters.
     """
-    logging.info("Normalizing character set...")
-    logging.debug(f"Unicode charset before: {utils.extract_unicode_charset(text)}")
+    # The text is scanned for unicode characters only once, the rest is derived from them
+    charset = utils.extract_unicode_charset(text)
 
-    text = remove_unicode_diacritics(text)
+    logging.debug("Normalizing character set...")
+    logging.debug(f"Unicode charset before: {charset}")
 
-    # Translation table for special characters
-    translation_table = str.maketrans(
-        {
-            "’": "'",
-            "‘": "'",
-            "”": '"',
-            "“": '"',
-            "…": "...",
-            "•": "*",
-            "–": "-",  # en dash
-            "—": "-",  # em dash
-            "―": "-",  # horizontal bar
-            "æ": "ae",
-            "£": "",
-            "œ": "",  # ae ligature
-        }
+    # Same as `text.translate(translation_table)`, but ASCII characters never change and are skipped
+    translation_table = get_translation_table(charset)
+    text = regex_registry.compile(NON_ASCII_PATTERN).sub(
+        lambda m: translation_table[ord(m.group())], text
     )
 
-    # Translate the text using the table
-    text = text.translate(translation_table)
-
-    charset_after = utils.extract_unicode_charset(text)
+    charset_after = utils.extract_unicode_charset(
+        "".join(translation_table[ord(char)] for char in charset)
+    )
     if len(charset_after) > 0:
         logging.warning(f"Unicode characters left not translated: {charset_after}.")
 
     return text
 
 
+def iter_tokens(text: str) -> Iterator[str]:
+    """
+    Splits the input text into alternating runs of word and non-word characters, as they are found.
+    Joining the tokens gives the text back.
+
+    Args:
+        text (str): The input text to be split.
+
+    Returns:
+        Iterator[str]: The tokens of the text.
+    """
+    for m in regex_registry.compile(TOKEN_PATTERN).finditer(text):
+        yield m.group()
+
+
+def is_stopword(token: str) -> bool:
+    """
+    Checks whether a token is a stopword, regardless of case.
+
+    Args:
+        token (str): The token to check.
+
+    Returns:
+        bool: True if the token is a stopword.
+    """
+    if token.isascii():
+        return token.lower() in STOPWORDS
+
+    # outside of ASCII, the case-insensitive matching of `re` decides,
+    # e.g. "K" (the Kelvin sign) is the same letter as "k" for it
+    return (
+        regex_registry.compile(STOPWORD_PATTERN, re.IGNORECASE).fullmatch(token)
+        is not None
+    )
+
+
+def iter_content_words(text: str) -> Iterator[str]:
+    """
+    Streaming version of removing the stopwords, punctuation and extra whitespace from
+    the input text and splitting it into words: the words are yielded as they are found.
+
+    Args:
+        text (str): The input text to be split.
+
+    Returns:
+        Iterator[str]: The words of the text that aren't stopwords.
+    """
+    # a word can run over several tokens (e.g. "[" is kept by `remove_punctuation`)
+    word = ""
+    for token in iter_tokens(text):
+        if is_stopword(token):
+            continue
+
+        parts = regex_registry.compile(NON_CONTENT_PATTERN).split(token)
+        word += parts[0]
+        if len(parts) == 1:
+            continue
+
+        if word:
+            yield word
+        yield from filter(None, parts[1:-1])
+        word = parts[-1]
+
+    if word:
+        yield word
+
+
 def remove_stopwords(text: str) -> str:
     """
     Removes stopwords from the input text.
@@ -168,17 +356,7 @@ def remove_stopwords(text: str) -> str:
     """
     len_before = len(text)
 
-    text = re.sub(
-        # r"(( \b({rgx})\b)|(\b({rgx})\b ))".format(
-        #     rgx=utils.re_union(*stop_words.stop_words),
-        # ),
-        r"((\b({rgx})\b))".format(
-            rgx=utils.re_union(*stop_words.stop_words),
-        ),
-        "",
-        text,
-        flags=re.IGNORECASE,
-    )
+    text = "".join(token for token in iter_tokens(text) if not is_stopword(token))
 
     # For debugging purposes. Can be removed later.
     if len_before != len(text) and len(text) == 0:
@@ -0,0 +1,108 @@
+"""
+Central registry of precompiled regex patterns.
+
+Every module registers the patterns it uses once at import time and then pulls
+the compiled objects from here, so we never depend on the size of the internal
+cache of the `re` module. The registry also keeps track of how long each
+pattern took to compile and how many times it was requested.
+"""
+import logging
+import re
+import time
+
+
+class RegisteredPattern:
+    """
+    A compiled pattern along with its usage statistics.
+    """
+
+    __slots__ = ("name", "pattern", "compiled", "compile_time", "hits")
+
+    def __init__(self, name: str, pattern: str, flags: int = 0):
+        self.name: str = name
+        self.pattern: str = pattern
+
+        start = time.perf_counter()
+        self.compiled: re.Pattern = re.compile(pattern, flags)
+        self.compile_time: float = time.perf_counter() - start
+
+        self.hits: int = 0
+
+
+_registry: dict[tuple[str, int], RegisteredPattern] = {}
+
+
+def register(pattern: str, flags: int = 0, name: str | None = None) -> re.Pattern:
+    """
+    Compiles and registers a pattern, without counting it as a hit.
+    Registering the same pattern (and flags) again is a no-op.
+
+    Args:
+        pattern (str): The regex pattern to be compiled.
+        flags (int): The regex flags to compile the pattern with.
+        name (str | None): A readable name used when reporting statistics.
+
+    Returns:
+        re.Pattern: The compiled pattern.
+    """
+    pattern = str(pattern)
+    key = (pattern, flags)
+
+    entry = _registry.get(key)
+    if entry is None:
+        entry = RegisteredPattern(name or pattern, pattern, flags)
+        _registry[key] = entry
+
+    return entry.compiled
+
+
+def compile(pattern: str, flags: int = 0) -> re.Pattern:
+    """
+    Returns the compiled version of a pattern, registering it on first use.
+
+    Args:
+        pattern (str): The regex pattern to look up.
+        flags (int): The regex flags the pattern was compiled with.
+
+    Returns:
+        re.Pattern: The compiled pattern.
+    """
+    entry = _registry.get((str(pattern), flags))
+    if entry is None:
+        register(pattern, flags)
+        entry = _registry[(str(pattern), flags)]
+
+    entry.hits += 1
+    return entry.compiled
+
+
+def stats() -> list[dict]:
+    """
+    Returns the usage statistics of all registered patterns,
+    sorted by the number of hits (most used first).
+    """
+    return [
+        {
+            "name": entry.name,
+            "flags": entry.compiled.flags,
+            "compile_time": entry.compile_time,
+            "hits": entry.hits,
+        }
+        for entry in sorted(_registry.values(), key=lambda e: e.hits, reverse=True)
+    ]
+
+
+def log_stats():
+    """
+    Logs the usage statistics of all registered patterns.
+    """
+    entries = stats()
+    total_time = sum(e["compile_time"] for e in entries)
+    logging.debug(
+        f"Regex registry: {len(entries)} patterns compiled in {total_time * 1000:.2f}ms"
+    )
+    for e in entries:
+        name = e["name"] if len(e["name"]) <= 60 else e["name"][:57] + "..."
+        logging.debug(
+            f" - {name:<60} hits={e['hits']:<8} compile={e['compile_time'] * 1000:.3f}ms"
+        )
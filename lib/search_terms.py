@@ -1,51 +1,112 @@
+import os
 
-from lib import utils
+from lib import term_matcher
 
-book_query_terms = {
+# Terms that apply to any book
+common_query_terms = {
     "investigator": [
         "[iI]nvestigator(s)?",
         "[dD]etective(s)?",
-        # Murder on the Links
-        "(Hercule )?Poirot",
-        # Sign of the Four
-        "(Sherlock Holmes)|Holmes",
-        # Man in the Brown Suit
-        "((Colonel )?Race)|Colonel",
     ],
     "perpetrator": [
         "[pP]erpetrator(s)?",
         "[kK]iller(s)?",
         "[mM]urderer(s)?",
-        # Murder on the Links
-        "(((Marthe|Madame) )?Daubreuil)|Marthe",
-        # Sign of the Four
-        "((Jonathan )?Small)|Jonathan",
-        # The Man in the Brown Suit
-        "(Sir )?Eustace Pedler",
     ],
     "suspect": [
         "[sS]uspect(s)?",
-        # Murder on the Links
-        "Renauld|Jack|Eloise",
-        "(M. )?(Lucien )?Bex",
-        "((Bella|Dulcie) )?Duveen|Bella|Dulcie|Dulcibella",
-        "(Leonie|Denise)( Oulard)?",  # Léonie Oulard
-        # Sign of the Four
-        "(Major (John )?Sholto)|major",
-        "(Captain )?Morstan|Captain",
-        "(Thaddeus )?Sholto|Thaddeus",
-        "Tonga",
-        # The Man in the Brown Suit
-        "(Suzanne )?Blair",
-        "(Guy )?Pagett",
-    ],
-    "crime": [
-        "They have robbed him of the treasure",
-        "(?<=stone dead, )stabbed in the back",
-        "(?<=discovered yesterday, )strangled",
     ],
+    "crime": [],
 }
 
+# Character names and crime details of each book, by book name (the name of the book file)
+books_query_terms = {
+    "the_murder_on_the_links": {
+        "investigator": [
+            "(Hercule )?Poirot",
+        ],
+        "perpetrator": [
+            "(((Marthe|Madame) )?Daubreuil)|Marthe",
+        ],
+        "suspect": [
+            "Renauld|Jack|Eloise",
+            "(M. )?(Lucien )?Bex",
+            "((Bella|Dulcie) )?Duveen|Bella|Dulcie|Dulcibella",
+            "(Leonie|Denise)( Oulard)?",  # Léonie Oulard
+        ],
+        "crime": [
+            "(?<=stone dead, )stabbed in the back",
+        ],
+    },
+    "the_sign_of_the_four": {
+        "investigator": [
+            "(Sherlock Holmes)|Holmes",
+        ],
+        "perpetrator": [
+            "((Jonathan )?Small)|Jonathan",
+        ],
+        "suspect": [
+            "(Major (John )?Sholto)|major",
+            "(Captain )?Morstan|Captain",
+            "(Thaddeus )?Sholto|Thaddeus",
+            "Tonga",
+        ],
+        "crime": [
+            "They have robbed him of the treasure",
+        ],
+    },
+    "the_man_the_brown_suit": {
+        "investigator": [
+            "((Colonel )?Race)|Colonel",
+        ],
+        "perpetrator": [
+            "(Sir )?Eustace Pedler",
+        ],
+        "suspect": [
+            "(Suzanne )?Blair",
+            "(Guy )?Pagett",
+        ],
+        "crime": [
+            "(?<=discovered yesterday, )strangled",
+        ],
+    },
+}
+
+
+def merge_query_terms(*query_terms_maps: dict[str, list]) -> dict[str, list]:
+    """
+    Merges {tag: [patterns]} maps, keeping the order of the tags and of the patterns.
+    """
+    merged = {}
+    for query_terms in query_terms_maps:
+        for k, v in query_terms.items():
+            merged.setdefault(k, []).extend(v)
+
+    return merged
+
+
+# The terms of all the books, used when the book is unknown
+book_query_terms = merge_query_terms(common_query_terms, *books_query_terms.values())
+
+
+def get_book_name(file_path: str) -> str:
+    """
+    Returns the name of a book from the path of its file, e.g. "the_sign_of_the_four".
+    """
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def get_book_query_terms(book_name: str | None) -> dict[str, list]:
+    """
+    Returns the search terms of a book: the common terms and the ones specific to the book,
+    or the terms of all the books if the book is unknown.
+    """
+    if book_name not in books_query_terms:
+        return book_query_terms
+
+    return merge_query_terms(common_query_terms, books_query_terms[book_name])
+
+
 chat_query_terms = {
     "perpetrator": ["bad guy", "villain", "criminal"],
     "crime": [
@@ -67,11 +128,19 @@ for k, v in chat_query_terms.items():
     all_query_terms[k].extend(v)
 
 
-def build_pattern_map(sub_patterns_map: dict[str, list]):
-    pattern_map = {}
-    for k, v in sub_patterns_map.items():
-        pattern_map[k] = r"\b({rgx})\b".format(
-            rgx=utils.re_union(*v),
-        )
+_term_matchers: dict[tuple, term_matcher.TermMatcher] = {}
+
+
+def compile_term_matcher(
+    sub_patterns_map: dict[str, list], ignore_case: bool = False
+) -> term_matcher.TermMatcher:
+    """
+    Builds a `TermMatcher` (Aho-Corasick backed) for the given patterns.
+    The matcher is built once per distinct map and reused afterwards.
+    """
+    key = (tuple((k, tuple(v)) for k, v in sub_patterns_map.items()), ignore_case)
+
+    if key not in _term_matchers:
+        _term_matchers[key] = term_matcher.TermMatcher(sub_patterns_map, ignore_case)
 
-    return pattern_map
+    return _term_matchers[key]
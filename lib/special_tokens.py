@@ -1,4 +1,3 @@
-import re
 from enum import Enum
 
 
@@ -8,7 +7,3 @@ class SpecialTokens(str, Enum):
 
     def __str__(self) -> str:
         return self.value
-
-
-def remove_special_tokens(text: str):
-    return re.sub(r"<[A-Z]{3,}>", "", text)
@@ -0,0 +1,385 @@
+"""
+Matcher backend used to find the search terms in the text.
+
+Most of the search terms are literal names with a few optional parts
+(e.g. "(Sir )?Eustace Pedler"), so they can be expanded into a list of plain
+strings and compiled into an Aho-Corasick automaton. The automaton works on
+word tokens, so a scan is linear in the length of the text regardless of how
+many terms there are. Only the terms that really need regex features
+(like the lookbehinds of the `crime` patterns) fall back to `re`.
+"""
+import collections
+import math
+import re
+from typing import Callable, Iterator
+
+from lib import regex_registry, utils
+
+# Alternating runs of word and non-word characters
+TOKEN_PATTERN = r"\w+|\W+"
+
+# Limit on the number of strings a single term can be expanded into
+MAX_EXPANSIONS = 256
+
+
+def _tokenize(text: str) -> list[str]:
+    return regex_registry.compile(TOKEN_PATTERN).findall(text)
+
+
+def _is_word(text: str) -> bool:
+    return bool(text) and (text[0].isalnum() or text[0] == "_")
+
+
+class _LiteralParser:
+    """
+    Recursive descent parser for the small regex subset used by the search terms:
+    literal characters, groups, alternations, `?` and simple character classes.
+    Raises ValueError on anything else.
+    """
+
+    LITERAL_CHARS = set(" '-,!") | set(
+        "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    )
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.pos = 0
+
+    def peek(self) -> str | None:
+        return self.pattern[self.pos] if self.pos < len(self.pattern) else None
+
+    def parse(self) -> list[str]:
+        res = self.parse_alt()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected `{self.peek()}` at {self.pos}")
+        return res
+
+    def parse_alt(self) -> list[str]:
+        res = self.parse_seq()
+        while self.peek() == "|":
+            self.pos += 1
+            res = res + self.parse_seq()
+        return res
+
+    def parse_seq(self) -> list[str]:
+        res = [""]
+        while self.peek() not in (None, "|", ")"):
+            alts = self.parse_atom()
+            if self.peek() == "?":
+                self.pos += 1
+                alts = alts + [""]
+            res = [a + b for a in res for b in alts]
+            if len(res) > MAX_EXPANSIONS:
+                raise ValueError("Too many expansions")
+        return res
+
+    def parse_atom(self) -> list[str]:
+        char = self.peek()
+        if char == "(":
+            self.pos += 1
+            if self.peek() == "?":
+                raise ValueError("Extension groups are not literal")
+            res = self.parse_alt()
+            if self.peek() != ")":
+                raise ValueError("Unbalanced group")
+            self.pos += 1
+            return res
+        if char == "[":
+            end = self.pattern.find("]", self.pos)
+            chars = self.pattern[self.pos + 1 : end]
+            if end < 0 or not chars or not set(chars) <= self.LITERAL_CHARS:
+                raise ValueError("Unsupported character class")
+            self.pos = end + 1
+            return list(dict.fromkeys(chars))
+        if char in self.LITERAL_CHARS:
+            self.pos += 1
+            return [char]
+        raise ValueError(f"Unsupported character `{char}`")
+
+
+def expand_literals(pattern: str) -> list[str] | None:
+    """
+    Expands a regex pattern into the list of strings it can match.
+
+    Args:
+        pattern (str): The regex pattern to expand, e.g. "(Sir )?Eustace Pedler".
+
+    Returns:
+        list[str] | None: The expanded strings, e.g. ["Sir Eustace Pedler", "Eustace Pedler"],
+            or None if the pattern uses regex features that can't be expanded.
+    """
+    try:
+        literals = _LiteralParser(pattern).parse()
+    except ValueError:
+        return None
+
+    # The literals are matched as whole words, which is what \b...\b does
+    # as long as they start and end with a word character
+    if not all(_is_word(lit) and _is_word(lit[-1]) for lit in literals):
+        return None
+
+    return list(dict.fromkeys(literals))
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over word tokens.
+    Each keyword is a string that is split into word and non-word tokens,
+    so matches can only start and end on word boundaries.
+    Passing `tokenize=list` gives a regular character-level automaton instead.
+    """
+
+    def __init__(self, tokenize: Callable[[str], list[str]] = _tokenize):
+        self.tokenize = tokenize
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        # for each state, the (number of tokens, value) of the keywords ending there
+        self.out: list[list[tuple[int, object]]] = [[]]
+        self.max_len: int = 0
+
+    def add(self, keyword: str, value: object):
+        """
+        Adds a keyword to the automaton. `build` must be called afterwards.
+        """
+        tokens = self.tokenize(keyword)
+
+        state = 0
+        for tok in tokens:
+            if tok not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[state][tok] = len(self.goto) - 1
+            state = self.goto[state][tok]
+
+        self.out[state].append((len(tokens), value))
+        self.max_len = max(self.max_len, len(tokens))
+
+    def build(self):
+        """
+        Computes the failure links with a breadth-first traversal of the trie.
+        """
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for tok, child in self.goto[state].items():
+                queue.append(child)
+
+                fail = self.fail[state]
+                while fail and tok not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(tok, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def iter_matches(self, text: str) -> Iterator[tuple[int, int, object]]:
+        """
+        Yields the (start, end, value) of every keyword occurrence in the text,
+        including overlapping ones, in order of their end offset.
+        """
+        goto, fail, out = self.goto, self.fail, self.out
+
+        # start offsets of the last few tokens, enough to cover the longest keyword
+        starts = collections.deque(maxlen=max(self.max_len, 1))
+        state = 0
+        pos = 0
+        for tok in self.tokenize(text):
+            starts.append(pos)
+            pos += len(tok)
+
+            while state and tok not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(tok, 0)
+
+            for num_tokens, value in out[state]:
+                yield starts[-num_tokens], pos, value
+
+
+class SuffixAutomaton:
+    """
+    Suffix automaton of a set of strings: it recognizes every substring of any of them
+    in O(len(substring)), with O(total length) states (a table of all the substrings
+    would take O(length²) entries per string).
+
+    Each substring resolves to the value of the first string added that contains it.
+    """
+
+    # Separates the strings, so that no substring spans two of them
+    SEPARATOR = "\0"
+
+    def __init__(self):
+        self.next: list[dict[str, int]] = [{}]
+        self.link: list[int] = [-1]
+        self.length: list[int] = [0]
+        # for each state, the index of the first string containing its substrings
+        self.first: list[int] = [math.inf]
+        self.values: list[object] = []
+        self.last: int = 0
+
+    def _new_state(self, length: int, next: dict[str, int], link: int) -> int:
+        self.next.append(next)
+        self.link.append(link)
+        self.length.append(length)
+        self.first.append(math.inf)
+        return len(self.next) - 1
+
+    def _extend(self, char: str) -> int:
+        cur = self._new_state(self.length[self.last] + 1, {}, 0)
+
+        state = self.last
+        while state != -1 and char not in self.next[state]:
+            self.next[state][char] = cur
+            state = self.link[state]
+
+        if state != -1:
+            target = self.next[state][char]
+            if self.length[state] + 1 == self.length[target]:
+                self.link[cur] = target
+            else:
+                clone = self._new_state(
+                    self.length[state] + 1,
+                    dict(self.next[target]),
+                    self.link[target],
+                )
+                while state != -1 and self.next[state].get(char) == target:
+                    self.next[state][char] = clone
+                    state = self.link[state]
+                self.link[target] = self.link[cur] = clone
+
+        self.last = cur
+        return cur
+
+    def add(self, string: str, value: object):
+        """
+        Adds a string to the automaton. `build` must be called afterwards.
+        """
+        index = len(self.values)
+        self.values.append(value)
+
+        for char in string:
+            self.first[self._extend(char)] = index
+        self._extend(self.SEPARATOR)
+
+    def build(self):
+        """
+        Propagates the first string containing each substring up the suffix links:
+        the substrings of a state are in a string if those of one of its descendants are.
+        """
+        for state in sorted(
+            range(1, len(self.next)), key=self.length.__getitem__, reverse=True
+        ):
+            link = self.link[state]
+            self.first[link] = min(self.first[link], self.first[state])
+
+    def get(self, substring: str, default=None):
+        """
+        Returns the value of the first string containing the substring, or `default`.
+        """
+        if not substring or self.SEPARATOR in substring:
+            return default
+
+        state = 0
+        for char in substring:
+            state = self.next[state].get(char)
+            if state is None:
+                return default
+
+        index = self.first[state]
+        return default if index is math.inf else self.values[index]
+
+
+class TermMatcher:
+    """
+    Finds the search terms of a {tag: [patterns]} map in a text.
+    Literal-expandable patterns go through the Aho-Corasick automaton,
+    the remaining ones are combined into a single regex with one named group per tag.
+
+    Matches never overlap: the leftmost match wins, then the longest one,
+    then the one whose tag is listed first.
+
+    With `ignore_case`, the terms are matched regardless of case (like `re.IGNORECASE`).
+    """
+
+    def __init__(self, sub_patterns_map: dict[str, list], ignore_case: bool = False):
+        self.tags: list[str] = list(sub_patterns_map.keys())
+        self.ignore_case = ignore_case
+
+        self.automaton = AhoCorasick()
+        fallback_patterns: dict[str, list] = {}
+
+        for tag_idx, (tag, patterns) in enumerate(sub_patterns_map.items()):
+            for pattern in patterns:
+                literals = expand_literals(pattern)
+                if literals is None:
+                    fallback_patterns.setdefault(tag, []).append(pattern)
+                    continue
+                for literal in literals:
+                    self.automaton.add(
+                        literal.lower() if ignore_case else literal, tag_idx
+                    )
+
+        self.automaton.build()
+
+        # the fallback regex is looked up in the registry when used, so its hits are counted
+        self.fallback: str | None = None
+        self.fallback_flags: int = re.IGNORECASE if ignore_case else 0
+        if fallback_patterns:
+            self.fallback = "|".join(
+                r"(?P<{tag}>\b({rgx})\b)".format(tag=tag, rgx=utils.re_union(*v))
+                for tag, v in fallback_patterns.items()
+            )
+            regex_registry.register(
+                self.fallback, self.fallback_flags, name="term_matcher.fallback"
+            )
+
+    def find_all(self, text: str) -> list[tuple[int, int, int]]:
+        """
+        Finds all the candidate matches of the search terms in the text, overlapping ones included
+        (the fallback regex only gives non-overlapping ones).
+
+        Args:
+            text (str): The text to search.
+
+        Returns:
+            list[tuple[int, int, int]]: The (start, end, tag index) of each candidate, in no particular order.
+        """
+        lowered = text
+        if self.ignore_case:
+            lowered = text.lower()
+            # a handful of characters change length when lowercased, these are left as they are
+            if len(lowered) != len(text):
+                lowered = "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+        candidates = list(self.automaton.iter_matches(lowered))
+
+        if self.fallback is not None:
+            candidates.extend(
+                (m.start(), m.end(), self.tags.index(m.lastgroup))
+                for m in regex_registry.compile(
+                    self.fallback, self.fallback_flags
+                ).finditer(text)
+            )
+
+        return candidates
+
+    def finditer(self, text: str) -> list[tuple[int, int, str]]:
+        """
+        Finds all the (non-overlapping) search terms in the text.
+
+        Args:
+            text (str): The text to search.
+
+        Returns:
+            list[tuple[int, int, str]]: The (start, end, tag) of each match, in order.
+        """
+        candidates = self.find_all(text)
+        candidates.sort(key=lambda c: (c[0], -c[1], c[2]))
+
+        matches = []
+        last_end = 0
+        for start, end, tag_idx in candidates:
+            if start < last_end:
+                continue
+            matches.append((start, end, self.tags[tag_idx]))
+            last_end = end
+
+        return matches
@@ -3,7 +3,14 @@ Miscellaneous utility functions that don't fit anywhere else.
 """
 
 
+import collections
+import concurrent.futures
+import contextlib
+import os
+import signal
 import string
+import threading
+from typing import Callable, Iterable, Iterator
 
 
 def re_union(*args):
@@ -43,8 +50,86 @@ def create_permutation_map(lists_of_terms: list[list[str]]):
     """
     permutation_map = {}
     for alts in lists_of_terms:
-        alts = list(set(map(str.strip, alts)))
+        # without duplicates, in a fixed order so the same random choices pick the same words
+        alts = list(dict.fromkeys(map(str.strip, alts)))
         for s in alts:
             permutation_map[s.lower()] = alts
 
     return permutation_map
+
+
+def ordered_map(
+    fn: Callable,
+    iterable: Iterable,
+    executor: concurrent.futures.Executor | None = None,
+    max_pending: int | None = None,
+) -> Iterator:
+    """
+    Lazily maps a function over an iterable, on an executor if one is given.
+    Unlike `Executor.map`, the input is consumed as the results are consumed,
+    with at most `max_pending` tasks in flight, so the input can be a stream.
+    The results are always yielded in the order of the input.
+
+    Args:
+        fn (Callable): The function to map, picklable for process pools.
+        iterable (Iterable): The inputs.
+        executor (Executor | None): The executor to run on, or None to run serially.
+        max_pending (int | None): The maximum number of tasks in flight
+            (defaults to 4 per CPU).
+
+    Returns:
+        Iterator: The results, in order.
+    """
+    if executor is None:
+        yield from map(fn, iterable)
+        return
+
+    max_pending = max_pending or 4 * (os.cpu_count() or 1)
+
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+
+    while pending:
+        yield pending.popleft().result()
+
+
+class TimeBudgetExceeded(Exception):
+    """
+    Raised when a block of code runs for longer than its time budget (see `time_budget`).
+    """
+
+
+@contextlib.contextmanager
+def time_budget(seconds: float | None):
+    """
+    Interrupts a block of code that runs for longer than the given number of seconds,
+    by raising `TimeBudgetExceeded` in it. Regex matching checks for signals as it goes,
+    so a match that backtracks for too long is interrupted as well.
+
+    The budget relies on `SIGALRM`, so it is only enforced in the main thread
+    on platforms that have it (not on Windows), the block just runs to completion elsewhere.
+
+    Args:
+        seconds (float | None): The time budget, or None for no budget.
+    """
+    if (
+        not seconds
+        or not hasattr(signal, "setitimer")
+        or threading.current_thread() is not threading.main_thread()
+    ):
+        yield
+        return
+
+    def on_alarm(signum, frame):
+        raise TimeBudgetExceeded(f"Time budget of {seconds}s exceeded")
+
+    prev_handler = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, prev_handler)
@@ -1,8 +1,9 @@
 import argparse
+import concurrent.futures
 import logging
 import sys
 
-from lib import chat, dataset
+from lib import cache, chat, dataset, regex_registry, search_terms
 
 header_text = """
  ██████╗██╗  ██╗ █████╗ ████████╗   ██████╗ ███████╗ ██████╗ ███████╗██╗  ██╗
@@ -54,25 +55,82 @@ def main():
     print("=" * 80)
     print(header_text)
 
-    input_path = args.input
-    # TODO: Error checking if file exists or not a valid text file?
-    data = dataset.read_data(input_path)
-
-    data_proc = dataset.preprocess_data(data)
-
-    # with open(f"{os.path.splitext(input_path)[0]}_proc.txt", "w") as f:
-    #     f.write(data_proc)
-
-    bot = chat.ChatBot(data_proc)
-
-    # with open(f"{os.path.splitext(input_path)[0]}_features.json", "w") as f:
-    #     json.dump(bot.data_map, f, indent=4)
+    # A single book, or a corpus of books loaded into the same index
+    input_paths = dataset.find_books(args.input)
+    if not input_paths:
+        logging.error(f"No text files found at: {args.input}")
+        sys.exit(1)
+
+    bot = None
+    if not args.no_cache:
+        bot = cache.load(input_paths, words_around=args.words_around)
+
+    if bot is None:
+        # The chapters are preprocessed and indexed on a pool of worker processes if requested
+        executor = None
+        if args.workers > 1:
+            executor = concurrent.futures.ProcessPoolExecutor(args.workers)
+
+        bot = chat.ChatBot(words_around=args.words_around)
+
+        try:
+            for input_path in input_paths:
+                # Each book is tagged with its own search terms (character names, etc.)
+                name = search_terms.get_book_name(input_path)
+                query_terms = search_terms.get_book_query_terms(name)
+                metadata = dataset.read_metadata(input_path)
+
+                # The text is preprocessed and indexed one chapter at a time, as it is read
+                lines = dataset.read_lines(input_path)
+
+                bot.build_data_map_from_lines(
+                    lines,
+                    executor,
+                    name=name,
+                    title=metadata.get("Title", name),
+                    author=metadata.get("Author", ""),
+                    query_terms=query_terms,
+                )
+        finally:
+            # the chapters still queued are dropped if the indexing failed
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        if not args.no_cache:
+            # the text of the sentences is memory-mapped from a file saved along with the cache
+            # (or kept in memory, and pickled with the cache, if the file can't be written)
+            try:
+                bot.store.map_text(cache.get_text_path(input_paths))
+            except OSError as e:
+                logging.warning(f"Failed to save the text of the sentences: {e}")
+            cache.save(input_paths, bot, words_around=args.words_around)
+
+    # the time budget isn't part of the cached state
+    bot.time_budget = args.time_budget
+
+    if args.seed is not None:
+        chat.AIResponse.seed(args.seed)
+
+    if args.fuzz:
+        results = chat.fuzz.fuzz_intents(bot)
+        chat.fuzz.log_results(results)
+        if any(res["superlinear"] for res in results):
+            logging.error("Routing time grows superlinearly for some intents")
+            sys.exit(1)
+        return
 
     if args.test:
         run_tests(bot)
+        regex_registry.log_stats()
+        bot.router.log_stats()
         return
 
-    bot.start()
+    regex_registry.log_stats()
+
+    try:
+        bot.start()
+    finally:
+        bot.router.log_stats()
 
 
 def parse_args():
@@ -82,7 +140,7 @@ def parse_args():
         "--input",
         type=str,
         required=True,
-        help="path to input text file",
+        help="path to input text file, or to a directory (or glob pattern) of text files to load as a corpus",
     )
     parser.add_argument(
         "-v",
@@ -90,6 +148,41 @@ def parse_args():
         action="store_true",
         help="increase console output verbosity",
     )
+    parser.add_argument(
+        "-w",
+        "--words-around",
+        type=int,
+        default=3,
+        help="number of words kept before and after each mention for `words around` queries",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes used to preprocess and index the chapters in parallel",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="always preprocess the input from scratch instead of using (and updating) the cache",
+    )
+    parser.add_argument(
+        "--time-budget",
+        type=float,
+        default=0,
+        help="maximum number of seconds spent answering a message, enforced with SIGALRM where available (0 for no limit, the default)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="seed of the random choices made when rendering the responses, for reproducible answers",
+    )
+    parser.add_argument(
+        "--fuzz",
+        action="store_true",
+        help="runs the worst-case latency fuzzing harness on the chat intents instead of the chat, failing if any of them is superlinear",
+    )
     parser.add_argument(
         "-t",
         "--test",
@@ -0,0 +1,83 @@
+"""
+Benchmark of finding the mentions of two tags in the same sentence: the sorted merge
+of their postings lists (`inverted_index.intersect_sentences`) against comparing every
+mention of one tag with every mention of the other, as `get_cooccurance` used to.
+
+Run from the root of the repository:
+
+    python -m scripts.bench_cooccurrences
+"""
+import argparse
+import glob
+import logging
+import timeit
+
+from lib import chat, dataset, inverted_index, search_terms
+
+
+def nested_loop(postings1, postings2):
+    return [
+        (posting1, posting2)
+        for posting1 in postings1
+        for posting2 in postings2
+        # same chapter_idx and sentence_idx
+        if posting1[:2] == posting2[:2]
+    ]
+
+
+def build_bot(paths: list[str]):
+    bot = chat.ChatBot()
+    for path in paths:
+        name = search_terms.get_book_name(path)
+        bot.build_data_map_from_lines(
+            dataset.read_lines(path),
+            name=name,
+            query_terms=search_terms.get_book_query_terms(name),
+        )
+    return bot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=3, help="best of this many runs")
+    parser.add_argument(
+        "--copies", type=int, default=10, help="copies of the books in the corpus"
+    )
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    books = sorted(glob.glob("dataset/*.txt"))
+
+    cases = [
+        (search_terms.get_book_name(path), build_bot([path]), "suspect")
+        for path in books
+    ]
+    corpus = build_bot(books * args.copies)
+    cases += [
+        (f"all books x{args.copies}", corpus, "perpetrator"),
+        (f"all books x{args.copies}", corpus, "suspect"),
+    ]
+
+    print(f"{'books':<28} {'tags':<26} {'nested':>10} {'merge':>10}")
+    for name, bot, tag in cases:
+        postings1, postings2 = bot.index.get("investigator"), bot.index.get(tag)
+        assert nested_loop(postings1, postings2) == inverted_index.intersect_sentences(
+            postings1, postings2
+        )
+
+        times = [
+            min(
+                timeit.repeat(
+                    lambda: fn(postings1, postings2), number=1, repeat=args.repeat
+                )
+            )
+            for fn in (nested_loop, inverted_index.intersect_sentences)
+        ]
+        print(
+            f"{name:<28} {'investigator/' + tag:<26} "
+            + " ".join(f"{t * 1000:>8.2f}ms" for t in times)
+        )
+
+
+if __name__ == "__main__":
+    main()
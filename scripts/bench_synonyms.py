@@ -0,0 +1,113 @@
+"""
+Benchmark of the synonym substitution of the responses (`AIResponse.create_variation`),
+a single pass with an alternation of all the phrases, against the substitution of
+each phrase in turn it replaced.
+
+Run from the root of the repository:
+
+    python -m scripts.bench_synonyms
+"""
+import argparse
+import glob
+import importlib
+import logging
+import re
+import timeit
+
+from lib import dataset, search_terms
+from lib.chat import AIResponse, ChatBot, example_prompts
+
+ai_response = importlib.import_module("lib.chat.AIResponse")
+
+
+def match_case(original: str, synonym: str) -> str:
+    # the casing of the first word of the original phrase is kept
+    words = synonym.split(" ")
+    if original.islower():
+        words[0] = words[0].lower()
+    elif original.isupper():
+        words[0] = words[0].upper()
+    elif original.istitle():
+        words[0] = words[0].title()
+    return " ".join(words)
+
+
+def phrase_by_phrase(text: str, choice) -> str:
+    for synonym, synonym_list in ai_response.response_phrase_permutation_map.items():
+        text = re.compile(r"\b" + synonym + r"\b", re.IGNORECASE).sub(
+            lambda m: match_case(m.group(0), choice(synonym_list)), text
+        )
+    return text
+
+
+class First:
+    """
+    Random generator always picking the first alternative, to compare the outputs.
+    """
+
+    @staticmethod
+    def choice(seq):
+        return seq[0]
+
+
+def get_answers() -> list[str]:
+    answers = []
+    for path in sorted(glob.glob("dataset/*.txt")):
+        name = search_terms.get_book_name(path)
+        bot = ChatBot()
+        bot.build_data_map_from_lines(
+            dataset.read_lines(path),
+            name=name,
+            query_terms=search_terms.get_book_query_terms(name),
+        )
+        prompts = example_prompts.samples + [
+            f"Words around the {tag}" for tag in search_terms.all_query_terms
+        ]
+        answers += [str(bot.answer(prompt)) for prompt in prompts]
+    return answers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    answers = get_answers()
+
+    rng, ai_response._rng = ai_response._rng, First()
+    try:
+        assert [phrase_by_phrase(answer, First.choice) for answer in answers] == [
+            AIResponse.create_variation(answer) for answer in answers
+        ]
+    finally:
+        ai_response._rng = rng
+
+    text = "\n".join(answers)
+    cases = [
+        (
+            f"largest answer ({len(max(answers, key=len))} chars)",
+            [max(answers, key=len)],
+        ),
+        (f"all {len(answers)} answers", answers),
+        (f"all answers x2 ({len(text) * 2} chars)", [text] * 2),
+    ]
+
+    print(f"{'text':<40} {'before':>10} {'after':>10}")
+    for name, texts in cases:
+        times = [
+            min(
+                timeit.repeat(
+                    lambda: [fn(text) for text in texts], number=1, repeat=args.repeat
+                )
+            )
+            for fn in (
+                lambda text: phrase_by_phrase(text, ai_response._rng.choice),
+                AIResponse.create_variation,
+            )
+        ]
+        print(f"{name:<40} {times[0] * 1e3:>8.1f}ms {times[1] * 1e3:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark of the single-pass whitespace normalization (`preprocessing.remove_extra_whitespace`)
+against the chain of four regexes it replaced.
+
+Run from the root of the repository:
+
+    python -m scripts.bench_whitespace
+"""
+import argparse
+import glob
+import os
+import re
+import timeit
+
+from lib import preprocessing
+from lib.chat import example_prompts
+
+
+def regex_chain(
+    text: str, max_consecutive_spaces: int = 1, max_consecutive_newlines: int = 3
+) -> str:
+    # [^\S\r\n] -> any whitespace EXCEPT newlines and carriage returns
+    text = re.sub(
+        r"[^\S\r\n]{" + str(max_consecutive_spaces) + r",}",
+        " " * max_consecutive_spaces,
+        text,
+    )
+    text = re.sub(
+        r"[\r\n]{" + str(max_consecutive_newlines) + r",}",
+        "\n" * max_consecutive_newlines,
+        text,
+    )
+    text = re.sub(r"^[^\S\r\n]+", "", text, flags=re.MULTILINE)
+    text = re.sub(r"[^\S\r\n]+$", "", text, flags=re.MULTILINE)
+    return text.strip()
+
+
+def best_of(fn, texts: list[str], repeat: int) -> float:
+    return min(
+        timeit.repeat(lambda: [fn(text) for text in texts], number=1, repeat=repeat)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5, help="best of this many runs")
+    args = parser.parse_args()
+
+    cases = []
+    for path in sorted(glob.glob("dataset/*.txt")):
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        name = os.path.basename(path)
+        cases.append((f"{name} (whole text)", [text], "ms"))
+        cases.append((f"{name} (line by line)", text.split("\n"), "ms"))
+    # the short strings normalized when answering (per string)
+    cases.append(("user messages", example_prompts.samples, "us"))
+    cases.append(("words-around fragments", ["  the  man\twho ", " said  it "], "us"))
+
+    print(f"{'text':<48} {'before':>10} {'after':>10}")
+    for name, texts, unit in cases:
+        assert [regex_chain(text) for text in texts] == [
+            preprocessing.remove_extra_whitespace(text) for text in texts
+        ]
+
+        times = [
+            best_of(fn, texts, args.repeat)
+            for fn in (regex_chain, preprocessing.remove_extra_whitespace)
+        ]
+        if unit == "ms":
+            times = [f"{t * 1e3:.1f}ms" for t in times]
+        else:
+            times = [f"{t / len(texts) * 1e6:.1f}us" for t in times]
+        print(f"{name:<48} {times[0]:>10} {times[1]:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Shared helpers of the tests: the bundled books and the golden outputs.
+
+The golden outputs pin the results of the optimized preprocessing. They were checked
+against the regex implementations it replaced when they were first generated.
+Run the tests with `UPDATE_GOLDEN=1` to regenerate them after an intended change of behavior.
+"""
+import functools
+import hashlib
+import json
+import os
+from typing import Callable, Iterable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+BOOKS = sorted(
+    os.path.join(ROOT, "dataset", name)
+    for name in os.listdir(os.path.join(ROOT, "dataset"))
+    if name.endswith(".txt")
+)
+
+
+def book_name(path: str) -> str:
+    return os.path.basename(path)
+
+
+def read_book(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def digest(texts: Iterable[str]) -> str:
+    """
+    Hashes a sequence of strings (e.g. the lines of a preprocessed book), for the golden outputs
+    too large to be kept as they are.
+    """
+    h = hashlib.sha256()
+    for text in texts:
+        h.update(text.encode("utf-8", "surrogatepass"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+@functools.cache
+def golden(name: str, compute: Callable[[], dict]) -> dict:
+    """
+    Returns the golden outputs saved in `tests/data/{name}.json`.
+    With `UPDATE_GOLDEN=1`, they are computed with the current code and saved first.
+    """
+    path = os.path.join(DATA_DIR, f"{name}.json")
+    if os.environ.get("UPDATE_GOLDEN") == "1":
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(compute(), f, indent=1, ensure_ascii=False)
+            f.write("\n")
+
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+@functools.cache
+def load_bot(*paths: str):
+    """
+    Builds the chat bot on the given books, the way `main.py` does without the cache.
+    The bots are shared by the tests, which must not modify them.
+    """
+    from lib import chat, dataset, search_terms
+
+    bot = chat.ChatBot()
+    for path in paths:
+        name = search_terms.get_book_name(path)
+        query_terms = search_terms.get_book_query_terms(name)
+        metadata = dataset.read_metadata(path)
+        bot.build_data_map_from_lines(
+            dataset.read_lines(path),
+            name=name,
+            title=metadata.get("Title", name),
+            author=metadata.get("Author", ""),
+            query_terms=query_terms,
+        )
+    return bot
@@ -0,0 +1,107 @@
+"""
+Tests of the rendering of the responses: the compiled (flat) rendering against
+the recursive rendering it replaced, and the reproducibility of the seeded answers.
+"""
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+from lib.chat import AIResponse, example_prompts
+from tests import helpers
+
+# a nested message, the separators in it, and choices that may render nothing
+GREETING = AIResponse(["Hello", "Hi", None], AIResponse("there", ["friend", ""]), "!")
+
+
+def reference_render(msg: AIResponse, rng: random.Random) -> str:
+    # every part in turn, the random choices being made as they come
+    parts = []
+    for p in msg.msg_parts:
+        if isinstance(p, list):
+            p = rng.choice(p)
+            if not p:
+                continue
+        if isinstance(p, AIResponse):
+            parts.append(reference_render(p, rng))
+        elif p:
+            parts.append(str(p))
+    return msg.join.join(parts)
+
+
+def random_message(rng: random.Random, depth: int = 0) -> AIResponse:
+    parts = []
+    for _ in range(rng.randint(0, 5)):
+        kind = rng.random()
+        if kind < 0.35:
+            parts.append(rng.choice(["a", "b c", "", "\n", "x."]))
+        elif kind < 0.7:
+            alternatives = ["p", "q", None, "", 7]
+            if depth < 3:
+                alternatives.append(random_message(rng, depth + 1))
+            parts.append([rng.choice(alternatives) for _ in range(rng.randint(1, 4))])
+        elif depth < 3:
+            parts.append(random_message(rng, depth + 1))
+    return AIResponse(*parts, join=rng.choice([" ", "", "\n", ", "]))
+
+
+def test_greeting():
+    renders = {GREETING.render(random.Random(seed)) for seed in range(100)}
+    assert renders == {
+        f"{hello}{sep}there{friend} !"
+        for hello, sep in [("Hello", " "), ("Hi", " "), ("", "")]
+        for friend in [" friend", ""]
+    }
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_random_messages(seed):
+    rng = random.Random(seed)
+    for i in range(2000):
+        msg = random_message(rng)
+        for render_seed in range(3):
+            assert msg.render(random.Random(render_seed)) == reference_render(
+                msg, random.Random(render_seed)
+            ), (i, render_seed)
+
+
+def test_answers():
+    bot = helpers.load_bot(*helpers.BOOKS)
+    for prompt in example_prompts.samples:
+        answer = bot.answer(prompt)
+        for seed in range(3):
+            assert answer.render(random.Random(seed)) == reference_render(
+                answer, random.Random(seed)
+            ), prompt
+
+
+def test_seed():
+    bot = helpers.load_bot(*helpers.BOOKS)
+
+    def answers(seed: int) -> list[str]:
+        AIResponse.seed(seed)
+        return [
+            bot.postprocess_msg(str(bot.answer(prompt)), use_synonyms=True)
+            for prompt in example_prompts.samples
+        ]
+
+    assert answers(1) == answers(1)
+    assert answers(1) != answers(2)
+
+
+def test_seed_option(tmp_path):
+    # the same answers from different processes, whatever the hash seed
+    def run(hash_seed: str) -> str:
+        return subprocess.run(
+            [sys.executable, os.path.join(helpers.ROOT, "main.py")]
+            + ["-i", helpers.BOOKS[-1], "-t", "--no-cache", "--seed", "1"],
+            cwd=tmp_path,
+            env={**os.environ, "PYTHONHASHSEED": hash_seed},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+    assert run("0") == run("1")
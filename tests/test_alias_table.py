@@ -0,0 +1,118 @@
+"""
+Tests of the resolution of the query terms to tags, against the table of all
+the substrings of the aliases the suffix automaton replaced.
+"""
+import random
+
+import pytest
+
+from lib import inverted_index, search_terms, term_matcher
+from tests import helpers
+
+
+def substring_table(strings: list[tuple[str, object]]) -> dict[str, object]:
+    table = {}
+    for string, value in strings:
+        for i in range(len(string)):
+            for j in range(i + 1, len(string) + 1):
+                table.setdefault(string[i:j], value)
+    return table
+
+
+def book_aliases() -> list[dict[str, list[str]]]:
+    # the aliases of the corpus, and of each of its books (see `ChatBot.build_aliases`)
+    bot = helpers.load_bot(*helpers.BOOKS)
+    indexes = [bot.index]
+    indexes += [bot.for_book(i).index for i in range(len(bot.store.book_names))]
+    return [
+        {
+            tag: [tag, *index.terms(tag)]
+            for tag in search_terms.book_query_terms
+            if tag in index
+        }
+        for index in indexes
+    ]
+
+
+def queries(strings: list[str], rng: random.Random) -> list[str]:
+    alphabet = sorted(set("".join(strings))) + ["\0"]
+    queries = ["", "\0", "x", "zzz"]
+    for string in strings:
+        queries += [
+            string[i:j] for i in range(len(string)) for j in range(i, len(string) + 1)
+        ]
+        queries += [f"the {string}", f"{string}s", f"{string}\0", f"\0{string}"]
+    queries += [
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 6)))
+        for _ in range(2000)
+    ]
+    return queries
+
+
+def test_priority():
+    automaton = term_matcher.SuffixAutomaton()
+    automaton.add("abcd", "first")
+    automaton.add("xbcy", "second")
+    automaton.add("bc", "third")
+    automaton.build()
+    # the first string added containing the substring wins
+    assert automaton.get("bc") == "first"
+    assert automaton.get("bcy") == "second"
+    assert automaton.get("xb") == "second"
+    assert automaton.get("abcy") is None
+
+
+def test_empty_and_separator():
+    automaton = term_matcher.SuffixAutomaton()
+    automaton.add("ab", 1)
+    automaton.add("cd", 2)
+    automaton.build()
+    assert automaton.get("", "default") == "default"
+    # no substring spans two strings
+    assert automaton.get("b\0c") is None
+    assert automaton.get("\0") is None
+    assert automaton.get("bc") is None
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_random_strings(seed):
+    rng = random.Random(seed)
+    strings = [
+        ("".join(rng.choice("abc ") for _ in range(rng.randint(0, 8))), i)
+        for i in range(rng.randint(1, 12))
+    ]
+    automaton = term_matcher.SuffixAutomaton()
+    for string, value in strings:
+        automaton.add(string, value)
+    automaton.build()
+
+    table = substring_table(strings)
+    for query in queries([s for s, _ in strings], rng):
+        assert automaton.get(query) == table.get(query), query
+
+
+def test_book_aliases():
+    rng = random.Random(0)
+    for aliases in book_aliases():
+        alias_table = inverted_index.AliasTable(aliases)
+        strings = [
+            (alias.lower(), tag)
+            for tag, tag_aliases in aliases.items()
+            for alias in tag_aliases
+        ]
+        table = substring_table(strings)
+        priority = {tag: i for i, tag in enumerate(aliases)}
+        exact = dict(reversed(strings))
+
+        for query in queries([s for s, _ in strings], rng):
+            assert alias_table.substrings.get(query) == table.get(query), query
+
+            # the resolution of the alias table before the suffix automaton
+            if query in exact:
+                expected = exact[query]
+            else:
+                candidates = [tag for string, tag in strings if string in query]
+                if query in table:
+                    candidates.append(table[query])
+                expected = min(candidates, key=priority.__getitem__, default=None)
+            assert alias_table.resolve(query) == expected, query
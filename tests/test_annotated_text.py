@@ -0,0 +1,84 @@
+"""
+Tests of the export of the annotated chapters to the inline format, and of reading them back.
+"""
+import pytest
+
+from lib import dataset, search_terms
+from lib.annotated_text import AnnotatedText
+from lib.chat.ChatBot import read_chapters
+from lib.special_tokens import SpecialTokens
+from tests import helpers
+
+CHAPTER = (
+    "CHAPTER I. The Science of Deduction\n\n"
+    "Sherlock Holmes took his bottle. Dr. Watson sat.\nHe smiled.\n\n"
+    "The end came"
+)
+
+
+def spans(chapter: AnnotatedText) -> dict:
+    return {
+        "title": chapter.title,
+        "sentences": list(
+            zip(
+                chapter.sentence_starts,
+                chapter.sentence_ends,
+                chapter.sentence_paragraphs,
+            )
+        ),
+        "tags": [
+            (chapter.tags[tag_id], start, end)
+            for tag_id, start, end in zip(
+                chapter.tag_ids, chapter.tag_starts, chapter.tag_ends
+            )
+        ],
+    }
+
+
+def test_to_inline():
+    chapter = dataset.preprocess_chapter(SpecialTokens.START_OF_CHAPTER + CHAPTER)
+    assert chapter.to_inline() == (
+        "<SOC>CHAPTER I. The Science of Deduction\n\n"
+        "Sherlock Holmes<INVESTIGATOR> took his bottle.<EOS>\n"
+        "Dr. Watson sat.<EOS>\nHe smiled.<EOS>\n\n"
+        "The end came"
+    )
+    assert spans(chapter) == {
+        "title": "CHAPTER I. The Science of Deduction",
+        "sentences": [(37, 69, 1), (70, 85, 1), (86, 96, 1)],
+        "tags": [("investigator", 37, 52)],
+    }
+
+
+@pytest.mark.parametrize("path", helpers.BOOKS, ids=helpers.book_name)
+def test_books(path):
+    query_terms = search_terms.get_book_query_terms(search_terms.get_book_name(path))
+    matcher = search_terms.compile_term_matcher(query_terms)
+    chapters = [
+        chapter
+        for chapter in dataset.preprocess_lines(
+            dataset.read_lines(path), None, query_terms
+        )
+        if chapter.is_chapter
+    ]
+    assert chapters
+
+    for chapter in chapters:
+        inline = chapter.to_inline()
+        assert inline.startswith(SpecialTokens.START_OF_CHAPTER)
+
+        # inline -> annotated text -> inline
+        read_back = AnnotatedText.from_inline(
+            inline[len(SpecialTokens.START_OF_CHAPTER) :], is_chapter=True
+        )
+        read_back.find_tags(matcher)
+        assert read_back.to_inline() == inline
+
+        # the same spans as the chapter preprocessed from the raw text
+        assert spans(read_back) == spans(chapter)
+
+    # the whole book in the inline format, split into chapters
+    inline = "".join(chapter.to_inline() for chapter in chapters)
+    read_back = list(read_chapters(inline, query_terms))
+    assert [spans(chapter) for chapter in read_back] == list(map(spans, chapters))
+    assert "".join(chapter.to_inline() for chapter in read_back) == inline
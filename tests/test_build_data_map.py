@@ -0,0 +1,51 @@
+"""
+Tests that a book is indexed the same way from its preprocessed chapters or from its raw
+lines, serially or on a process pool.
+"""
+import concurrent.futures
+
+import pytest
+
+from lib import chat, dataset, search_terms
+from tests import helpers
+
+
+def book_state(bot) -> dict:
+    # everything the answers are computed from
+    return {
+        "store": {
+            key: bytes(value) if key == "text" else value
+            for key, value in vars(bot.store).items()
+        },
+        "postings": bot.index.postings,
+        "term_postings": bot.index.term_postings,
+        "kwic": bot.kwic,
+    }
+
+
+def build(path: str, from_lines: bool, executor=None):
+    name = search_terms.get_book_name(path)
+    query_terms = search_terms.get_book_query_terms(name)
+    bot = chat.ChatBot()
+    lines = dataset.read_lines(path)
+    if from_lines:
+        bot.build_data_map_from_lines(
+            lines, executor, name=name, query_terms=query_terms
+        )
+    else:
+        bot.build_data_map(
+            dataset.preprocess_lines(lines, executor, query_terms),
+            executor,
+            name=name,
+            query_terms=query_terms,
+        )
+    return bot
+
+
+@pytest.mark.parametrize("from_lines", [False, True])
+def test_process_pool(from_lines):
+    path = helpers.BOOKS[-1]
+    expected = book_state(build(path, from_lines=False))
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        assert book_state(build(path, from_lines, executor)) == expected
+    assert book_state(build(path, from_lines)) == expected
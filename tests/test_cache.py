@@ -0,0 +1,119 @@
+"""
+Tests of the on-disk cache of the index (see `lib/cache.py`).
+"""
+import os
+import random
+import shutil
+import sys
+import types
+
+import pytest
+
+from lib import cache, chat, dataset
+from tests import helpers
+
+
+@pytest.fixture
+def book(tmp_path) -> str:
+    (tmp_path / "books").mkdir()
+    path = tmp_path / "books" / helpers.book_name(helpers.BOOKS[-1])
+    shutil.copy(helpers.BOOKS[-1], path)
+    return str(path)
+
+
+def build_and_save(input_paths: list[str], words_around: int = 3):
+    # the way `main.py` builds and caches the index
+    bot = chat.ChatBot(words_around=words_around)
+    for path in input_paths:
+        bot.build_data_map_from_lines(dataset.read_lines(path))
+    bot.store.map_text(cache.get_text_path(input_paths))
+    cache.save(input_paths, bot, words_around=words_around)
+    return bot
+
+
+def test_round_trip(book):
+    bot = build_and_save([book])
+    loaded = cache.load([book], words_around=3)
+    assert loaded is not None
+    assert bytes(loaded.store.text) == bytes(bot.store.text)
+    assert loaded.index.postings == bot.index.postings
+    msg = "When is the perpetrator first mentioned?"
+    assert loaded.answer(msg).render(random.Random(0)) == bot.answer(msg).render(
+        random.Random(0)
+    )
+
+
+def test_key_input_file(book):
+    key = cache.get_cache_key([book], words_around=3)
+    with open(book, "a", encoding="utf-8") as f:
+        f.write("\n")
+    assert cache.get_cache_key([book], words_around=3) != key
+
+
+def test_key_words_around(book):
+    assert cache.get_cache_key([book], words_around=3) != cache.get_cache_key(
+        [book], words_around=4
+    )
+
+
+def test_key_pipeline_module(book, tmp_path, monkeypatch):
+    # a stand-in for one of the modules of the pipeline, whose source is edited
+    source = tmp_path / "module.py"
+    source.write_text("A = 1\n")
+    module = types.ModuleType("module")
+    module.__file__ = str(source)
+    monkeypatch.setitem(sys.modules, "module", module)
+    monkeypatch.setattr(cache, "PIPELINE_MODULES", [*cache.PIPELINE_MODULES, "module"])
+
+    key = cache.get_cache_key([book], words_around=3)
+    source.write_text("A = 2\n")
+    assert cache.get_cache_key([book], words_around=3) != key
+
+
+def test_outdated(book):
+    build_and_save([book], words_around=3)
+    assert cache.load([book], words_around=4) is None
+
+
+def test_corrupt_pickle(book):
+    build_and_save([book])
+    cache_path = cache.get_cache_path([book])
+    with open(cache_path, "r+b") as f:
+        f.seek(os.path.getsize(cache_path) // 2)
+        f.truncate()
+    assert cache.load([book], words_around=3) is None
+
+
+def test_wrong_size_text(book):
+    build_and_save([book])
+    with open(cache.get_text_path([book]), "ab") as f:
+        f.write(b"extra")
+    assert cache.load([book], words_around=3) is None
+
+
+def test_missing_text(book):
+    build_and_save([book])
+    os.remove(cache.get_text_path([book]))
+    assert cache.load([book], words_around=3) is None
+
+
+def test_moved(book, tmp_path):
+    # the cache, its text file and the book moved together to another directory
+    bot = build_and_save([book])
+    os.rename(tmp_path / "books", tmp_path / "moved")
+
+    book = str(tmp_path / "moved" / os.path.basename(book))
+    loaded = cache.load([book], words_around=3)
+    assert loaded is not None
+    assert loaded.store.text_path == os.path.abspath(cache.get_text_path([book]))
+    assert bytes(loaded.store.text) == bytes(bot.store.text)
+
+
+def test_changed_text(book):
+    build_and_save([book])
+    # same size, different content
+    with open(cache.get_text_path([book]), "r+b") as f:
+        first = f.read(1)
+        f.seek(0)
+        f.write(b"#" if first != b"#" else b"%")
+    assert cache.load([book], words_around=3) is None
@@ -0,0 +1,51 @@
+"""
+Equivalence tests of the character set normalization (a translation table built one
+character at a time) against normalizing the whole text to NFD first, as it used to.
+"""
+import random
+import unicodedata
+
+import pytest
+
+from lib import preprocessing, utils
+from tests import helpers
+
+# precomposed letters, combining marks, ligatures, Hangul syllables and jamo,
+# singletons (the Kelvin and Angstrom signs, a CJK compatibility ideograph),
+# the punctuation of `SPECIAL_CHARACTERS`, and plain ASCII around them
+ALPHABET = ["a", "e", "A", " ", ".", "é", "Å", "ñ", "ü", "ǅ", "ῷ", "ḍ", "ệ"]
+ALPHABET += ["\u0301", "\u0323", "\u0308", "\u0345", "\u20dd"]
+ALPHABET += ["ﬁ", "ﬀ", "æ", "œ", "Ĳ", "ß", "ǆ"]
+ALPHABET += ["한", "글", "\u1100", "\u1161", "\u11a8", "ㄱ"]
+ALPHABET += ["\u212a", "\u212b", "\uf900", "’", "“", "…", "—", "£", "™", "\ufeff"]
+
+
+def reference_normalize_character_set(text: str) -> str:
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(char for char in text if unicodedata.category(char) != "Mn")
+    return text.translate(str.maketrans(preprocessing.SPECIAL_CHARACTERS))
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_random_strings(seed):
+    rng = random.Random(seed)
+    for _ in range(5000):
+        text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 10)))
+        assert preprocessing.normalize_character_set(
+            text
+        ) == reference_normalize_character_set(text), ascii(text)
+
+
+@pytest.mark.parametrize("path", helpers.BOOKS, ids=helpers.book_name)
+def test_books(path):
+    text = helpers.read_book(path)
+    assert preprocessing.normalize_character_set(
+        text
+    ) == reference_normalize_character_set(text)
+
+
+def test_translation_table():
+    # the table only covers the characters of the text, the cache is bounded
+    table = preprocessing.get_translation_table(utils.extract_unicode_charset("é ﬁ"))
+    assert table == {ord("é"): "e", ord("ﬁ"): "ﬁ"}
+    assert preprocessing.translate_character.cache_info().maxsize is not None
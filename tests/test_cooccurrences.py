@@ -0,0 +1,148 @@
+"""
+Tests of the co-occurrences of two terms within a number of sentences, or in the same
+paragraph or chapter (see `inverted_index.intersect_window`).
+"""
+import itertools
+
+import pytest
+
+from lib import inverted_index, search_terms
+from tests import helpers
+
+
+def posting(chapter_idx: int, sentence_idx: int) -> inverted_index.Posting:
+    return chapter_idx, sentence_idx, 0, 1
+
+
+def brute_force_window(postings1, postings2, window, key):
+    """
+    The mentions of the first list with a mention of the second one nearby,
+    and the distance to the nearest one.
+    """
+    pairs = []
+    for p1 in postings1:
+        group1, position1 = key(p1)
+        distances = [
+            abs(position2 - position1)
+            for group2, position2 in map(key, postings2)
+            if group2 == group1 and abs(position2 - position1) <= window
+        ]
+        if distances:
+            pairs.append((p1, min(distances)))
+    return pairs
+
+
+@pytest.mark.parametrize("window", range(4))
+def test_window_distance(window):
+    # the second term exactly `window` sentences after the first, then one more
+    at_window = [posting(1, 10)], [posting(1, 10 + window)]
+    assert inverted_index.intersect_window(*at_window, window) == [
+        (posting(1, 10), posting(1, 10 + window))
+    ]
+    past_window = [posting(1, 10)], [posting(1, 11 + window)]
+    assert inverted_index.intersect_window(*past_window, window) == []
+
+
+@pytest.mark.parametrize("window", range(4))
+def test_window_other_term_first(window):
+    assert inverted_index.intersect_window(
+        [posting(1, 10)], [posting(1, 10 - window)], window
+    ) == [(posting(1, 10), posting(1, 10 - window))]
+    assert (
+        inverted_index.intersect_window(
+            [posting(1, 10)], [posting(1, 9 - window)], window
+        )
+        == []
+    )
+
+
+def test_window_nearest():
+    postings2 = [posting(1, 5), posting(1, 9), posting(1, 12), posting(2, 10)]
+    assert inverted_index.intersect_window(
+        [posting(1, 10), posting(1, 11), posting(2, 1)], postings2, 3
+    ) == [
+        (posting(1, 10), posting(1, 9)),
+        (posting(1, 11), posting(1, 12)),
+    ]
+
+
+def test_window_across_chapters():
+    # the last sentence of a chapter and the first one of the next are not close
+    assert inverted_index.intersect_window([posting(1, 30)], [posting(2, 1)], 100) == []
+    assert inverted_index.intersect_window([posting(2, 1)], [posting(1, 30)], 100) == []
+
+
+@pytest.mark.parametrize("scope", ["sentence", "paragraph", "chapter"])
+def test_book(scope):
+    bot = helpers.load_bot(helpers.BOOKS[-1])
+    key = {
+        "sentence": inverted_index.sentence_key,
+        "paragraph": bot.paragraph_key,
+        "chapter": bot.chapter_key,
+    }[scope]
+
+    tags = [tag for tag in search_terms.all_query_terms if tag in bot.index]
+    assert len(tags) > 1
+    for tag1, tag2 in itertools.permutations(tags, 2):
+        for window in (0, 1, 3) if scope == "sentence" else (0,):
+            postings1, postings2 = bot.index.get(tag1), bot.index.get(tag2)
+            pairs = bot.index.window_cooccurrences(tag1, tag2, window, key)
+            assert [
+                (p1, abs(key(p2)[1] - key(p1)[1])) for p1, p2 in pairs
+            ] == brute_force_window(postings1, postings2, window, key)
+
+            for p1, p2 in pairs:
+                # never across a chapter, nor across a paragraph in the paragraph scope
+                assert p1[0] == p2[0]
+                if scope == "paragraph":
+                    assert bot.store.paragraph(*p1[:2]) == bot.store.paragraph(*p2[:2])
+
+
+@pytest.mark.parametrize(
+    "msg,groups",
+    [
+        (
+            "Where do the detective and perpetrator co-occur within 2 sentences?",
+            {"num": "2", "scope": None},
+        ),
+        (
+            "Do the detective and the perpetrator appear in the same paragraph?",
+            {"num": None, "scope": "paragraph"},
+        ),
+        (
+            "When are the detective and the perpetrator both mentioned in the same chapter?",
+            {"num": None, "scope": "chapter"},
+        ),
+        (
+            "Within 3 sentences, do the detective and perpetrator co-occur?",
+            {"num": "3", "scope": None},
+        ),
+    ],
+)
+def test_routing(msg, groups):
+    # the windowed co-occurrences are tried before the co-occurrences in the same sentence
+    bot = helpers.load_bot(helpers.BOOKS[-1])
+    intent, route_groups, _, _ = bot.route(msg)
+    assert intent.name.startswith("WORDS_COOCCUR_WINDOW")
+    assert route_groups == {**groups, "term1": "detective", "term2": "perpetrator"}
+
+    intent, _, _, _ = bot.route(
+        "In which chapters do the detective and perpetrator co-occur?"
+    )
+    assert intent.name.startswith("WORDS_COOCCUR_V")
+
+
+def test_answer():
+    bot = helpers.load_bot(helpers.BOOKS[-1])
+    pairs = bot.find_cooccurrences("detective", "perpetrator", 2)
+    assert pairs
+    for mention1, mention2 in pairs:
+        assert mention1["chapter_idx"] == mention2["chapter_idx"]
+        assert abs(mention1["sentence_idx"] - mention2["sentence_idx"]) <= 2
+
+    answer = str(
+        bot.answer(
+            "Where do the detective and perpetrator co-occur within 2 sentences?"
+        )
+    )
+    assert "within 2 sentences of each other" in answer
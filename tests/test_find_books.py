@@ -0,0 +1,43 @@
+"""
+Tests of the references to the books of a corpus in the messages.
+"""
+import pytest
+
+from tests import helpers
+
+BROWN_SUIT, LINKS, SIGN_OF_FOUR = range(3)
+
+CASES = [
+    # the two books by Agatha Christie
+    (
+        "Words around the crime by Christie",
+        [BROWN_SUIT, LINKS],
+        "Words around the crime",
+    ),
+    ("patterns by Agatha Christie", [BROWN_SUIT, LINKS], "patterns"),
+    ("Compare the works of Christie", [BROWN_SUIT, LINKS], "Compare the works"),
+    ("patterns in the Sign of the Four", [SIGN_OF_FOUR], "patterns"),
+    ("patterns in the Murder on the Links", [LINKS], "patterns"),
+    (
+        "patterns by Doyle and Christie",
+        [BROWN_SUIT, LINKS, SIGN_OF_FOUR],
+        "patterns and",
+    ),
+    # no reference, all the books
+    (
+        "When is Poirot first mentioned?",
+        [BROWN_SUIT, LINKS, SIGN_OF_FOUR],
+        "When is Poirot first mentioned?",
+    ),
+]
+
+
+@pytest.mark.parametrize("msg,book_ids,rest", CASES)
+def test_find_books(msg, book_ids, rest):
+    bot = helpers.load_bot(*helpers.BOOKS)
+    assert bot.store.book_names == [
+        "the_man_the_brown_suit",
+        "the_murder_on_the_links",
+        "the_sign_of_the_four",
+    ]
+    assert bot.find_books(msg) == (book_ids, rest)
@@ -0,0 +1,12 @@
+"""
+Worst-case latency of routing the messages, with the fuzzing harness (see `lib/chat/fuzz.py`).
+"""
+from lib.chat import fuzz
+from tests import helpers
+
+
+def test_no_superlinear_intent():
+    bot = helpers.load_bot(*helpers.BOOKS)
+    results = fuzz.fuzz_intents(bot, fuzz.SIZES)
+    assert len(results) > 1
+    assert [res["name"] for res in results if res["superlinear"]] == []
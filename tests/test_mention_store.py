@@ -0,0 +1,61 @@
+"""
+Tests of the accessors of the mention store.
+"""
+import pytest
+
+from lib import dataset, mention_store, search_terms
+from lib.chat.ChatBot import parse_chapter, read_chapters
+from tests import helpers
+
+
+def test_accessors():
+    store = mention_store.MentionStore()
+    assert store.add_book("book", "The Book", "An Author") == 0
+    assert store.add_chapter("Chapter I") == 1
+    store.add_sentence("Holmes sat down.", 1)
+    sentence_id = store.add_sentence("Watson stood up, then Holmes.", 2)
+    assert store.add_mention(sentence_id, 0, 6) == 0
+    assert store.add_mention(sentence_id, 22, 28) == 1
+    assert store.add_book("other", "Another Book", "") == 1
+    assert store.add_chapter("Chapter I") == 2
+    sentence_id = store.add_sentence("Poirot é.", 1)
+    assert store.add_mention(sentence_id, 0, 6) == 2
+
+    assert len(store) == 3
+    assert store.posting(0) == (1, 2, 0, 6)
+    assert store.posting(1) == (1, 2, 22, 28)
+    assert store.posting(2) == (2, 1, 0, 6)
+    assert store.sentence(1, 2) == "Watson stood up, then Holmes."
+    assert store.sentence(2, 1) == "Poirot é."
+    assert store.paragraph(1, 2) == 2
+    assert store.book_chapters(0) == range(1, 2)
+    assert store.book_sentences(1) == range(2, 3)
+    assert store.book_mentions(0) == range(0, 2)
+    assert store.book_mentions(1) == range(2, 3)
+
+
+@pytest.mark.parametrize("path", helpers.BOOKS, ids=helpers.book_name)
+def test_book(path):
+    # the mentions as they were parsed, in the order they were added to the store
+    bot = helpers.load_bot(path)
+    query_terms = search_terms.get_book_query_terms(search_terms.get_book_name(path))
+    chapters = dataset.preprocess_lines(dataset.read_lines(path), None, query_terms)
+
+    mention_id = 0
+    for chapter_idx, chapter in enumerate(read_chapters(chapters, query_terms), 1):
+        chapter_title, sentences = parse_chapter(chapter, bot.words_around)
+        assert bot.store.chapter_titles[chapter_idx - 1] == chapter_title
+        for sentence_idx, (sentence, paragraph_idx, mentions) in enumerate(
+            sentences, 1
+        ):
+            assert bot.store.sentence(chapter_idx, sentence_idx) == sentence
+            assert bot.store.paragraph(chapter_idx, sentence_idx) == paragraph_idx
+            for tag, matched_term, start, end, _ in mentions:
+                posting = (chapter_idx, sentence_idx, start, end)
+                assert bot.store.posting(mention_id) == posting
+                assert bot.get_mention(posting)["matched_term"] == matched_term
+                assert mention_id in bot.index.get_ids(tag)
+                assert matched_term in bot.index.terms(tag)
+                mention_id += 1
+
+    assert mention_id == len(bot.store)
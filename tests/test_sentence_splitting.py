@@ -0,0 +1,81 @@
+"""
+Regression tests of the sentence segmenter. The random strings are checked against
+`RegexPatterns.SENTENCE_SPLITTING`, the reference definition of where the sentences end,
+and the books against the golden outputs (see `tests/helpers.py`).
+"""
+import random
+import re
+
+import pytest
+
+from lib import dataset, preprocessing
+from lib.special_tokens import SpecialTokens
+from tests import helpers
+
+# punctuation, quotes, whitespace, initials and abbreviations (with and without inner dots)
+TOKENS = ["a", "B", "Z", "_", "1", "é", ".", "!", "?", ":", ",", '"', "'", " ", "\n"]
+TOKENS += ["\t", "Mr", "Mrs", "Col", "Sgt", "Co", "U", "e.g", "ab"]
+
+EDGE_CASES = [
+    # titles and initials don't end a sentence
+    ("Mr. Holmes came. He sat.", [16]),
+    ("The U. S. A. is far. Yes.", [20]),
+    ("See e.g. this. Done!", [14]),
+    ("It's 5 a.m. now. Go?\nNext.", [16, 20]),
+    # the closing quotes stay with their sentence
+    ('He said, "No." Then left.', [14]),
+    ('"Yes," she said. "No!" he cried.', [16, 22]),
+    ('Col. Sholto left: "Bye."\nEnd', [17, 24]),
+    ("Why? Because.", [4]),
+]
+
+
+def chapters(path: str):
+    # the chapters as they are split into sentences by the preprocessing
+    for chapter in dataset.add_chapter_delimiter(dataset.read_lines(path)):
+        yield preprocessing.normalize_character_set(
+            preprocessing.join_paragraph_lines(chapter)
+        )
+
+
+def book_digests(path: str) -> dict[str, str]:
+    return {
+        "ends": helpers.digest(
+            map(str, dataset.find_sentence_ends(helpers.read_book(path)))
+        ),
+        "chapters": helpers.digest(map(dataset.add_sentence_delimiter, chapters(path))),
+    }
+
+
+def compute_golden() -> dict:
+    return {"books": {helpers.book_name(p): book_digests(p) for p in helpers.BOOKS}}
+
+
+@pytest.mark.parametrize("text,ends", EDGE_CASES)
+def test_edge_cases(text, ends):
+    assert list(dataset.find_sentence_ends(text)) == ends
+    assert (
+        dataset.add_sentence_delimiter(text)
+        == "".join(
+            text[start:end] + SpecialTokens.END_OF_SENTENCE + "\n"
+            for start, end in zip([0] + [e + 1 for e in ends], ends)
+        )
+        + text[ends[-1] + 1 :]
+    )
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_random_strings(seed):
+    pattern = re.compile(dataset.RegexPatterns.SENTENCE_SPLITTING.value)
+    rng = random.Random(seed)
+    for _ in range(20000):
+        text = "".join(rng.choice(TOKENS) for _ in range(rng.randint(0, 12)))
+        assert dataset.add_sentence_delimiter(text) == pattern.sub(
+            SpecialTokens.END_OF_SENTENCE + "\n", text
+        ), text
+
+
+@pytest.mark.parametrize("path", helpers.BOOKS, ids=helpers.book_name)
+def test_books(path):
+    expected = helpers.golden("sentence_splitting", compute_golden)["books"]
+    assert book_digests(path) == expected[helpers.book_name(path)]
@@ -0,0 +1,103 @@
+"""
+Regression tests of the stopword filter (a frozenset lookup over a tokenizer), against
+the outputs of the alternation of all the stopwords it replaced (see `tests/helpers.py`
+for the golden outputs).
+"""
+import random
+
+import pytest
+
+from lib import preprocessing
+from lib.chat import example_prompts
+from tests import helpers
+
+# case variants, letters `re` folds differently from `str.lower` (the Kelvin sign,
+# the long s, the dotted I, ligatures), apostrophes, underscores and brackets
+WORDS = ["the", "The", "THE", "a", "İt", "ſhe", "K", "don't", "o'clock"]
+WORDS += [
+    "[the]",
+    "abc[the]",
+    "x_y",
+    "café",
+    "über",
+    "ʼn",
+    "_",
+    "t",
+    "s",
+    "--",
+    "[",
+    "]",
+]
+WORDS += ["i", "I", "Holmes", "me", "ß", "ﬀ", "oﬀ"]
+SEPARATORS = ["", " ", ",", "'", "[", "  ", "\n"]
+
+EDGE_CASES = [
+    ("The cat and the hat", " cat   hat", ["cat", "hat"]),
+    ("THE END", " END", ["END"]),
+    # the Kelvin sign isn't a stopword, but it is dropped with the punctuation
+    ("K is not k", "K   k", ["k"]),
+    # `re` matches the long s and the dotted I as "s" and "i" regardless of case
+    ("ſhe said", " said", ["said"]),
+    ("İt was", " ", []),
+    ("don't stop", "' stop", ["stop"]),
+    ("o'clock", "o'clock", ["o", "clock"]),
+    ("abc[the] x_y", "abc[] x_y", ["abc[", "x", "y"]),
+    ("café über the ß", "café über  ß", ["caf", "ber"]),
+    ("ﬀ oﬀ the", "ﬀ oﬀ ", ["o"]),
+]
+
+
+def random_texts(seed: int, count: int = 5000):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield "".join(
+            rng.choice(WORDS) + rng.choice(SEPARATORS)
+            for _ in range(rng.randint(1, 10))
+        )
+
+
+def digests(texts) -> dict[str, str]:
+    texts = list(texts)
+    return {
+        "stopwords": helpers.digest(map(preprocessing.remove_stopwords, texts)),
+        "content_words": helpers.digest(
+            " ".join(preprocessing.iter_content_words(text)) for text in texts
+        ),
+    }
+
+
+def compute_golden() -> dict:
+    return {
+        "random": [digests(random_texts(seed)) for seed in range(4)],
+        "example_prompts": digests(example_prompts.samples),
+        "books": {
+            helpers.book_name(p): digests(helpers.read_book(p).splitlines())
+            for p in helpers.BOOKS
+        },
+    }
+
+
+@pytest.mark.parametrize("text,expected,content_words", EDGE_CASES)
+def test_edge_cases(text, expected, content_words):
+    assert preprocessing.remove_stopwords(text) == expected
+    assert list(preprocessing.iter_content_words(text)) == content_words
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_random_strings(seed):
+    expected = helpers.golden("stopwords", compute_golden)["random"]
+    assert digests(random_texts(seed)) == expected[seed]
+
+
+def test_example_prompts():
+    expected = helpers.golden("stopwords", compute_golden)["example_prompts"]
+    assert digests(example_prompts.samples) == expected
+
+
+@pytest.mark.parametrize("path", helpers.BOOKS, ids=helpers.book_name)
+def test_books(path):
+    expected = helpers.golden("stopwords", compute_golden)["books"]
+    assert (
+        digests(helpers.read_book(path).splitlines())
+        == expected[helpers.book_name(path)]
+    )
@@ -0,0 +1,77 @@
+"""
+Regression tests of the single-pass whitespace normalization, against the outputs of
+the chain of regexes it replaced (see `tests/helpers.py` for the golden outputs).
+"""
+import random
+
+import pytest
+
+from lib import preprocessing
+from tests import helpers
+
+# `\r` and the other line boundaries of `str.splitlines` are where the two differed the most
+ALPHABET = ["a", "b", ".", " ", " ", "\t", "\n", "\n", "\r", "\x0b", "\x0c", "\x85"]
+ALPHABET += [" ", " ", "\x1c"]
+LIMITS = [(1, 3), (1, 1), (2, 3), (3, 2), (1, 2)]
+
+EDGE_CASES = [
+    # a lone `\r` doesn't end a line, the spaces around it are kept
+    ("a \r b", 1, 3, "a \r b"),
+    ("a  \r\n  b", 1, 3, "a \r\nb"),
+    (" \x85 a", 1, 3, "a"),
+    ("a\r\r\rb", 1, 3, "a\n\n\nb"),
+    ("a\n\n\n\n\nb", 1, 3, "a\n\n\nb"),
+    ("a \t  b", 2, 3, "a  b"),
+    ("  a  \n  b  ", 1, 3, "a\nb"),
+    ("a\x0b\x0cb", 1, 1, "a b"),
+    ("a \n\r \nb", 1, 2, "a\n\n\nb"),
+]
+
+
+def random_texts(count: int = 300) -> list[str]:
+    rng = random.Random(0)
+    return [
+        "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 25)))
+        for _ in range(count)
+    ]
+
+
+def book_digests(path: str) -> dict[str, str]:
+    text = helpers.read_book(path)
+    return {
+        "text": helpers.digest([preprocessing.remove_extra_whitespace(text)]),
+        "lines": helpers.digest(
+            preprocessing.remove_extra_whitespace_lines(text.split("\n"))
+        ),
+    }
+
+
+def compute_golden() -> dict:
+    return {
+        "random": [
+            [preprocessing.remove_extra_whitespace(text, *limits) for limits in LIMITS]
+            for text in random_texts()
+        ],
+        "books": {helpers.book_name(p): book_digests(p) for p in helpers.BOOKS},
+    }
+
+
+@pytest.mark.parametrize("text,spaces,newlines,expected", EDGE_CASES)
+def test_edge_cases(text, spaces, newlines, expected):
+    assert preprocessing.remove_extra_whitespace(text, spaces, newlines) == expected
+
+
+def test_random_strings():
+    expected = helpers.golden("whitespace", compute_golden)["random"]
+    for text, outputs in zip(random_texts(), expected, strict=True):
+        for limits, output in zip(LIMITS, outputs, strict=True):
+            assert preprocessing.remove_extra_whitespace(text, *limits) == output, (
+                text,
+                limits,
+            )
+
+
+@pytest.mark.parametrize("path", helpers.BOOKS, ids=helpers.book_name)
+def test_books(path):
+    expected = helpers.golden("whitespace", compute_golden)["books"]
+    assert book_digests(path) == expected[helpers.book_name(path)]